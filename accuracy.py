@@ -0,0 +1,79 @@
+'''
+Accuracy checks for the approximate and ideal filtering models.
+
+estimate_location gives the HRTF index estimated from a count of the model
+(the index with the most spikes over all channels, as shown by
+ircam_plot_count), and location_error the angle between two HRTF locations.
+
+compare_dtypes checks that running a model in single precision (dtype=float32)
+gives the same location estimates as double precision. The same model is
+built for each dtype, and each sound is presented at each HRTF index with the
+same random seed for every dtype, so the neuron noise is the same and only
+the precision of the computations differs. Run this file to do the check on
+a random set of indices of one subject.
+
+Only numpy is imported here, so that estimates can be computed from saved
+counts without importing Brian.
+'''
+from numpy import *
+from numpy.random import seed
+
+__all__ = ['estimate_location', 'location_error', 'compare_dtypes']
+
+def estimate_location(count):
+    '''
+    Returns the HRTF index with the largest total count, for a count of shape
+    (cfN, num_indices).
+    '''
+    return argmax(sum(asarray(count), axis=0))
+
+def location_error(hrtfset, i, j):
+    '''
+    Returns the angle in degrees between the locations of HRTF indices i and
+    j (which can be arrays).
+    '''
+    azim = hrtfset.coordinates['azim']*pi/180
+    elev = hrtfset.coordinates['elev']*pi/180
+    c = (sin(elev[i])*sin(elev[j])+
+         cos(elev[i])*cos(elev[j])*cos(azim[i]-azim[j]))
+    return arccos(clip(c, -1, 1))*180/pi
+
+def compare_dtypes(modelclass, hrtfset, cfmin, cfmax, cfN, indices, sound,
+                   dtypes=(float64, float32), baseseed=0, **modelkwds):
+    '''
+    Runs modelclass (ApproximateFilteringModel or IdealFilteringModel),
+    constructed with each of the dtypes, on the mono sound at each of the HRTF
+    indices. Returns an array of shape (len(dtypes), len(indices)) of the
+    estimated indices. Other keywords are passed to the model.
+    '''
+    estimates = zeros((len(dtypes), len(indices)), dtype=int)
+    for d, dtype in enumerate(dtypes):
+        model = modelclass(hrtfset, cfmin, cfmax, cfN, dtype=dtype, **modelkwds)
+        for k, index in enumerate(indices):
+            seed(baseseed+k)
+            estimates[d, k] = estimate_location(model(sound, index, report=None))
+        del model
+    return estimates
+
+if __name__=='__main__':
+
+    from shared import *
+    from approximate_filtering_model import ApproximateFilteringModel
+
+    hrtfdb = get_ircam()
+    subject = 1002
+    hrtfset = hrtfdb.load_subject(subject)
+    cfmin, cfmax, cfN = 150*Hz, 5*kHz, 80
+    indices = randint(hrtfset.num_indices, size=20)
+    sound = whitenoise(100*ms).atlevel(80*dB)
+
+    estimates = compare_dtypes(ApproximateFilteringModel, hrtfset,
+                               cfmin, cfmax, cfN, indices, sound,
+                               engine='numpy')
+
+    print('Same estimate in float32 and float64: %d/%d'%(
+                sum(estimates[0]==estimates[1]), len(indices)))
+    for d, name in enumerate(['float64', 'float32']):
+        error = location_error(hrtfset, indices, estimates[d])
+        print('%s: %d/%d correct, mean error %.1f degrees'%(
+                name, sum(estimates[d]==indices), len(indices), mean(error)))
@@ -1,6 +1,10 @@
 from shared import *
 from hrtf_analysis import *
 from models import *
+from numpy_engine import *
+from filterbanks import *
+from snapshot import *
+from model_pool import reset_model
 import gc
 
 class AllPairsModel(object):
@@ -10,55 +14,117 @@ class AllPairsModel(object):
     delay_N),
     and optionally:
     a model for the coincidence detector neurons (cd_model),
-    a model for the filter neurons (filtergroup_model).
+    a model for the filter neurons (filtergroup_model),
+    the simulation engine for the neurons, 'brian' or 'numpy' (engine, see
+    numpy_engine.py),
+    a margin in grid steps (band_margin, see below),
+    the floating point type of the filterbank output after the Gammatone
+    filters, and of the neuron state with the numpy engine (dtype, e.g.
+    float32),
+    a CochlearFrontEnd with the same cochlear range whose Gammatone filters
+    are used instead of the model's own, to run it with other models in a
+    MultiModelRunner (frontend, see frontend.py).
+    
+    By default there is a coincidence detector for every gain and delay in
+    every channel. If band_margin is specified, each channel only has those
+    within band_margin grid steps of the range of best gains and delays of
+    the hrtfset in that channel over all the HRTF indices (from
+    hrtfset_itd_ild), and only the filter neurons these need. The count is
+    returned in the same layout, with zeros for the missing neurons.
         
-    The __call__ method returns a count (see docstring of that method). 
+    The __call__ method returns a count (see docstring of that method). Use
+    the save method and the load class method to store a built model and
+    recreate it without the HRTF analysis.
     '''
     def __init__(self, hrtfset, cfmin, cfmax, cfN,
                  gain_max, gain_N, delay_max, delay_N,
                  cd_model=standard_cd_model,
                  filtergroup_model=standard_filtergroup_model,
+                 engine='brian', band_margin=None, dtype=float, frontend=None,
                  ):
         self.hrtfset = hrtfset
         self.cfmin, self.cfmax, self.cfN = cfmin, cfmax, cfN
         self.cd_model = cd_model
         self.filtergroup_model = filtergroup_model
+        if engine not in ('brian', 'numpy'):
+            raise ValueError("engine should be 'brian' or 'numpy'")
+        self.engine = engine
+        self.dtype = dtype
+        if frontend is not None:
+            frontend.check(cfmin, cfmax, cfN)
+        self.frontend = frontend
         self.gain_max = gain_max
         self.gain_N = gain_N
         self.delay_max = delay_max
         self.delay_N = delay_N
+        self.band_margin = band_margin
+        
+        self.num_indices = hrtfset.num_indices
+        
+        # the coincidence detectors used, indices into the full grid
+        # (channel, gain, delay), or None for all of them
+        if band_margin is None:
+            self.cd_indices = None
+        else:
+            self.cd_indices = flatnonzero(self._band_mask(band_margin))
         
-        self.num_indices = num_indices = hrtfset.num_indices
-        cf = erbspace(cfmin, cfmax, cfN)
+        self._build()
+        
+    def _build(self):
+        cfN, gain_max, gain_N = self.cfN, self.gain_max, self.gain_N
+        delay_max, delay_N = self.delay_max, self.delay_N
+        cd_model, filtergroup_model = self.cd_model, self.filtergroup_model
+        engine, dtype = self.engine, self.dtype
+        cf = erbspace(self.cfmin, self.cfmax, cfN)
                 
-        # dummy sound, when we run apply() we replace it
-        sound = Sound((silence(1*ms), silence(1*ms)))
-        soundinput = DoNothingFilterbank(sound)
+        if self.frontend is not None:
+            soundinput = self.frontend.soundinput
+        else:
+            # dummy sound, when we run apply() we replace it
+            sound = Sound((silence(1*ms), silence(1*ms)))
+            soundinput = DoNothingFilterbank(sound)
 
         # prepare gains filter
         m = (gain_N+1)/2
         gains_dB = linspace(0, gain_max, m)
         gains = 10**(gains_dB/20)
         gains = hstack((1/gains[::-1], gains[1:]))
-        allgains = reshape(gains, (1, 1, gains.size))
 
-        def apply_gains(y):
-            nsamples = y.shape[0]
-            cfN = y.shape[1]/2
-            y = reshape(y, (nsamples, 2*cfN, 1))            
-            y1 = y[:, :cfN, :]*allgains
-            y2 = y[:, cfN:, :]*allgains[:, :, ::-1]
-            y = hstack((y1, y2))
-            y = reshape(y, (nsamples, y.size/nsamples))
-            return y
+        # the (channel, gain) pairs the coincidence detectors need
+        j, pairs = self._cd_pairs()
         
-        gfb = Gammatone(Repeat(soundinput, cfN), hstack((cf, cf)))
-                
-        gains_fb = FunctionFilterbank(gfb, apply_gains)
-        gains_fb.nchannels = gfb.nchannels*gain_N
+        # the filter neurons are ordered L then R, by pair, each pair giving
+        # a channel c and gain index g, the right ear having the reversed gain
+        # of the left one
+        c = pairs//gain_N
+        g = pairs%gain_N
+        channels = hstack((c, c+cfN))
+        filtergains = hstack((gains[g], gains[::-1][g]))
         
-        compress = filtergroup_model['compress']
-        cochlea = FunctionFilterbank(gains_fb, lambda x:compress(clip(x, 0, Inf)))
+        if self.frontend is not None:
+            gfb = self.frontend.gammatone
+        else:
+            gfb = Gammatone(Repeat(soundinput, cfN), hstack((cf, cf)))
+        
+        cochlea = GainCompressFilterbank(gfb, filtergains,
+                                         filtergroup_model['compress'],
+                                         indices=channels, dtype=dtype)
+        
+        # the synaptic connectivity
+        pre_L, pre_R, delays_L, delays_R = self._connectivity()
+        post = arange(len(j))
+
+        self.soundinput = soundinput
+        self.cochlea = cochlea
+        if engine=='numpy':
+            self.network = NumpyNetwork(cochlea, filtergroup_model, cd_model,
+                                        pre_L, pre_R, delays_L, delays_R,
+                                        dtype=dtype)
+            self.filtergroup = self.network.filtergroup
+            self.synchronygroup = self.network.synchronygroup
+            self.synapses = None
+            self.counter = self.network.counter
+            return
         
         # Create the filterbank group
         eqs = Equations(filtergroup_model['eqs'], **filtergroup_model['parameters'])
@@ -69,42 +135,124 @@ class AllPairsModel(object):
         
         # create the synchrony group
         cd_eqs = Equations(cd_model['eqs'], **cd_model['parameters'])
-        cd = NeuronGroup(cfN*gain_N*(delay_N*2-1), cd_eqs,
+        cd = NeuronGroup(len(j), cd_eqs,
                          threshold=cd_model['threshold'],
                          reset=cd_model['reset'],
                          refractory=cd_model['refractory'],
                          clock=G.clock)
         
         # set up the synaptic connectivity
-        left_delays = hstack((zeros(delay_N-1), linspace(0, float(delay_max), delay_N)))
-        right_delays = left_delays[::-1]
         cd_weight = cd_model['weight']
-        C = Connection(G, cd, 'target_var', delay=True, max_delay=delay_max)
-        for i, j, dl, dr in zip(repeat(arange(cfN*gain_N), 2*delay_N-1),
-                                arange(cfN*gain_N*(delay_N*2-1)),
-                                tile(left_delays, cfN*gain_N),
-                                tile(right_delays, cfN*gain_N)):
-            C[i, j] = cd_weight
-            C[i+cfN*gain_N, j] = cd_weight
-            C.delay[i, j] = dl
-            C.delay[i+cfN*gain_N, j] = dr
+        C = makeconnection(G, cd, hstack((pre_L, pre_R)), hstack((post, post)),
+                           cd_weight, delay=hstack((delays_L, delays_R)),
+                           max_delay=delay_max)
 
-        self.soundinput = soundinput
         self.filtergroup = G
         self.synchronygroup = cd
         self.synapses = C
         self.counter = SpikeCounter(cd)
         self.network = Network(G, cd, C, self.counter)
         
-    def __call__(self, sound, index=None, **indexkwds):
+    def save(self, path):
         '''
-        Apply all pairs filtering group to given sound, which should be a
-        stereo sound unless you specify the HRTF index, or coordinates of
-        the HRTF index as keyword arguments, in which case it should be a mono
-        sound which will have the given HRTF applied to it. You can also
-        specify index=hrtf. Returns the count of the neurons in the synchrony
-        group with shape (cfN, gain_N, delay_N*2-1).
+        Saves the coincidence detectors used by the model and its parameters
+        to the file path (see snapshot.py).
+        '''
+        arrays = {}
+        if self.cd_indices is not None:
+            arrays['cd_indices'] = self.cd_indices
+        save_model(path, self,
+                   dict(cfmin=self.cfmin, cfmax=self.cfmax, cfN=self.cfN,
+                        gain_max=self.gain_max, gain_N=self.gain_N,
+                        delay_max=self.delay_max, delay_N=self.delay_N,
+                        band_margin=self.band_margin),
+                   arrays)
+
+    @classmethod
+    def load(cls, path, hrtfset, cd_model=standard_cd_model,
+             filtergroup_model=standard_filtergroup_model, engine='brian',
+             dtype=float, frontend=None):
         '''
+        Returns the model saved in the file path with the save method, for
+        the same hrtfset. The other arguments are as for the constructor.
+        '''
+        params, arrays = load_model(path, cls, hrtfset)
+        self = cls.__new__(cls)
+        self.hrtfset = hrtfset
+        self.cfmin, self.cfmax = params['cfmin']*Hz, params['cfmax']*Hz
+        self.cfN = int(params['cfN'])
+        self.cd_model = cd_model
+        self.filtergroup_model = filtergroup_model
+        if engine not in ('brian', 'numpy'):
+            raise ValueError("engine should be 'brian' or 'numpy'")
+        self.engine = engine
+        self.dtype = dtype
+        if frontend is not None:
+            frontend.check(self.cfmin, self.cfmax, self.cfN)
+        self.frontend = frontend
+        self.gain_max = params['gain_max']
+        self.gain_N = int(params['gain_N'])
+        self.delay_max = params['delay_max']*second
+        self.delay_N = int(params['delay_N'])
+        self.band_margin = params['band_margin']
+        self.num_indices = hrtfset.num_indices
+        self.cd_indices = arrays['cd_indices']
+        self._build()
+        return self
+
+    def _cd_pairs(self):
+        '''
+        Returns (j, pairs), the coincidence detectors used, as indices into
+        the full grid (channel, gain, delay), and the (channel, gain) pairs
+        they need, as indices into the grid (channel, gain).
+        '''
+        numdelays = self.delay_N*2-1
+        if self.cd_indices is None:
+            j = arange(self.cfN*self.gain_N*numdelays)
+        else:
+            j = self.cd_indices
+        return j, unique(j//numdelays)
+
+    def _connectivity(self):
+        '''
+        Returns (pre_L, pre_R, delays_L, delays_R), the filter neurons and
+        delays of the two inputs of each coincidence detector.
+        '''
+        delay_N = self.delay_N
+        numdelays = delay_N*2-1
+        j, pairs = self._cd_pairs()
+        left_delays = hstack((zeros(delay_N-1), linspace(0, float(self.delay_max), delay_N)))
+        right_delays = left_delays[::-1]
+        i = searchsorted(pairs, j//numdelays)
+        k = j%numdelays
+        return i, i+len(pairs), left_delays[k], right_delays[k]
+
+    def _band_mask(self, margin):
+        '''
+        Returns a boolean array of shape (cfN, gain_N, delay_N*2-1) of the
+        coincidence detectors within margin grid steps of the range of best
+        gains and delays in each channel.
+        '''
+        gain_N, delay_N = self.gain_N, self.delay_N
+        itd, ild = hrtfset_itd_ild(self.hrtfset, self.cfmin, self.cfmax, self.cfN)
+        itd = asarray(itd)
+        ild = asarray(ild)
+        # positions in the grid, as in the figure of __main__
+        arrgains = linspace(-self.gain_max, self.gain_max, gain_N)
+        gainindex = gain_N-1-digitize(20*log10(ild), 0.5*(arrgains[1:]+arrgains[:-1]))
+        delaystep = float(self.delay_max)/(delay_N-1)
+        delayindex = delay_N-1-array(rint(itd/delaystep), dtype=int)
+        gmin = amin(gainindex, axis=0)-margin
+        gmax = amax(gainindex, axis=0)+margin
+        dmin = amin(delayindex, axis=0)-margin
+        dmax = amax(delayindex, axis=0)+margin
+        g = arange(gain_N)
+        d = arange(delay_N*2-1)
+        gainmask = (g[newaxis, :]>=gmin[:, newaxis])&(g[newaxis, :]<=gmax[:, newaxis])
+        delaymask = (d[newaxis, :]>=dmin[:, newaxis])&(d[newaxis, :]<=dmax[:, newaxis])
+        return gainmask[:, :, newaxis]&delaymask[:, newaxis, :]
+        
+    def _prepare_sound(self, sound, index=None, **indexkwds):
         hrtf = None
         if index is not None:
             hrtf = self.hrtfset[index]
@@ -114,15 +262,35 @@ class AllPairsModel(object):
             hrtf = self.hrtfset(**indexkwds)
         if hrtf is not None:
             sound = hrtf(sound)
+        return sound
+
+    def __call__(self, sound, index=None, report='stderr', seed=None,
+                 **indexkwds):
+        '''
+        Apply all pairs filtering group to given sound, which should be a
+        stereo sound unless you specify the HRTF index, or coordinates of
+        the HRTF index as keyword arguments, in which case it should be a mono
+        sound which will have the given HRTF applied to it. You can also
+        specify index=hrtf. Returns the count of the neurons in the synchrony
+        group with shape (cfN, gain_N, delay_N*2-1).
+        
+        The progress is reported as for Network.run, use report=None to
+        silence it. With a seed, the random initial state and noise are drawn
+        from a generator seeded with it (see model_pool.reset_model).
+        '''
+        sound = self._prepare_sound(sound, index, **indexkwds)
         self.soundinput.source = sound
-        self.network.reinit()
-        self.filtergroup_model['init'](self.filtergroup,
-                                       self.filtergroup_model['parameters'])
-        self.cd_model['init'](self.synchronygroup, self.cd_model['parameters'])
-        self.network.run(sound.duration, report='stderr')
-        count = reshape(self.counter.count,
-                        (self.cfN, self.gain_N, self.delay_N*2-1))
-        return count
+        reset_model(self, seed)
+        self.network.run(sound.duration, report=report)
+        return self._format_count(self.counter.count)
+
+    def _format_count(self, count):
+        shape = (self.cfN, self.gain_N, self.delay_N*2-1)
+        if self.cd_indices is not None:
+            fullcount = zeros(shape[0]*shape[1]*shape[2], dtype=asarray(count).dtype)
+            fullcount[self.cd_indices] = count
+            count = fullcount
+        return reshape(count, shape)
 
 if __name__=='__main__':
     
@@ -0,0 +1,51 @@
+'''
+The cache of the HRTF analysis of hrtf_analysis.py, with functions to read
+it without importing Brian.
+
+Results are cached in data/cache, keyed by a hash of the HRIRs, samplerates,
+cochlear range and the version number of the code that computes them.
+Increment the version numbers when changing the computations. The keys only
+use the data and samplerate of the hrtfset (and numbers, with quantities in
+SI units), so cached_itd_ild and cached_attenuations can look up entries
+for any object with these attributes.
+'''
+import os
+import numpy
+from cache import cache_key, CacheStore
+from settings import datapath, samplerate_hz
+
+__all__ = ['hrtf_cache', 'itd_ild_key', 'attenuations_key', 'cached_itd_ild',
+           'cached_attenuations']
+
+hrtf_cache = CacheStore(os.path.join(datapath, 'cache'))
+itd_ild_version = 1
+attenuations_version = 2
+
+def itd_ild_key(hrtfset, cfmin, cfmax, cfN):
+    return cache_key(itd_ild_version, hrtfset.data, hrtfset.samplerate,
+                     cfmin, cfmax, cfN)
+
+def attenuations_key(hrtfset, cfmin, cfmax, cfN, dtype=float):
+    return cache_key(attenuations_version, hrtfset.data, hrtfset.samplerate,
+                     samplerate_hz, cfmin, cfmax, cfN, numpy.dtype(dtype).str)
+
+def cached_itd_ild(hrtfset, cfmin, cfmax, cfN):
+    '''
+    Returns (all_itds, all_ilds) as for hrtfset_itd_ild if they are in the
+    cache, otherwise None.
+    '''
+    arrays = hrtf_cache.get('itdild', itd_ild_key(hrtfset, cfmin, cfmax, cfN))
+    if arrays is None:
+        return None
+    return arrays['itds'], arrays['ilds']
+
+def cached_attenuations(cfmin, cfmax, cfN, hrtfset, dtype=float):
+    '''
+    Returns the attenuations as for hrtfset_attenuations if they are in the
+    cache, otherwise None.
+    '''
+    arrays = hrtf_cache.get('hrtf_attenuation',
+                            attenuations_key(hrtfset, cfmin, cfmax, cfN, dtype))
+    if arrays is None:
+        return None
+    return arrays['y']
@@ -1,6 +1,11 @@
 from shared import *
 from hrtf_analysis import *
 from models import *
+from numpy_engine import *
+from filterbanks import *
+from snapshot import *
+from model_pool import reset_model
+from decision import *
 import gc
 
 class ApproximateFilteringModel(object):
@@ -13,20 +18,38 @@ class ApproximateFilteringModel(object):
     whether or not to use the best gains (use_gains),
     whether or not to use only the phase information (delays between -pi and pi),
     an alternative set of itd/ild pairs (itdild, see the file hrtf_analysis.py
-    for more information on this, function hrtfset_itd_ild).
+    for more information on this, function hrtfset_itd_ild),
+    the simulation engine for the neurons, 'brian' or 'numpy' (engine, see
+    numpy_engine.py),
+    the floating point type of the filterbank output after the Gammatone
+    filters, and of the neuron state with the numpy engine (dtype, e.g.
+    float32, see accuracy.py for a check of the location estimates),
+    a CochlearFrontEnd with the same cochlear range whose Gammatone filters
+    are used instead of the model's own, to run it with other models in a
+    MultiModelRunner (frontend, see frontend.py).
     
-    The __call__ method returns a count (see docstring of that method). 
+    The __call__ method returns a count (see docstring of that method), and
+    the estimate method the estimated location, stopping the simulation early
+    once it is decisive. Use the save method and the load class method to
+    store a built model and recreate it without the HRTF analysis.
     '''
     def __init__(self, hrtfset, cfmin, cfmax, cfN,
                  cd_model=standard_cd_model,
                  filtergroup_model=standard_filtergroup_model,
                  use_delays=True, use_gains=True, use_only_phase=False,
-                 itdild=None,
+                 itdild=None, engine='brian', dtype=float, frontend=None,
                  ):
         self.hrtfset = hrtfset
         self.cfmin, self.cfmax, self.cfN = cfmin, cfmax, cfN
         self.cd_model = cd_model
         self.filtergroup_model = filtergroup_model
+        if engine not in ('brian', 'numpy'):
+            raise ValueError("engine should be 'brian' or 'numpy'")
+        self.engine = engine
+        self.dtype = dtype
+        if frontend is not None:
+            frontend.check(cfmin, cfmax, cfN)
+        self.frontend = frontend
         
         self.num_indices = num_indices = hrtfset.num_indices
         cf = erbspace(cfmin, cfmax, cfN)
@@ -56,24 +79,103 @@ class ApproximateFilteringModel(object):
         delay_max = max(amax(delays_L), amax(delays_R))*second
 
         if not use_gains:
-            gains = ones(len(gains))
+            gains = ones(gains.shape)
 
         if not use_delays:
             delays_L = delays_R = zeros(len(d))
             delay_max = 2/samplerate
         
-        # dummy sound, when we run apply() we replace it
-        sound = Sound((silence(1*ms), silence(1*ms)))
-        soundinput = DoNothingFilterbank(sound)
-        
-        gfb = Gammatone(Repeat(soundinput, cfN), hstack((cf, cf)))
-        
-        gains_fb = FunctionFilterbank(Repeat(gfb, num_indices),
-                                      lambda x:x*gains)
+        self.gains = gains
+        self.delays_L, self.delays_R = delays_L, delays_R
+        self.delay_max = delay_max
+
+        self._build()
+
+    def _build(self):
+        (self.soundinput, self.cochlea, self.filtergroup, self.synchronygroup,
+         self.synapses, self.counter, self.network) = self._build_network(1)
+        self._batch_network = None
+
+    def save(self, path):
+        '''
+        Saves the gains and delays of the model and its parameters to the
+        file path (see snapshot.py).
+        '''
+        save_model(path, self,
+                   dict(cfmin=self.cfmin, cfmax=self.cfmax, cfN=self.cfN,
+                        delay_max=self.delay_max),
+                   dict(gains=self.gains, delays_L=self.delays_L,
+                        delays_R=self.delays_R))
+
+    @classmethod
+    def load(cls, path, hrtfset, cd_model=standard_cd_model,
+             filtergroup_model=standard_filtergroup_model, engine='brian',
+             dtype=float, frontend=None):
+        '''
+        Returns the model saved in the file path with the save method, for
+        the same hrtfset. The other arguments are as for the constructor.
+        '''
+        params, arrays = load_model(path, cls, hrtfset)
+        self = cls.__new__(cls)
+        self.hrtfset = hrtfset
+        self.cfmin, self.cfmax = params['cfmin']*Hz, params['cfmax']*Hz
+        self.cfN = int(params['cfN'])
+        self.cd_model = cd_model
+        self.filtergroup_model = filtergroup_model
+        if engine not in ('brian', 'numpy'):
+            raise ValueError("engine should be 'brian' or 'numpy'")
+        self.engine = engine
+        self.dtype = dtype
+        if frontend is not None:
+            frontend.check(self.cfmin, self.cfmax, self.cfN)
+        self.frontend = frontend
+        self.num_indices = hrtfset.num_indices
+        self.gains = arrays['gains']
+        self.delays_L, self.delays_R = arrays['delays_L'], arrays['delays_R']
+        self.delay_max = params['delay_max']*second
+        self._build()
+        return self
+
+    def _build_network(self, nstreams):
+        '''
+        Builds the filterbank, neuron groups and connections for nstreams
+        independent stereo inputs, stacked as channels LRLR... of the input
+        sound. Each stream gets its own copy of the filter and coincidence
+        detector neurons, in consecutive blocks. A single stream uses the
+        frontend if there is one.
+        '''
+        cfN, num_indices = self.cfN, self.num_indices
+        cd_model, filtergroup_model = self.cd_model, self.filtergroup_model
+        cf = erbspace(self.cfmin, self.cfmax, cfN)
+        dtype = self.dtype
+        gains = asarray(tile(self.gains, (1, nstreams)), dtype=dtype)
+
+        if nstreams==1 and self.frontend is not None:
+            soundinput = self.frontend.soundinput
+            gfb = self.frontend.gammatone
+        else:
+            # dummy sound, when we run apply() we replace it
+            sound = Sound(tuple(silence(1*ms) for _ in xrange(2*nstreams)))
+            soundinput = DoNothingFilterbank(sound)
+            gfb = Gammatone(Repeat(soundinput, cfN), tile(cf, 2*nstreams))
         
-        compress = filtergroup_model['compress']
-        cochlea = FunctionFilterbank(gains_fb, lambda x:compress(clip(x, 0, Inf)))
+        # each Gammatone channel repeated num_indices times, with gains,
+        # rectification and compression
+        cochlea = GainCompressFilterbank(gfb, gains, filtergroup_model['compress'],
+                                         indices=repeat(arange(gfb.nchannels), num_indices),
+                                         dtype=dtype)
         
+        # the synaptic connectivity
+        pre_L, pre_R, delays_L, delays_R = self._connectivity(nstreams)
+        post = arange(len(pre_L))
+
+        if self.engine=='numpy':
+            network = NumpyNetwork(cochlea, filtergroup_model, cd_model,
+                                   pre_L, pre_R, delays_L, delays_R,
+                                   dtype=dtype)
+            return (soundinput, cochlea, network.filtergroup,
+                    network.synchronygroup, None, network.counter, network)
+
         # Create the filterbank group
         eqs = Equations(filtergroup_model['eqs'], **filtergroup_model['parameters'])
         G = FilterbankGroup(cochlea, 'target_var', eqs,
@@ -83,7 +185,7 @@ class ApproximateFilteringModel(object):
         
         # create the synchrony group
         cd_eqs = Equations(cd_model['eqs'], **cd_model['parameters'])
-        cd = NeuronGroup(num_indices*cfN, cd_eqs,
+        cd = NeuronGroup(nstreams*num_indices*cfN, cd_eqs,
                          threshold=cd_model['threshold'],
                          reset=cd_model['reset'],
                          refractory=cd_model['refractory'],
@@ -91,29 +193,28 @@ class ApproximateFilteringModel(object):
         
         # set up the synaptic connectivity
         cd_weight = cd_model['weight']
-        C = Connection(G, cd, 'target_var', delay=True, max_delay=delay_max)
-        for i in xrange(num_indices*cfN):
-            C[i, i] = cd_weight
-            C[i+num_indices*cfN, i] = cd_weight
-            C.delay[i, i] = delays_L[i]
-            C.delay[i+cfN*num_indices, i] = delays_R[i]
-
-        self.soundinput = soundinput
-        self.filtergroup = G
-        self.synchronygroup = cd
-        self.synapses = C
-        self.counter = SpikeCounter(cd)
-        self.network = Network(G, cd, C, self.counter)
+        C = makeconnection(G, cd, hstack((pre_L, pre_R)), hstack((post, post)),
+                           cd_weight, delay=hstack((delays_L, delays_R)),
+                           max_delay=self.delay_max)
+
+        counter = SpikeCounter(cd)
+        network = Network(G, cd, C, counter)
+        return soundinput, cochlea, G, cd, C, counter, network
         
-    def __call__(self, sound, index=None, **indexkwds):
+    def _connectivity(self, nstreams=1):
         '''
-        Apply approximate filtering group to given sound, which should be a
-        stereo sound unless you specify the HRTF index, or coordinates of
-        the HRTF index as keyword arguments, in which case it should be a mono
-        sound which will have the given HRTF applied to it. You can also
-        specify index=hrtf. Returns the spike count of the neurons in the synchrony
-        group with shape (cfN, num_indices).
+        Returns (pre_L, pre_R, delays_L, delays_R), the filter neurons and
+        delays of the two inputs of each coincidence detector, for nstreams
+        streams.
         '''
+        num_indices, cfN = self.num_indices, self.cfN
+        post = arange(nstreams*num_indices*cfN)
+        pre_L = post+(post//(num_indices*cfN))*num_indices*cfN
+        pre_R = pre_L+num_indices*cfN
+        return (pre_L, pre_R, tile(self.delays_L, nstreams),
+                tile(self.delays_R, nstreams))
+
+    def _prepare_sound(self, sound, index=None, **indexkwds):
         hrtf = None
         if index is not None:
             hrtf = self.hrtfset[index]
@@ -123,13 +224,78 @@ class ApproximateFilteringModel(object):
             hrtf = self.hrtfset(**indexkwds)
         if hrtf is not None:
             sound = hrtf(sound)
+        return sound
+
+    def __call__(self, sound, index=None, report='stderr', seed=None,
+                 **indexkwds):
+        '''
+        Apply approximate filtering group to given sound, which should be a
+        stereo sound unless you specify the HRTF index, or coordinates of
+        the HRTF index as keyword arguments, in which case it should be a mono
+        sound which will have the given HRTF applied to it. You can also
+        specify index=hrtf. Returns the spike count of the neurons in the synchrony
+        group with shape (cfN, num_indices).
+        
+        The progress is reported as for Network.run, use report=None to
+        silence it. With a seed, the random initial state and noise are drawn
+        from a generator seeded with it (see model_pool.reset_model).
+        '''
+        sound = self._prepare_sound(sound, index, **indexkwds)
         self.soundinput.source = sound
-        self.network.reinit()
-        self.filtergroup_model['init'](self.filtergroup,
-                                       self.filtergroup_model['parameters'])
-        self.cd_model['init'](self.synchronygroup, self.cd_model['parameters'])
-        self.network.run(sound.duration, report='stderr')
-        count = reshape(self.counter.count, (self.cfN, self.num_indices))
+        reset_model(self, seed)
+        self.network.run(sound.duration, report=report)
+        return self._format_count(self.counter.count)
+
+    def estimate(self, sound, index=None, confidence=0.99, segment=10*ms,
+                 min_duration=0*ms, seed=None, **indexkwds):
+        '''
+        Estimates the location of the sound (given as for __call__), stopping
+        the simulation as soon as the leading location is decisively ahead.
+        Returns (index, confidence, duration), see early_estimate in
+        decision.py.
+        '''
+        return early_estimate(self, sound, index, confidence=confidence,
+                              segment=segment, min_duration=min_duration,
+                              seed=seed, **indexkwds)
+
+    def _format_count(self, count):
+        return reshape(count, (self.cfN, self.num_indices))
+
+    def run_batch(self, sounds, indices=None, report=None, seed=None):
+        '''
+        Apply the model to N sounds in a single simulation. The sounds should
+        all have the same duration, and indices (if given) should be a
+        sequence of N HRTF indices (or HRTF objects, or None for a stereo
+        sound) as for the __call__ method. The network for N streams is built
+        on the first call and reused for subsequent calls with the same N.
+        Returns the spike counts with shape (N, cfN, num_indices). The
+        progress is reported as for Network.run, by default not at all, and
+        the seed is used as in the __call__ method.
+        '''
+        N = len(sounds)
+        if indices is None:
+            indices = [None]*N
+        if len(indices)!=N:
+            raise ValueError('Need one index per sound.')
+        sounds = [self._prepare_sound(sound, index)
+                  for sound, index in zip(sounds, indices)]
+        nsamples = sounds[0].nsamples
+        for sound in sounds:
+            if sound.nchannels!=2:
+                raise ValueError('Sounds should be stereo or have an HRTF index.')
+            if sound.nsamples!=nsamples:
+                raise ValueError('All sounds should have the same duration.')
+        if self._batch_network is None or self._batch_network[0]!=N:
+            # release the previous batch network before building a new one
+            self._batch_network = None
+            gc.collect()
+            self._batch_network = (N,)+self._build_network(N)
+        _, soundinput, _, G, cd, C, counter, network = self._batch_network
+        soundinput.source = Sound(hstack([asarray(sound) for sound in sounds]),
+                                  samplerate=sounds[0].samplerate)
+        reset_model(self, seed, network, G, cd)
+        network.run(sounds[0].duration, report=report)
+        count = reshape(counter.count, (N, self.cfN, self.num_indices))
         return count
 
 if __name__=='__main__':
@@ -0,0 +1,240 @@
+'''
+Benchmarks of the construction time, simulation speed, memory use and
+accuracy of the three models.
+
+Each configuration (a dict, see default_config) is run in a fresh worker
+process, so that the peak resident memory reported is that of this
+configuration alone. The HRTFs are those of a spherical head at num_indices
+locations on the horizontal plane (see synthetic_hrtf.py), so the benchmarks
+run without the IRCAM database. For each configuration the following are
+measured:
+
+``analysis_time``
+    Time to compute (or load from the cache) the HRTF analysis.
+``construction_time``
+    Time to construct the model, with the analysis already done.
+``run_time``
+    The mean time to run the model on one sound.
+``throughput``
+    Seconds of audio per second of wall time.
+``peak_rss``
+    The peak resident memory of the worker process, in bytes.
+``accuracy``
+    The fraction of the sounds whose location is estimated correctly (see
+    accuracy.py), for the approximate and ideal models.
+
+The ideal model is also run with shared_gammatone=True (a single Gammatone
+filterbank followed by the HRTFs, see ideal_filtering_model.py), with the
+same numbers of channels and locations as the default ideal configurations,
+to compare the two.
+
+run_benchmarks writes the results as JSON, with some information about the
+machine and the import times of the modules (see import_times), for
+comparison between versions. Run this file to benchmark a grid of
+configurations, with an optional argument giving the output file.
+'''
+from shared import *
+from sweep import model_class, precompute_caches
+from synthetic_hrtf import spherical_head_hrtfset, horizontal_coordinates
+import multiprocessing, json, platform, resource, gc, subprocess
+
+__all__ = ['default_config', 'benchmark_config',
+           'run_benchmarks', 'default_configs', 'import_times',
+           'light_modules', 'model_modules']
+
+default_config = {
+    'model':'approximate',
+    'cfmin':150., 'cfmax':5000., 'cfN':40,
+    'num_indices':24,
+    'gain_max':8., 'gain_N':21, 'delay_N':21,
+    'duration':0.1,
+    'num_sounds':4,
+    'engine':'brian',
+    'shared_gammatone':False,
+    }
+
+def _peak_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in kilobytes on Linux, bytes on OS X
+    if sys.platform!='darwin':
+        rss *= 1024
+    return int(rss)
+
+def benchmark_config(config):
+    '''
+    Runs the benchmark for the configuration (a dict, missing values are
+    taken from default_config) in the current process, and returns a dict of
+    the configuration and the results.
+    '''
+    from accuracy import estimate_location
+    config = dict(default_config, **config)
+    model = config['model']
+    hrtfset = spherical_head_hrtfset(horizontal_coordinates(config['num_indices']),
+                                     hrir_length=256)
+    modelargs = (config['cfmin']*Hz, config['cfmax']*Hz, config['cfN'])
+    if model=='allpairs':
+        delay_N = config['delay_N']
+        modelargs += (config['gain_max'], config['gain_N'],
+                      delay_N/samplerate, delay_N)
+    start = time.time()
+    precompute_caches(model, hrtfset, modelargs)
+    analysis_time = time.time()-start
+    start = time.time()
+    modelkwds = {'engine':config['engine']}
+    if config['shared_gammatone']:
+        if model!='ideal':
+            raise ValueError('shared_gammatone is only for the ideal model.')
+        modelkwds['shared_gammatone'] = True
+    instance = model_class(model)(hrtfset, *modelargs, **modelkwds)
+    construction_time = time.time()-start
+    sound = whitenoise(config['duration']*second)
+    num_sounds = config['num_sounds']
+    indices = (arange(num_sounds)*hrtfset.num_indices)//num_sounds
+    run_time = 0.0
+    correct = 0
+    for k, index in enumerate(indices):
+        seed(k)
+        start = time.time()
+        count = instance(sound, index, report=None)
+        run_time += time.time()-start
+        if model!='allpairs':
+            correct += estimate_location(count)==index
+    run_time /= num_sounds
+    result = dict(config)
+    result.update(analysis_time=analysis_time,
+                  construction_time=construction_time,
+                  run_time=run_time,
+                  throughput=config['duration']/run_time,
+                  peak_rss=_peak_rss(),
+                  accuracy=float(correct)/num_sounds if model!='allpairs' else None)
+    return result
+
+# modules that should be importable without importing Brian
+light_modules = ['settings', 'cache', 'analysis_cache', 'results', 'snapshot',
+                 'accuracy', 'plot_count', 'model_pool', 'model_equations',
+                 'numpy_engine', 'time_windows']
+
+# modules that build or run the models, which import Brian through shared.py
+# (their import time is mostly that of Brian)
+model_modules = ['shared', 'models', 'hrtf_analysis',
+                 'approximate_filtering_model', 'ideal_filtering_model',
+                 'all_pairs_model', 'sweep']
+
+_import_code = '''
+import sys, time, json
+start = time.time()
+import %s
+print(json.dumps({'time':time.time()-start, 'brian':'brian' in sys.modules}))
+'''
+
+def import_times(modules=None, repeat=3):
+    '''
+    Measures the time to import each of the modules (by default the
+    light_modules and the model_modules) in a new Python process, the best
+    of repeat times. Returns a dict with the module names as keys
+    and for each one a dict with the keys time and brian (whether the
+    import also imported Brian), or None if the import failed.
+    '''
+    if modules is None:
+        modules = light_modules+model_modules
+    path = os.path.dirname(os.path.abspath(__file__))
+    times = {}
+    for module in modules:
+        best = None
+        for _ in xrange(repeat):
+            process = subprocess.Popen([sys.executable, '-c',
+                                        _import_code%module], cwd=path,
+                                       stdout=subprocess.PIPE)
+            output = process.communicate()[0]
+            if process.returncode:
+                best = None
+                break
+            result = json.loads(output.decode('ascii').strip().splitlines()[-1])
+            if best is None or result['time']<best['time']:
+                best = result
+        times[module] = best
+    return times
+
+def default_configs():
+    '''
+    The configurations run by this file: the number of channels, the number
+    of locations, the size of the all pairs grid and the sound duration are
+    varied separately from the default_config, for each model. The ideal
+    model configurations that vary the number of channels and locations are
+    also run with shared_gammatone=True.
+    '''
+    configs = []
+    for model in ['approximate', 'ideal', 'allpairs']:
+        configs.append({'model':model})
+        for cfN in [20, 80]:
+            configs.append({'model':model, 'cfN':cfN})
+        for duration in [0.5]:
+            configs.append({'model':model, 'duration':duration})
+        if model=='allpairs':
+            for N in [11, 41]:
+                configs.append({'model':model, 'gain_N':N, 'delay_N':N})
+        else:
+            for num_indices in [72, 187]:
+                configs.append({'model':model, 'num_indices':num_indices})
+    configs.extend([dict(config, shared_gammatone=True) for config in configs
+                    if config['model']=='ideal' and 'duration' not in config])
+    return configs
+
+def run_benchmarks(configs, filename=None):
+    '''
+    Runs benchmark_config for each of the configurations, each in a new
+    process, and returns the list of results. If filename is given, the
+    results are written to it as JSON, together with information about the
+    machine and versions.
+    '''
+    results = []
+    for config in configs:
+        pool = multiprocessing.Pool(1)
+        try:
+            results.append(pool.apply(benchmark_config, (config,)))
+        finally:
+            pool.close()
+            pool.join()
+        gc.collect()
+    if filename is not None:
+        import numpy, brian
+        output = {
+            'time':time.strftime('%Y-%m-%d %H:%M:%S'),
+            'platform':platform.platform(),
+            'processor':platform.processor(),
+            'python':platform.python_version(),
+            'numpy':numpy.__version__,
+            'brian':getattr(brian, '__version__', None),
+            'import_times':import_times(),
+            'results':results,
+            }
+        f = open(filename, 'w')
+        try:
+            json.dump(output, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+    return results
+
+if __name__=='__main__':
+
+    if len(sys.argv)>1:
+        filename = sys.argv[1]
+    else:
+        filename = os.path.join(datapath, 'benchmark.json')
+
+    results = run_benchmarks(default_configs(), filename)
+
+    for result in results:
+        print('%(model)s%(shared)s cfN=%(cfN)d num_indices=%(num_indices)d '
+              'duration=%(duration).2fs: construction %(construction_time).2fs, '
+              'throughput %(throughput).3f, peak RSS %(peak_rss)d'%
+              dict(result, shared=' (shared Gammatone)' if result['shared_gammatone'] else ''))
+
+    times = import_times()
+    for module in light_modules+model_modules:
+        result = times[module]
+        if result is None:
+            print('import %s: failed'%module)
+        else:
+            print('import %s: %.3fs%s'%(module, result['time'],
+                                        ' (imports Brian)' if result['brian'] else ''))
@@ -0,0 +1,189 @@
+'''
+Content-addressed cache for derived data such as the results of the HRTF
+analysis.
+
+Entries are identified by a namespace and a key, which should be a hash of
+everything the data depends on (see cache_key). Each entry is a directory
+of .npy files, one per named array, that can be memory mapped when loaded.
+Entries are written to a temporary directory and renamed into place, so
+readers never see a partially written entry. The computation of a missing
+entry is done while holding a file lock, so that concurrent processes
+needing the same entry compute it only once. Loaded entries are kept in an
+in-process LRU, so repeated lookups do not touch the disk.
+
+Only numpy and the standard library are used here, so that cached data can
+be read without importing the simulator.
+'''
+import os, hashlib, tempfile, shutil, threading
+from collections import OrderedDict
+import numpy
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+__all__ = ['cache_key', 'FileLock', 'CacheStore']
+
+def cache_key(*args):
+    '''
+    Returns a hex digest of the arguments, which can be arrays, numbers,
+    strings or (nested) tuples and lists of these. Numbers are converted to
+    float, so quantities with units hash the same as their value in SI units.
+    '''
+    h = hashlib.sha1()
+    def update(x):
+        if isinstance(x, (tuple, list)):
+            h.update(('seq%d:'%len(x)).encode('ascii'))
+            for y in x:
+                update(y)
+        elif isinstance(x, str):
+            h.update(('str%d:'%len(x)).encode('ascii'))
+            h.update(x.encode('utf-8'))
+        elif isinstance(x, numpy.ndarray) and x.ndim>0:
+            x = numpy.ascontiguousarray(x)
+            h.update(('arr%s%s:'%(x.dtype.str, x.shape)).encode('ascii'))
+            h.update(x.view(numpy.uint8).data)
+        else:
+            h.update(('num%r:'%float(x)).encode('ascii'))
+    update(args)
+    return h.hexdigest()
+
+class FileLock(object):
+    '''
+    Exclusive lock on a file, for use in a with statement. Uses fcntl on Unix
+    and msvcrt on Windows.
+    '''
+    def __init__(self, fname):
+        self.fname = fname
+        self.f = None
+    def __enter__(self):
+        self.f = open(self.fname, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            self.f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except IOError:
+                    # LK_LOCK gives up after 10 seconds
+                    pass
+        return self
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+        self.f.close()
+        self.f = None
+
+class CacheStore(object):
+    '''
+    A cache of dicts of named arrays stored under the directory path.
+
+    ``maxitems``
+        The number of entries kept in the in-process LRU.
+    ``mmap_mode``
+        Passed to numpy.load when reading entries from disk, by default 'r'
+        (read-only memory mapping), use None to load into memory.
+    '''
+    def __init__(self, path, maxitems=32, mmap_mode='r'):
+        self.path = path
+        self.maxitems = maxitems
+        self.mmap_mode = mmap_mode
+        self.lru = OrderedDict()
+        self.lock = threading.RLock()
+
+    def entry_path(self, namespace, key):
+        return os.path.join(self.path, namespace, key)
+
+    def _remember(self, namespace, key, arrays):
+        with self.lock:
+            self.lru.pop((namespace, key), None)
+            self.lru[namespace, key] = arrays
+            while len(self.lru)>self.maxitems:
+                self.lru.popitem(last=False)
+
+    def get(self, namespace, key):
+        '''
+        Returns the dict of arrays for the entry, or None if there is none.
+        '''
+        with self.lock:
+            arrays = self.lru.get((namespace, key), None)
+            if arrays is not None:
+                self._remember(namespace, key, arrays)
+                return arrays
+        dirname = self.entry_path(namespace, key)
+        if not os.path.isdir(dirname):
+            return None
+        arrays = {}
+        for fname in os.listdir(dirname):
+            name, ext = os.path.splitext(fname)
+            if ext=='.npy':
+                arrays[name] = numpy.load(os.path.join(dirname, fname),
+                                          mmap_mode=self.mmap_mode)
+        self._remember(namespace, key, arrays)
+        return arrays
+
+    def put(self, namespace, key, arrays):
+        '''
+        Stores the dict of arrays as the entry, replacing any existing one.
+        '''
+        dirname = self.entry_path(namespace, key)
+        parent = os.path.dirname(dirname)
+        if not os.path.exists(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                # another process created it in the meantime
+                if not os.path.isdir(parent):
+                    raise
+        tmpdir = tempfile.mkdtemp(prefix='.tmp-'+key, dir=parent)
+        try:
+            for name, value in arrays.items():
+                numpy.save(os.path.join(tmpdir, name+'.npy'),
+                           numpy.asarray(value))
+            if os.path.exists(dirname):
+                shutil.rmtree(dirname)
+            os.rename(tmpdir, dirname)
+        except:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+        with self.lock:
+            self.lru.pop((namespace, key), None)
+
+    def cached(self, namespace, key, compute):
+        '''
+        Returns the entry, calling compute() to get the dict of arrays and
+        storing it if it doesn't exist yet. Only one process at a time
+        computes a given entry, others wait for it and then load it.
+        '''
+        arrays = self.get(namespace, key)
+        if arrays is not None:
+            return arrays
+        parent = os.path.join(self.path, namespace)
+        if not os.path.exists(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                if not os.path.isdir(parent):
+                    raise
+        with FileLock(self.entry_path(namespace, key)+'.lock'):
+            arrays = self.get(namespace, key)
+            if arrays is None:
+                self.put(namespace, key, compute())
+                arrays = self.get(namespace, key)
+        return arrays
+
+    def clear_memory(self):
+        '''
+        Empties the in-process LRU.
+        '''
+        with self.lock:
+            self.lru.clear()
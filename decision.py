@@ -0,0 +1,71 @@
+'''
+Location estimates with early termination, for the approximate and ideal
+filtering models.
+
+The estimate of the filtering models is the HRTF index with the most
+coincidence detector spikes summed over all channels (as in
+ircam_plot_count). early_estimate runs the model on the sound in segments
+(10 ms by default), adds up this evidence for each location after each
+segment, and stops as soon as the leading location is decisively ahead of
+the second one, rather than simulating the whole sound.
+
+The decision treats the two spike counts n1 and n2 as Poisson, so that
+under the hypothesis that both locations are equally likely to fire the
+difference has variance n1+n2, and z=(n1-n2)/sqrt(n1+n2) is approximately
+normal. The confidence returned is the normal cumulative probability of z,
+and the simulation stops once it reaches the requested level. This is a
+sequential test repeated after every segment, so the confidence is a
+heuristic rather than a calibrated probability of being correct.
+'''
+from shared import *
+from scipy.special import ndtr
+from model_pool import reset_model
+
+__all__ = ['margin_confidence', 'early_estimate']
+
+def margin_confidence(evidence):
+    '''
+    Returns (index, confidence) for the array of summed counts of each
+    location, where index is the location with the largest count and
+    confidence is the probability of the z statistic of its margin over the
+    second largest (see the module docstring).
+    '''
+    evidence = asarray(evidence, dtype=float)
+    index = argmax(evidence)
+    if len(evidence)<2:
+        return index, 1.0
+    n2, n1 = sort(evidence)[-2:]
+    if n1+n2<=0:
+        return index, 0.5
+    return index, float(ndtr((n1-n2)/sqrt(n1+n2)))
+
+def early_estimate(model, sound, index=None, confidence=0.99, segment=10*ms,
+                   min_duration=0*ms, seed=None, **indexkwds):
+    '''
+    Runs the model (ApproximateFilteringModel or IdealFilteringModel, with
+    either engine) on the sound as in its __call__ method, in segments of the
+    given duration, and stops after the first segment, at least min_duration
+    into the sound, at which the confidence of the leading location reaches
+    the given level (or at the end of the sound). Returns (index, confidence,
+    duration), the estimated HRTF index, its confidence and the duration of
+    sound simulated. The count up to that point is left in model.counter.
+    The model is reset with the seed as by its __call__ method.
+    '''
+    sound = model._prepare_sound(sound, index, **indexkwds)
+    model.soundinput.source = sound
+    reset_model(model, seed)
+    samplerate = sound.samplerate
+    nsamples = sound.nsamples
+    segment_samples = int(maximum(1, round(float(segment*samplerate))))
+    min_samples = int(round(float(min_duration*samplerate)))
+    estimate, p = margin_confidence(zeros(model.num_indices))
+    done = 0
+    while done<nsamples:
+        n = int(minimum(segment_samples, nsamples-done))
+        model.network.run(n/samplerate, report=None)
+        done += n
+        evidence = sum(model._format_count(model.counter.count), axis=0)
+        estimate, p = margin_confidence(evidence)
+        if done>=min_samples and p>=confidence:
+            break
+    return estimate, p, done/samplerate
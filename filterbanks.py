@@ -0,0 +1,200 @@
+'''
+Filterbanks used by the models.
+
+GainCompressFilterbank is the last stage of the cochlear model, it replaces
+the chain FunctionFilterbank(x*gains) -> FunctionFilterbank(compress(clip(x,
+0, Inf))) (and the Repeat before the gains in the approximate filtering
+model) with a single stage. The output is computed in place in a buffer that
+is allocated once and reused for every buffer of the same size, so no
+intermediate arrays are allocated in the main loop.
+
+FFTConvolutionFilterbank convolves source channels with FIR filters by block
+FFT convolution (overlap-save), where the same source channel can be
+convolved with many filters and the same filter applied to many source
+channels without repeating the source. The ideal filtering model uses it
+to apply the HRTFs after a single shared Gammatone filterbank.
+
+SharedOutputFilterbank passes on the output of its source, keeping the last
+samples so that filterbanks fetching it in blocks of different sizes (e.g.
+an FFTConvolutionFilterbank and a filter group) can do so at different
+positions. The CochlearFrontEnd of frontend.py uses it after the Gammatone
+filterbank shared by several models.
+'''
+from shared import *
+from models import cube_root
+from numpy.fft import rfft, irfft
+
+__all__ = ['GainCompressFilterbank', 'FFTConvolutionFilterbank',
+           'SharedOutputFilterbank']
+
+class GainCompressFilterbank(Filterbank):
+    '''
+    Filterbank with output compress(maximum(gains*x[:, indices], 0)).
+
+    ``gains``
+        One gain per output channel, or None for no gains.
+    ``compress``
+        The compression function, or None for none. The cube_root function of
+        models.py is computed with numpy's cbrt in place, other functions are
+        applied to the rectified output.
+    ``indices``
+        If specified, the index of the source channel of each output channel,
+        so that channels can be repeated or selected without a Repeat or
+        RestructureFilterbank.
+    ``dtype``
+        The type of the output.
+
+    Note that the array returned by buffer_apply is overwritten by the next
+    buffer of the same size.
+    '''
+    def __init__(self, source, gains=None, compress=None, indices=None,
+                 dtype=float):
+        Filterbank.__init__(self, source)
+        if indices is not None:
+            indices = asarray(indices, dtype=int)
+            if len(indices) and (amin(indices)<0 or amax(indices)>=source.nchannels):
+                raise IndexError('Channel indices out of range.')
+            self.nchannels = len(indices)
+        if gains is not None:
+            gains = asarray(gains, dtype=dtype).flatten()
+            if len(gains)!=self.nchannels:
+                raise ValueError('Need one gain per output channel.')
+        self.gains = gains
+        self.compress = compress
+        self.indices = indices
+        self.dtype = dtype
+        self.output = None
+
+    def buffer_apply(self, input):
+        nsamples = input.shape[0]
+        output = self.output
+        if output is None or output.shape[0]!=nsamples:
+            output = self.output = empty((nsamples, self.nchannels),
+                                         dtype=self.dtype)
+        if self.indices is None:
+            output[:] = input
+        else:
+            # indices were checked in __init__, 'clip' avoids a temporary copy
+            take(input, self.indices, axis=1, out=output, mode='clip')
+        if self.gains is not None:
+            multiply(output, self.gains, out=output)
+        maximum(output, 0, out=output)
+        if self.compress is cube_root:
+            cbrt(output, out=output)
+        elif self.compress is not None:
+            output[:] = self.compress(output)
+        return output
+
+class FFTConvolutionFilterbank(Filterbank):
+    '''
+    Filterbank whose output channel k is the convolution of source channel
+    sourceindices[k] with the impulse response irs[irindices[k]], where irs
+    has shape (num_irs, ir_length).
+
+    The output is computed blocksize samples at a time (by default the
+    largest block for which the FFT length is the power of two at least
+    twice the impulse response length), so this is the minimum_buffer_size.
+    The products of the spectra are computed chunksize output channels at a
+    time to bound the memory use.
+    '''
+    def __init__(self, source, irs, sourceindices, irindices, blocksize=None,
+                 chunksize=4096):
+        Filterbank.__init__(self, source)
+        irs = asarray(irs)
+        self.sourceindices = asarray(sourceindices, dtype=int)
+        self.irindices = asarray(irindices, dtype=int)
+        if len(self.sourceindices)!=len(self.irindices):
+            raise ValueError('Need one source and one impulse response index '
+                             'per output channel.')
+        self.nchannels = len(self.sourceindices)
+        self.ir_length = L = irs.shape[1]
+        if blocksize is None:
+            blocksize = L
+        self.nfft = 2**int(ceil(log2(blocksize+L-1)))
+        self.blocksize = self.nfft-L+1
+        self.minimum_buffer_size = self.blocksize
+        self.chunksize = chunksize
+        # shape (nfft/2+1, num_irs)
+        self.ir_fft = rfft(irs, self.nfft, axis=1).T
+        self.buffer_init()
+
+    def buffer_init(self):
+        Filterbank.buffer_init(self)
+        # the last ir_length-1 samples of the input
+        self.input_cache = zeros((self.ir_length-1, self.source.nchannels))
+
+    def buffer_apply(self, input):
+        n = input.shape[0]
+        L, nfft = self.ir_length, self.nfft
+        x = vstack((self.input_cache, input))
+        output = empty((n, self.nchannels))
+        for start in xrange(0, n, self.blocksize):
+            end = start+self.blocksize
+            if end>n:
+                end = n
+            # circular convolution of x[start:end+L-1], of which the last
+            # end-start samples are the linear convolution
+            X = rfft(x[start:end+L-1, :], nfft, axis=0)
+            for c in xrange(0, self.nchannels, self.chunksize):
+                I = self.sourceindices[c:c+self.chunksize]
+                J = self.irindices[c:c+self.chunksize]
+                y = irfft(X[:, I]*self.ir_fft[:, J], nfft, axis=0)
+                output[start:end, c:c+self.chunksize] = y[L-1:L-1+end-start, :]
+        if L>1:
+            self.input_cache = x[x.shape[0]-(L-1):, :]
+        return output
+
+class SharedOutputFilterbank(Filterbank):
+    '''
+    Filterbank with the same output as its source, for several filterbanks
+    built on the same source. A Bufferable only keeps its output from the
+    start of the last fetch, so filterbanks that fetch blocks of different
+    sizes from it fail as soon as one of them gets ahead of the others. This
+    keeps the last history samples of output (and at least everything from
+    the start of the last fetch), and any block starting within them can be
+    fetched, in any order. The source is fetched once, in order.
+
+    The history should be at least the largest distance between the end of
+    a block fetched by one of the filterbanks and the start of a block
+    fetched by another one. It can be changed at any time.
+
+    The arrays returned by buffer_fetch are copies, which are not affected
+    by later fetches.
+    '''
+    def __init__(self, source, history=0):
+        Filterbank.__init__(self, source)
+        self.history = history
+        self.buffer_init()
+
+    def buffer_init(self):
+        Filterbank.buffer_init(self)
+        # rows 0:filled of output are the samples from output_start
+        self.output = zeros((0, self.nchannels))
+        self.output_start = 0
+        self.filled = 0
+
+    def buffer_fetch(self, start, end):
+        output_end = self.output_start+self.filled
+        if end>output_end:
+            n = end-output_end
+            if self.filled+n>self.output.shape[0]:
+                # drop what is no longer needed, and grow the array if this
+                # is not enough
+                keep = int(minimum(start, end-self.history))
+                drop = int(minimum(maximum(keep-self.output_start, 0), self.filled))
+                if drop:
+                    self.output[:self.filled-drop] = self.output[drop:self.filled].copy()
+                    self.output_start += drop
+                    self.filled -= drop
+                if self.filled+n>self.output.shape[0]:
+                    size = int(maximum(2*(self.filled+n), self.history+n))
+                    output = zeros((size, self.nchannels))
+                    output[:self.filled] = self.output[:self.filled]
+                    self.output = output
+            self.output[self.filled:self.filled+n] = self.source.buffer_fetch(output_end, end)
+            self.filled += n
+        if start<self.output_start:
+            raise IndexError('Attempted to fetch output that has disappeared '
+                             'from the buffer, the history of the '
+                             'SharedOutputFilterbank is too short.')
+        return self.output[start-self.output_start:end-self.output_start].copy()
@@ -0,0 +1,141 @@
+'''
+A cochlear front end shared by several models, run together in one
+simulation.
+
+All three models start by filtering the two ears of the sound with the same
+Gammatone filterbank, Gammatone(Repeat(soundinput, cfN), tile(cf, 2)) with
+cf=erbspace(cfmin, cfmax, cfN), and build their own stages on top of it. A
+CochlearFrontEnd holds one such input and filterbank, and models created
+with frontend=... use it instead of making their own (the ideal filtering
+model then applies the HRTFs after the Gammatone filters, as with
+shared_gammatone=True). A MultiModelRunner runs any number of these models,
+including copies of a model with different cd_model or filtergroup_model
+parameters, on each sound in a single simulation, so the Gammatone filtering
+is done once per sound for all of them.
+
+The models do not fetch the Gammatone output in the same blocks: the filter
+groups and the numpy engine fetch one buffer (e.g. 32 samples) at a time,
+but the FFTConvolutionFilterbank of the ideal model fetches blocks of its
+minimum_buffer_size (e.g. 513 samples), ahead of the others. A Bufferable
+only keeps its output from the start of the last fetch, so the Gammatone
+filterbank is followed by a SharedOutputFilterbank (see filterbanks.py),
+which keeps enough of its output for all the models. The MultiModelRunner
+sets its history from the largest lookahead and buffer size of the models,
+so the models can be given in any order. The Gammatone filtering is done
+once, and the models fetch copies of its output.
+'''
+from shared import *
+from filterbanks import SharedOutputFilterbank
+from streaming import filterbank_lookahead
+from model_pool import reset_model
+
+__all__ = ['CochlearFrontEnd', 'MultiModelRunner']
+
+class CochlearFrontEnd(object):
+    '''
+    The input and Gammatone filterbank for a cochlear range (cfmin, cfmax,
+    cfN), to be passed as the frontend argument of the models. The channels
+    are the cfN channels of the left ear followed by those of the right ear.
+    The gammatone attribute is the SharedOutputFilterbank on top of the
+    Gammatone filterbank, whose history is set by the MultiModelRunner.
+    '''
+    def __init__(self, cfmin, cfmax, cfN):
+        self.cfmin, self.cfmax, self.cfN = cfmin, cfmax, cfN
+        self.cf = erbspace(cfmin, cfmax, cfN)
+        # dummy sound, replaced by the sound to process
+        sound = Sound((silence(1*ms), silence(1*ms)))
+        self.soundinput = DoNothingFilterbank(sound)
+        self.gammatone = SharedOutputFilterbank(
+                            Gammatone(Repeat(self.soundinput, cfN),
+                                      tile(self.cf, 2)))
+
+    def check(self, cfmin, cfmax, cfN):
+        '''
+        Raises a ValueError if the cochlear range is not that of the front
+        end.
+        '''
+        if (cfN!=self.cfN or abs(float(cfmin)-float(self.cfmin))>1e-9 or
+                abs(float(cfmax)-float(self.cfmax))>1e-9):
+            raise ValueError('The cochlear range of the model is not that of '
+                             'the front end.')
+
+class MultiModelRunner(object):
+    '''
+    Runs several models built on the same CochlearFrontEnd (any of the three
+    models, all with the same engine) on each sound in one simulation. For
+    example::
+
+        frontend = CochlearFrontEnd(cfmin, cfmax, cfN)
+        runner = MultiModelRunner([
+            ApproximateFilteringModel(hrtfset, cfmin, cfmax, cfN,
+                                      frontend=frontend),
+            IdealFilteringModel(hrtfset, cfmin, cfmax, cfN,
+                                frontend=frontend),
+            ])
+        approximate_count, ideal_count = runner(sound, index)
+
+    The models can still be called on their own, which only runs that model.
+    '''
+    def __init__(self, models):
+        self.models = models = list(models)
+        if not models:
+            raise ValueError('Need at least one model.')
+        self.frontend = models[0].frontend
+        self.engine = models[0].engine
+        for model in models:
+            if model.frontend is None or model.frontend is not self.frontend:
+                raise ValueError('All the models should be built with the '
+                                 'same frontend.')
+            if model.engine!=self.engine:
+                raise ValueError('All the models should use the same engine.')
+        if self.engine=='brian':
+            objects = []
+            for model in models:
+                objects.extend([model.filtergroup, model.synchronygroup,
+                                model.synapses, model.counter])
+            self.network = Network(*objects)
+        else:
+            self.network = None
+            self.buffersize = models[0].network.buffersize
+        # the models fetch the front end output at most lookahead plus two
+        # buffers apart, with a margin
+        history = 0
+        for model in models:
+            if model.engine=='numpy':
+                buffersize = model.network.buffersize
+            else:
+                buffersize = model.filtergroup.buffersize
+            history = maximum(history, 2*(filterbank_lookahead(model.cochlea)+
+                                          2*buffersize))
+        self.frontend.gammatone.history = int(maximum(self.frontend.gammatone.history,
+                                                      history))
+
+    def __call__(self, sound, index=None, report='stderr', seed=None,
+                 **indexkwds):
+        '''
+        Applies each of the models to the sound, given as for the __call__
+        method of the models (the index refers to the hrtfset of the first
+        model). Returns the list of the counts of the models, each as
+        returned by its __call__ method. The progress is reported as for
+        Network.run with the Brian engine. With a seed, model k is reset
+        with the seed (seed, k) (see model_pool.reset_model).
+        '''
+        models = self.models
+        sound = models[0]._prepare_sound(sound, index, **indexkwds)
+        self.frontend.soundinput.source = sound
+        if self.engine=='brian':
+            self.network.reinit()
+        for k, model in enumerate(models):
+            reset_model(model, None if seed is None else (seed, k))
+        if self.engine=='brian':
+            self.network.run(sound.duration, report=report)
+        else:
+            # the networks are advanced together one buffer at a time, so
+            # they all fetch the same buffer of the front end in turn
+            samplerate = sound.samplerate
+            for start in xrange(0, sound.nsamples, self.buffersize):
+                n = int(minimum(self.buffersize, sound.nsamples-start))
+                for model in models:
+                    model.network.run(n/samplerate)
+        return [model._format_count(array(model.counter.count))
+                for model in models]
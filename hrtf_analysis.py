@@ -1,66 +1,121 @@
 from shared import *
+from analysis_cache import *
+from numpy.fft import rfft, irfft
+import multiprocessing
 
-def hrtfset_itd_ild(hrtfset, cfmin, cfmax, cfN):
+__all__ = ['hrtfset_itd_ild', 'subjects_itd_ild', 'hrtfset_attenuations',
+           'hrtf_cache', 'cached_itd_ild', 'cached_attenuations']
+
+# Results are cached in data/cache (see analysis_cache.py, which can read them
+# without importing Brian).
+
+def hrtfset_itd_ild(hrtfset, cfmin, cfmax, cfN, chunksize=16):
+    '''
+    Returns arrays all_itds, all_ilds of shape (num_indices, cfN) of the best
+    delay (in seconds) and gain in each cochlear channel for each HRTF index,
+    computed from the peak of the cross-correlation of the left and right
+    cochlear-filtered HRIRs.
+    
+    All the HRIRs are filtered by a single Gammatone filterbank, and the
+    cross-correlations are computed with batched real FFTs (zero padded to a
+    power of two) over chunksize indices at a time to bound the memory use.
+    '''
+    key = itd_ild_key(hrtfset, cfmin, cfmax, cfN)
+    compute = lambda: _compute_itd_ild(hrtfset, cfmin, cfmax, cfN, chunksize)
+    arrays = hrtf_cache.cached('itdild', key, compute)
+    return arrays['itds'], arrays['ilds']
+
+def _compute_itd_ild(hrtfset, cfmin, cfmax, cfN, chunksize):
     cf = erbspace(cfmin, cfmax, cfN)
-    man_name = hrtfset.name+'-'+str((int(cfmin)))+'-'+str(int(cfmax))+'-'+str(cfN)
-    fname = datapath+'/itdild/'+man_name+'.pkl'
-    if os.path.exists(fname):
-        return pickle.load(open(fname, 'rb'))
+    num_indices = hrtfset.num_indices
+    nsamples = hrtfset.data.shape[2]
+    # channels ordered LRLR... by index, and then by cf within each ear
+    hrirs = reshape(swapaxes(hrtfset.data, 0, 1), (2*num_indices, nsamples)).T
+    hrir = Sound(hrirs, samplerate=hrtfset.samplerate)
+    fb = Gammatone(Repeat(hrir, cfN), tile(cf, 2*num_indices))
+    filtered_hrirset = fb.process()
+    filtered_hrirset.shape = (nsamples, num_indices, 2, cfN)
+    # This FFT stuff does a correlate(left, right, 'full') for all channels
+    nfft = 2**int(ceil(log2(2*nsamples-1)))
     all_itds = []
     all_ilds = []
-    num_indices = hrtfset.num_indices
-    for j in xrange(num_indices):
-        hrir = Sound(hrtfset.hrtf[j].fir.T, samplerate=hrtfset.samplerate)
-        fb = Gammatone(Repeat(hrir, cfN), hstack((cf, cf)))
-        filtered_hrirset = fb.process()
-        itds = []
-        ilds = []
-        for i in xrange(cfN):
-            left = filtered_hrirset[:, i]
-            right = filtered_hrirset[:, i+cfN]
-            # This FFT stuff does a correlate(left, right, 'full')
-            Lf = fft(hstack((left, zeros(len(left)))))
-            Rf = fft(hstack((right[::-1], zeros(len(right)))))
-            C = ifft(Lf*Rf).real
-            i = argmax(C)+1-len(left)
-            itds.append(i/hrtfset.samplerate)
-            ilds.append(sqrt(amax(C)/sum(right**2)))
-        itds = array(itds)
-        ilds = array(ilds)
+    for start in xrange(0, num_indices, chunksize):
+        left = filtered_hrirset[:, start:start+chunksize, 0, :]
+        right = filtered_hrirset[:, start:start+chunksize, 1, :]
+        Lf = rfft(left, nfft, axis=0)
+        Rf = rfft(right[::-1], nfft, axis=0)
+        C = irfft(Lf*Rf, nfft, axis=0)[:2*nsamples-1]
+        i = argmax(C, axis=0)+1-nsamples
+        itds = i/float(hrtfset.samplerate)
+        ilds = sqrt(amax(C, axis=0)/sum(right**2, axis=0))
         all_itds.append(itds)
         all_ilds.append(ilds)
-    pickle.dump((all_itds, all_ilds), open(fname, 'wb'), -1)
-    return all_itds, all_ilds
+    return {'itds':vstack(all_itds), 'ilds':vstack(all_ilds)}
+
+def _subject_itd_ild(args):
+    get_database, subject, cfmin, cfmax, cfN = args
+    hrtfset = get_database().load_subject(subject)
+    return hrtfset_itd_ild(hrtfset, cfmin, cfmax, cfN)
 
-def hrtfset_attenuations(cfmin, cfmax, cfN, hrtfset, sound=None):
-    fname = datapath+'/hrtf_attenuation/'+hrtfset.name+'-'+str((int(cfmin)))+'-'+str(int(cfmax))+'-'+str(cfN)+'.pkl'
-    if os.path.exists(fname):
-        return pickle.load(open(fname, 'rb'))
+def subjects_itd_ild(subjects, cfmin, cfmax, cfN, get_database=get_ircam,
+                     processes=None):
+    '''
+    Computes (or loads) hrtfset_itd_ild for several subjects using a pool of
+    processes worker processes (by default the number of CPUs). The
+    get_database function should be defined at the top level of a module so
+    that it can be pickled. Returns a list of (all_itds, all_ilds), one for
+    each subject.
+    '''
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_subject_itd_ild,
+                           [(get_database, subject, cfmin, cfmax, cfN)
+                            for subject in subjects])
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+def hrtfset_attenuations(cfmin, cfmax, cfN, hrtfset, sound=None,
+                         chunksize=16, dtype=float):
+    '''
+    Returns an array of shape (2, num_indices, cfN) of the peak response of
+    each cochlear channel to each HRIR, relative to the peak response of the
+    channel on its own, with the ears swapped (used by the ideal filtering
+    model to normalise the filters).
     
+    Each HRIR is convolved with the Gammatone impulse responses (over 40 ms)
+    with batched real FFTs, chunksize indices at a time to bound the memory
+    use. The computation can be done in float32 with dtype=float32.
+    '''
+    key = attenuations_key(hrtfset, cfmin, cfmax, cfN, dtype)
+    compute = lambda: {'y':_compute_attenuations(cfmin, cfmax, cfN, hrtfset,
+                                                 chunksize, dtype)}
+    return hrtf_cache.cached('hrtf_attenuation', key, compute)['y']
+
+def _compute_attenuations(cfmin, cfmax, cfN, hrtfset, chunksize, dtype):
     sound = Sound(array([1.]))[:40*ms]
+    nsound = sound.shape[0]
     cf = erbspace(cfmin, cfmax, cfN)
+    num_indices = hrtfset.num_indices
+    nsamples = hrtfset.data.shape[2]
 
-    hrtfset_fb = hrtfset.filterbank(Repeat(sound, 2*hrtfset.num_indices))
-    gfb = Gammatone(Repeat(hrtfset_fb, cfN),
-                    tile(cf, hrtfset_fb.nchannels))
-
-    gfb2 = Gammatone(sound, cf)
-    
-    output_fb = Join(gfb, gfb2)
+    # impulse responses of the Gammatone filters, shape (nsound, cfN)
+    gammatone_ir = asarray(Gammatone(sound, cf).process())
+    z = amax(gammatone_ir, axis=0)
 
-    y = zeros(2*hrtfset.num_indices*cfN)
-    z = zeros(cfN)
-    endpoints = hstack((arange(0, sound.shape[0], 32), sound.shape[0]))
-    for start, end in zip(endpoints[:-1], endpoints[1:]):
-        output = output_fb.buffer_fetch(start, end)
-        output1 = output[:, :-cfN]
-        output2 = output[:, -cfN:]
-        y = maximum(y, amax(output1, axis=0))
-        z = maximum(z, amax(output2, axis=0))
-    y.shape = (2, hrtfset.num_indices, cfN)
-    z.shape = (1, 1, cfN)
+    # only the first nsound samples of the convolutions are used, so these
+    # have to be free of wrap around
+    nfft = 2**int(ceil(log2(nsound+nsamples-1)))
+    Gf = rfft(asarray(gammatone_ir, dtype=dtype), nfft, axis=0)
+    Gf = reshape(Gf, (Gf.shape[0], 1, 1, cfN))
+    y = zeros((2, num_indices, cfN), dtype=dtype)
+    for start in xrange(0, num_indices, chunksize):
+        hrirs = asarray(hrtfset.data[:, start:start+chunksize, :], dtype=dtype)
+        # shape (nfft/2+1, 2, chunk, 1)
+        Hf = rfft(hrirs, nfft, axis=2).transpose((2, 0, 1))[:, :, :, newaxis]
+        output = irfft(Hf*Gf, nfft, axis=0)[:nsound]
+        y[:, start:start+chunksize, :] = amax(output, axis=0)
     y = y[::-1, :, :]
     y /= z
-    
-    pickle.dump(y, open(fname, 'wb'), -1)
     return y
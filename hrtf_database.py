@@ -0,0 +1,186 @@
+'''
+Compact memory-mapped copy of the IRCAM LISTEN database.
+
+convert_ircam() does a one-time conversion of the database into a directory
+with one contiguous float32 array of all the HRIRs (shape (num_subjects, 2,
+num_indices, num_samples)) and tables of the subjects, samplerates and
+coordinates. MemmapHRTFDatabase opens these files via memory mapping, so
+loading a subject doesn't parse any files, and worker processes share the
+same pages of HRIR data. The HRTF sets of the subjects are MemmapHRTFSets,
+which keep the memory-mapped data and only make the HRTF object (with its
+own float64 copy of the HRIRs) of an index when it is used, rather than for
+all the indices as HRTFSet does. Their subsets keep the same memory-mapped
+data and the array of the indices they select.
+
+Note that the HRIRs are stored as float32, so the cached HRTF analysis for
+subjects loaded this way is different from that of the original database.
+'''
+from shared import *
+from numpy.lib.format import open_memmap
+import numpy
+
+__all__ = ['convert_ircam', 'MemmapHRTFSet', 'MemmapHRTFDatabase',
+           'get_ircam_memmap', 'ircam_memmap_path']
+
+ircam_memmap_path = os.path.join(datapath, 'ircam_memmap')
+
+def convert_ircam(path, hrtfdb=None, subjects=None):
+    '''
+    Converts the subjects (by default all) of the HRTF database hrtfdb (by
+    default get_ircam()) into the memory-mapped format in the directory path.
+    All subjects must have the same number of indices and HRIR length.
+    '''
+    if hrtfdb is None:
+        hrtfdb = get_ircam()
+    if subjects is None:
+        subjects = hrtfdb.subjects
+    subjects = list(subjects)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    first = hrtfdb.load_subject(subjects[0])
+    shape = (len(subjects),)+first.data.shape
+    tmpname = os.path.join(path, 'hrirs.tmp.npy')
+    hrirs = open_memmap(tmpname, mode='w+', dtype=float32, shape=shape)
+    coordinates = zeros((len(subjects), first.num_indices),
+                        dtype=first.coordinates.dtype)
+    samplerates = zeros(len(subjects))
+    for i, subject in enumerate(subjects):
+        hrtfset = first if i==0 else hrtfdb.load_subject(subject)
+        if hrtfset.data.shape!=first.data.shape:
+            raise ValueError('Subject '+str(subject)+' has HRIRs of shape '+
+                             str(hrtfset.data.shape)+', expected '+
+                             str(first.data.shape))
+        hrirs[i] = hrtfset.data
+        coordinates[i] = hrtfset.coordinates
+        samplerates[i] = float(hrtfset.samplerate)
+    hrirs.flush()
+    del hrirs
+    numpy.save(os.path.join(path, 'subjects.npy'), array(subjects))
+    numpy.save(os.path.join(path, 'coordinates.npy'), coordinates)
+    numpy.save(os.path.join(path, 'samplerates.npy'), samplerates)
+    # the HRIRs are written last, so that an interrupted conversion leaves no
+    # hrirs.npy behind
+    fname = os.path.join(path, 'hrirs.npy')
+    if os.path.exists(fname):
+        os.remove(fname)
+    os.rename(tmpname, fname)
+
+class _LazyHRTFs(object):
+    # the list of HRTF objects of an HRTFSet, made when they are accessed
+    # from the columns indices (None for all) of data
+    def __init__(self, data, samplerate, indices=None):
+        self.data = data
+        self.samplerate = samplerate
+        self.indices = indices
+    def __len__(self):
+        if self.indices is None:
+            return self.data.shape[1]
+        return len(self.indices)
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if index<0:
+            index += len(self)
+        if not 0<=index<len(self):
+            raise IndexError('HRTF index out of range.')
+        if self.indices is not None:
+            index = self.indices[index]
+        return HRTF(Sound(self.data[0, index, :], samplerate=self.samplerate),
+                    Sound(self.data[1, index, :], samplerate=self.samplerate))
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+def _condition_indices(condition, coordinates):
+    # the indices of the coordinates satisfying condition, a function of
+    # some of the coordinate names, as in HRTFSet.subset: evaluated on the
+    # arrays of coordinates if possible, otherwise on each index
+    code = getattr(condition, '__code__', None)
+    if code is None:
+        code = condition.func_code
+    names = code.co_varnames[:code.co_argcount]
+    ns = dict((name, coordinates[name]) for name in names)
+    try:
+        I = asarray(condition(**ns))
+        if I.shape!=(len(coordinates),):
+            raise ValueError
+    except Exception:
+        I = array([condition(**dict((name, ns[name][j]) for name in names))
+                   for j in xrange(len(coordinates))], dtype=bool)
+    return I.nonzero()[0]
+
+class MemmapHRTFSet(HRTFSet):
+    '''
+    An HRTFSet whose data is kept as given (e.g. a read-only memory map),
+    without the copy of the HRIRs of every index that HRTFSet makes. The
+    HRTF objects are made when they are accessed, hrtfset[index] returns a
+    new one on every call.
+
+    The subsets are MemmapHRTFSets of the same data with an array of the
+    indices they keep, indices (None for all). Their data attribute is the
+    data of these indices, copied from the memory map each time it is
+    accessed.
+    '''
+    def __init__(self, data, samplerate, coordinates, indices=None):
+        # HRTFSet.__init__ is not called, it makes all the HRTF objects
+        self.memmap = data
+        self.indices = indices
+        self.samplerate = samplerate
+        self.coordinates = coordinates
+        self.hrtf = _LazyHRTFs(data, samplerate, indices)
+
+    def _get_data(self):
+        if self.indices is None:
+            return self.memmap
+        return self.memmap[:, self.indices, :]
+    data = property(fget=_get_data)
+
+    num_indices = property(fget=lambda self: len(self.hrtf))
+
+    def subset(self, condition):
+        # HRTFSet.subset is not called, it makes the HRTF objects and copies
+        # the data of the subset
+        I = _condition_indices(condition, self.coordinates)
+        coordinates = self.coordinates[I]
+        if self.indices is not None:
+            I = self.indices[I]
+        obj = MemmapHRTFSet(self.memmap, self.samplerate, coordinates, I)
+        if hasattr(self, 'name'):
+            obj.name = self.name
+        return obj
+
+class MemmapHRTFDatabase(object):
+    '''
+    An HRTF database in the format written by convert_ircam, with the same
+    interface as IRCAM_LISTEN: the subjects attribute and the load_subject
+    method, which accepts subjects as numbers or strings (e.g. 1002 or
+    '1002'). The HRTF sets are MemmapHRTFSets of the memory-mapped data.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.hrirs = numpy.load(os.path.join(path, 'hrirs.npy'), mmap_mode='r')
+        self.subjects = list(numpy.load(os.path.join(path, 'subjects.npy')))
+        self.coordinates = numpy.load(os.path.join(path, 'coordinates.npy'))
+        self.samplerates = numpy.load(os.path.join(path, 'samplerates.npy'))
+        # subjects are looked up by str(subject), as in IRCAM_LISTEN
+        self.subject_index = dict((str(subject), i)
+                                  for i, subject in enumerate(self.subjects))
+
+    def load_subject(self, subject):
+        try:
+            i = self.subject_index[str(subject)]
+        except KeyError:
+            raise IOError("Couldn't find the HRTF data for subject "+str(subject))
+        hrtfset = MemmapHRTFSet(self.hrirs[i], self.samplerates[i]*Hz,
+                                self.coordinates[i])
+        hrtfset.name = 'IRCAM_'+str(subject)
+        return hrtfset
+
+def get_ircam_memmap():
+    '''
+    Returns the memory-mapped copy of the IRCAM database, converting it from
+    get_ircam() into data/ircam_memmap the first time.
+    '''
+    if not os.path.exists(os.path.join(ircam_memmap_path, 'hrirs.npy')):
+        convert_ircam(ircam_memmap_path)
+    return MemmapHRTFDatabase(ircam_memmap_path)
@@ -1,6 +1,11 @@
 from shared import *
 from hrtf_analysis import *
 from models import *
+from numpy_engine import *
+from filterbanks import *
+from snapshot import *
+from model_pool import reset_model
+from decision import *
 import gc
 
 class IdealFilteringModel(object):
@@ -11,51 +16,122 @@ class IdealFilteringModel(object):
     a model for the filter neurons (filtergroup_model),
     whether or not to normalise the cochlear-filtered HRTFs, which improves
     performance by making each frequency band have the same power (and therefore
-    comparable firing rates in the neurons) (use_normalisation_gains).
+    comparable firing rates in the neurons) (use_normalisation_gains),
+    the simulation engine for the neurons, 'brian' or 'numpy' (engine, see
+    numpy_engine.py),
+    the floating point type of the filterbank output after the Gammatone
+    filters, and of the neuron state with the numpy engine (dtype, e.g.
+    float32),
+    whether to filter the input with a single Gammatone filterbank shared by
+    all the HRTF indices, followed by the HRTFs (shared_gammatone, see below),
+    a CochlearFrontEnd with the same cochlear range whose Gammatone filters
+    are used as this shared filterbank, to run the model with other models in
+    a MultiModelRunner (frontend, see frontend.py, implies shared_gammatone).
     
-    The __call__ method returns a count (see docstring of that method). 
+    By default each HRTF is applied to the input and the result filtered by
+    its own Gammatone filterbank, so there are 2*num_indices*cfN Gammatone
+    channels. Both are linear filters, so with shared_gammatone=True the input
+    is instead filtered by 2*cfN Gammatone channels, and each of these is
+    convolved with the HRIRs of all the indices by block FFT convolution
+    (FFTConvolutionFilterbank in filterbanks.py). The output is the same.
+    benchmark.py runs both versions for comparison.
+    
+    The __call__ method returns a count (see docstring of that method), and
+    the estimate method the estimated location, stopping the simulation early
+    once it is decisive. Use the save method and the load class method to
+    store a built model and recreate it without the HRTF analysis.
     '''
     def __init__(self, hrtfset, cfmin, cfmax, cfN,
                  cd_model=standard_cd_model,
                  filtergroup_model=standard_filtergroup_model,
-                 use_normalisation_gains=True,
+                 use_normalisation_gains=True, engine='brian', dtype=float,
+                 shared_gammatone=False, frontend=None,
                  ):
         self.hrtfset = hrtfset
         self.cfmin, self.cfmax, self.cfN = cfmin, cfmax, cfN
         self.cd_model = cd_model
         self.filtergroup_model = filtergroup_model
+        if engine not in ('brian', 'numpy'):
+            raise ValueError("engine should be 'brian' or 'numpy'")
+        self.engine = engine
+        self.dtype = dtype
+        if frontend is not None:
+            frontend.check(cfmin, cfmax, cfN)
+            shared_gammatone = True
+        self.frontend = frontend
         
-        self.num_indices = num_indices = hrtfset.num_indices
-        cf = erbspace(cfmin, cfmax, cfN)
-                
-        # dummy sound, when we run apply() we replace it
-        sound = Sound((silence(1*ms), silence(1*ms)))
-        soundinput = DoNothingFilterbank(sound)
+        self.shared_gammatone = shared_gammatone
+        self.num_indices = hrtfset.num_indices
         
-        hrtfset_fb = hrtfset.filterbank(
-                RestructureFilterbank(soundinput, 
-                        indexmapping=repeat([1, 0], hrtfset.num_indices)))
-
         # We normalise the different HRTFs because we don't want a stronger
         # response from channels with less attenuation in the HRTF, but rather
-        # a stronger response when the filters are more closely equal
+        # a stronger response when the filters are more closely equal. The
+        # Gammatone filters are linear, so the gains are applied after them,
+        # together with the rectification and compression.
         if use_normalisation_gains:
             attenuations = hrtfset_attenuations(cfmin, cfmax, cfN, hrtfset)
             #shape: (2, hrtfset.num_indices, cfN))
             gains_max = reshape(1/maximum(attenuations[0], attenuations[1]), (1, hrtfset.num_indices, cfN))
             gains = vstack((gains_max, gains_max))
             gains.shape = gains.size
-            func = lambda x: x*gains
         else:
-            func = lambda x: x
-
-        gains_fb = FunctionFilterbank(Repeat(hrtfset_fb, cfN), func)
+            gains = None
+        self.gains = gains
+        
+        self._build()
+        
+    def _build(self):
+        hrtfset = self.hrtfset
+        cfN, num_indices = self.cfN, self.num_indices
+        cd_model, filtergroup_model = self.cd_model, self.filtergroup_model
+        engine, dtype = self.engine, self.dtype
+        cf = erbspace(self.cfmin, self.cfmax, cfN)
+                
+        if self.frontend is not None:
+            soundinput = self.frontend.soundinput
+        else:
+            # dummy sound, when we run apply() we replace it
+            sound = Sound((silence(1*ms), silence(1*ms)))
+            soundinput = DoNothingFilterbank(sound)
 
-        gfb = Gammatone(gains_fb,
-                        tile(cf, hrtfset_fb.nchannels))
+        # the channels are ordered by ear, index and then cf, the HRTFs of
+        # each ear being applied to the sound of the other ear
+        if self.shared_gammatone:
+            if self.frontend is not None:
+                gfb = self.frontend.gammatone
+            else:
+                gfb = Gammatone(Repeat(soundinput, cfN), tile(cf, 2))
+            hrirs = reshape(hrtfset.data, (2*num_indices, hrtfset.data.shape[2]))
+            ear = repeat([0, 1], num_indices*cfN)
+            index = tile(repeat(arange(num_indices), cfN), 2)
+            channel = tile(arange(cfN), 2*num_indices)
+            filtered = FFTConvolutionFilterbank(gfb, hrirs,
+                                                (1-ear)*cfN+channel,
+                                                ear*num_indices+index)
+        else:
+            hrtfset_fb = hrtfset.filterbank(
+                    RestructureFilterbank(soundinput, 
+                            indexmapping=repeat([1, 0], hrtfset.num_indices)))
+            filtered = Gammatone(Repeat(hrtfset_fb, cfN),
+                                 tile(cf, hrtfset_fb.nchannels))
         
-        compress = filtergroup_model['compress']
-        cochlea = FunctionFilterbank(gfb, lambda x:compress(clip(x, 0, Inf)))
+        cochlea = GainCompressFilterbank(filtered, self.gains, filtergroup_model['compress'],
+                                         dtype=dtype)
+        
+        # the synaptic connectivity
+        pre_L, pre_R, _, _ = self._connectivity()
+        post = arange(num_indices*cfN)
+
+        self.soundinput = soundinput
+        self.cochlea = cochlea
+        if engine=='numpy':
+            self.network = NumpyNetwork(cochlea, filtergroup_model, cd_model,
+                                        pre_L, pre_R, dtype=dtype)
+            self.filtergroup = self.network.filtergroup
+            self.synchronygroup = self.network.synchronygroup
+            self.synapses = None
+            self.counter = self.network.counter
+            return
         
         # Create the filterbank group
         eqs = Equations(filtergroup_model['eqs'], **filtergroup_model['parameters'])
@@ -74,27 +150,66 @@ class IdealFilteringModel(object):
         
         # set up the synaptic connectivity
         cd_weight = cd_model['weight']
-        C = Connection(G, cd, 'target_var')
-        for i in xrange(num_indices*cfN):
-            C[i, i] = cd_weight
-            C[i+num_indices*cfN, i] = cd_weight
+        C = makeconnection(G, cd, hstack((pre_L, pre_R)),
+                           hstack((post, post)), cd_weight)
 
-        self.soundinput = soundinput
         self.filtergroup = G
         self.synchronygroup = cd
         self.synapses = C
         self.counter = SpikeCounter(cd)
         self.network = Network(G, cd, C, self.counter)
         
-    def __call__(self, sound, index=None, **indexkwds):
+    def save(self, path):
         '''
-        Apply ideal filtering group to given sound, which should be a
-        stereo sound unless you specify the HRTF index, or coordinates of
-        the HRTF index as keyword arguments, in which case it should be a mono
-        sound which will have the given HRTF applied to it. You can also
-        specify index=hrtf. Returns the spike count of the neurons in the synchrony
-        group with shape (cfN, num_indices).
+        Saves the normalisation gains of the model and its parameters to the
+        file path (see snapshot.py).
+        '''
+        arrays = {}
+        if self.gains is not None:
+            arrays['gains'] = self.gains
+        save_model(path, self,
+                   dict(cfmin=self.cfmin, cfmax=self.cfmax, cfN=self.cfN,
+                        shared_gammatone=self.shared_gammatone),
+                   arrays)
+
+    @classmethod
+    def load(cls, path, hrtfset, cd_model=standard_cd_model,
+             filtergroup_model=standard_filtergroup_model, engine='brian',
+             dtype=float, frontend=None):
+        '''
+        Returns the model saved in the file path with the save method, for
+        the same hrtfset. The other arguments are as for the constructor.
         '''
+        params, arrays = load_model(path, cls, hrtfset)
+        self = cls.__new__(cls)
+        self.hrtfset = hrtfset
+        self.cfmin, self.cfmax = params['cfmin']*Hz, params['cfmax']*Hz
+        self.cfN = int(params['cfN'])
+        self.cd_model = cd_model
+        self.filtergroup_model = filtergroup_model
+        if engine not in ('brian', 'numpy'):
+            raise ValueError("engine should be 'brian' or 'numpy'")
+        self.engine = engine
+        self.dtype = dtype
+        if frontend is not None:
+            frontend.check(self.cfmin, self.cfmax, self.cfN)
+        self.frontend = frontend
+        self.shared_gammatone = bool(params['shared_gammatone']) or frontend is not None
+        self.num_indices = hrtfset.num_indices
+        self.gains = arrays['gains']
+        self._build()
+        return self
+
+    def _connectivity(self):
+        '''
+        Returns (pre_L, pre_R, delays_L, delays_R), the filter neurons and
+        delays (None, there are no delays) of the two inputs of each
+        coincidence detector.
+        '''
+        post = arange(self.num_indices*self.cfN)
+        return post, post+self.num_indices*self.cfN, None, None
+
+    def _prepare_sound(self, sound, index=None, **indexkwds):
         hrtf = None
         if index is not None:
             hrtf = self.hrtfset[index]
@@ -104,14 +219,42 @@ class IdealFilteringModel(object):
             hrtf = self.hrtfset(**indexkwds)
         if hrtf is not None:
             sound = hrtf(sound)
+        return sound
+
+    def __call__(self, sound, index=None, report='stderr', seed=None,
+                 **indexkwds):
+        '''
+        Apply ideal filtering group to given sound, which should be a
+        stereo sound unless you specify the HRTF index, or coordinates of
+        the HRTF index as keyword arguments, in which case it should be a mono
+        sound which will have the given HRTF applied to it. You can also
+        specify index=hrtf. Returns the spike count of the neurons in the synchrony
+        group with shape (cfN, num_indices).
+        
+        The progress is reported as for Network.run, use report=None to
+        silence it. With a seed, the random initial state and noise are drawn
+        from a generator seeded with it (see model_pool.reset_model).
+        '''
+        sound = self._prepare_sound(sound, index, **indexkwds)
         self.soundinput.source = sound
-        self.network.reinit()
-        self.filtergroup_model['init'](self.filtergroup,
-                                       self.filtergroup_model['parameters'])
-        self.cd_model['init'](self.synchronygroup, self.cd_model['parameters'])
-        self.network.run(sound.duration, report='stderr')
-        count = reshape(self.counter.count, (self.num_indices, self.cfN)).T
-        return count
+        reset_model(self, seed)
+        self.network.run(sound.duration, report=report)
+        return self._format_count(self.counter.count)
+
+    def estimate(self, sound, index=None, confidence=0.99, segment=10*ms,
+                 min_duration=0*ms, seed=None, **indexkwds):
+        '''
+        Estimates the location of the sound (given as for __call__), stopping
+        the simulation as soon as the leading location is decisively ahead.
+        Returns (index, confidence, duration), see early_estimate in
+        decision.py.
+        '''
+        return early_estimate(self, sound, index, confidence=confidence,
+                              segment=segment, min_duration=min_duration,
+                              seed=seed, **indexkwds)
+
+    def _format_count(self, count):
+        return reshape(count, (self.num_indices, self.cfN)).T
 
 if __name__=='__main__':
     
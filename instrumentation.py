@@ -0,0 +1,204 @@
+'''
+Profiling of the stages of the models.
+
+A ModelProfiler attached to a model (any of the three, with either engine)
+wraps the methods that do the work of each stage of the simulation, and
+records for each stage the number of calls, the time spent in the stage
+itself (excluding the time spent in other stages it calls, e.g. a filterbank
+fetching from its source) and a histogram of the latency of each call. The
+stages are:
+
+* each filterbank of the cochlear model, one call per buffer (for a
+  SharedOutputFilterbank, e.g. the Gammatone of a shared front end, one call
+  per fetch of each of the models using it);
+* with Brian, the update and reset of the filter and coincidence detector
+  groups (one call per time step), the propagation of the filter spikes
+  through the delayed connection and the spike counter;
+* with the numpy engine, the filter neurons, the synaptic input and the
+  coincidence detectors, one call per buffer.
+
+Nothing is changed in the model when the profiler is not attached. Use it
+as::
+
+    with ModelProfiler(model) as profiler:
+        count = model(sound, index, report=None)
+    result = profiler.result()
+
+or profile_model(model, sound, index) which does this and also records the
+total time. The result is a dict that can be written as JSON.
+'''
+from shared import *
+from filterbanks import SharedOutputFilterbank
+from timeit import default_timer
+from collections import OrderedDict
+
+__all__ = ['ModelProfiler', 'profile_model', 'latency_bins']
+
+# edges of the latency histograms in seconds, from 1 us to 10 s, the first
+# and last bins of the histograms are below and above these
+latency_bins = 10**arange(-6, 1.001, 0.25)
+
+class StageStats(object):
+    '''
+    Call count, total time and latency histogram of one stage.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.time = 0.0
+        self.histogram = zeros(len(latency_bins)+1, dtype=int)
+
+    def add(self, time, latency):
+        self.calls += 1
+        self.time += time
+        self.histogram[searchsorted(latency_bins, latency)] += 1
+
+    def result(self):
+        return {'calls':self.calls,
+                'time':self.time,
+                'mean_time':self.time/self.calls if self.calls else 0.0,
+                'histogram':[int(c) for c in self.histogram]}
+
+class ModelProfiler(object):
+    '''
+    Records the time spent in each stage of the model, see the module
+    docstring. Use attach() and detach(), or a with statement. The results
+    accumulate over runs until reset() is called.
+    '''
+    def __init__(self, model):
+        self.model = model
+        self.stages = OrderedDict()
+        self.wrapped = []
+        # time spent in nested stages, for each stage currently running
+        self.stack = []
+
+    def attach(self):
+        if self.wrapped:
+            return
+        model = self.model
+        for name, filterbank in _filterbank_stages(model.cochlea):
+            # a SharedOutputFilterbank overrides buffer_fetch, and only calls
+            # its source when a model fetches samples not computed yet
+            if isinstance(filterbank, SharedOutputFilterbank):
+                self._wrap(filterbank, 'buffer_fetch', name)
+            else:
+                self._wrap(filterbank, 'buffer_fetch_next', name)
+        network = model.network
+        if model.engine=='numpy':
+            self._wrap(network, '_update_filtergroup', 'filtergroup')
+            self._wrap(network, '_synaptic_input', 'synapses')
+            self._wrap(network, '_update_synchronygroup', 'synchronygroup')
+        else:
+            for name in ['filtergroup', 'synchronygroup']:
+                group = getattr(model, name)
+                self._wrap(group, 'update', name)
+                self._wrap(group, 'reset', name+' reset')
+            self._wrap(model.synapses, 'do_propagate', 'synapses')
+            self._wrap(model.counter, 'do_propagate', 'counter')
+            # the network keeps the methods to call at each time step
+            network.prepared = False
+
+    def detach(self):
+        for obj, attr in self.wrapped:
+            delattr(obj, attr)
+        self.wrapped = []
+        if self.model.engine!='numpy':
+            self.model.network.prepared = False
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.detach()
+
+    def reset(self):
+        for stage in self.stages.values():
+            stage.reset()
+
+    def _wrap(self, obj, attr, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        stage = self.stages[name]
+        method = getattr(obj, attr)
+        stack = self.stack
+        def wrapper(*args, **kwds):
+            stack.append(0.0)
+            start = default_timer()
+            try:
+                return method(*args, **kwds)
+            finally:
+                latency = default_timer()-start
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += latency
+                stage.add(latency-nested, latency)
+        setattr(obj, attr, wrapper)
+        self.wrapped.append((obj, attr))
+
+    def result(self):
+        '''
+        Returns a dict with the keys stages, a dict with the stage names as
+        keys and for each one a dict with the keys calls, time, mean_time and
+        histogram (the number of calls in each latency bin), and
+        latency_bins, the edges of the bins.
+        '''
+        stages = OrderedDict((name, stage.result())
+                             for name, stage in self.stages.items())
+        return {'stages':stages,
+                'latency_bins':[float(x) for x in latency_bins]}
+
+    def report(self, file=None):
+        '''
+        Prints a table of the time spent in each stage (to stdout by default).
+        '''
+        if file is None:
+            file = sys.stdout
+        total = sum([stage.time for stage in self.stages.values()])
+        for stage in self.stages.values():
+            file.write('%-28s %10d calls %10.3f s %5.1f%%\n'%(
+                    stage.name, stage.calls, stage.time,
+                    100*stage.time/total if total else 0.0))
+
+def _filterbank_stages(filterbank):
+    # (name, filterbank) for the filterbanks in the chain, from the input to
+    # the output, with a number added to repeated class names
+    stages = []
+    def visit(fb):
+        if not isinstance(fb, Filterbank):
+            return
+        for _, f in stages:
+            if f is fb:
+                return
+        sources = fb.source if isinstance(fb.source, tuple) else (fb.source,)
+        for source in sources:
+            visit(source)
+        stages.append((fb.__class__.__name__, fb))
+    visit(filterbank)
+    names = [name for name, _ in stages]
+    for i, (name, fb) in enumerate(stages):
+        if names.count(name)>1:
+            stages[i] = ('%s %d'%(name, names[:i].count(name)+1), fb)
+    return stages
+
+def profile_model(model, sound, index=None, **indexkwds):
+    '''
+    Runs the model on the sound (as for the __call__ method of the model,
+    without progress report) with a ModelProfiler attached. Returns (count,
+    result) where the result of the profiler also has the keys total_time
+    (the time of the whole call), duration (of the sound) and realtime_factor
+    (duration/total_time).
+    '''
+    profiler = ModelProfiler(model)
+    start = default_timer()
+    with profiler:
+        count = model(sound, index, report=None, **indexkwds)
+    total_time = default_timer()-start
+    result = profiler.result()
+    duration = float(sound.duration)
+    result.update(total_time=total_time, duration=duration,
+                  realtime_factor=duration/total_time)
+    return count, result
@@ -0,0 +1,17 @@
+'''
+The equations of the standard neuron models of models.py, importable without
+Brian, so that the numpy engine can check that a model uses them.
+'''
+
+__all__ = ['standard_filtergroup_eqs', 'standard_cd_eqs']
+
+standard_filtergroup_eqs = '''
+          dv/dt = (-(v-El)+R*I)/tau + mu/tau + sigma*xi*(2/tau)**0.5 : volt
+          I : amp
+          target_var = I
+          '''
+
+standard_cd_eqs = '''
+          dv/dt = -v/tau+sigma*(2./tau)**.5*xi : 1
+          target_var = v
+          '''
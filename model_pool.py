@@ -0,0 +1,321 @@
+'''
+A pool of built models, for applications answering many localisation
+requests.
+
+Building a model (the filterbanks, neuron groups and connections) takes much
+longer than resetting it, so a ModelPool keeps the models it has built, keyed
+by hrtfset, cochlear range, model and model arguments, and lends them out
+for each request. The models not in use are evicted, least recently used
+first, when their total memory footprint (as estimated by model_footprint)
+goes over max_bytes.
+
+The models reset themselves at each call with reset_model. Given a seed,
+the initial potentials are drawn from a random generator of the model,
+reseeded for each call, into buffers of the model that are reused from one
+call to the next, and copied into the existing state arrays of the groups,
+so that setting up a call does not allocate any arrays (with numpy 1.17 or
+later, older versions draw into a temporary array). With the numpy engine
+the noise comes from the same generator, so the count for a sound only
+depends on the seed, whatever other models do at the same time. With the
+Brian engine the noise comes from numpy's global generator, which
+reset_model seeds as well; a ModelPool therefore only lends Brian engine
+models to one thread at a time (see ModelPool).
+
+Only numpy and the standard library are imported here, the models are
+imported when they are built.
+'''
+import numpy
+import numpy.random
+from numpy import ndarray
+from cache import cache_key
+import threading, gc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+__all__ = ['reset_model', 'model_footprint', 'ModelPool']
+
+try:
+    from numpy.random import Generator, PCG64
+except ImportError:
+    Generator = PCG64 = None
+
+def _random_state(model, seed):
+    # the generator of the model seeded with seed, reusing that of the
+    # previous call when it can be reseeded in place
+    if Generator is not None:
+        random_state = Generator(PCG64(seed))
+    else:
+        random_state = getattr(model, '_random_state', None)
+        if random_state is None:
+            random_state = numpy.random.RandomState(seed)
+        else:
+            random_state.seed(seed)
+    model._random_state = random_state
+    return random_state
+
+def _random_sample(random_state, out):
+    # fills out with uniform numbers in [0, 1) from the generator
+    if Generator is not None and isinstance(random_state, Generator):
+        random_state.random(out=out)
+    else:
+        out[:] = random_state.random_sample(len(out))
+
+def _init_group(model, group, random_state, buffers):
+    # the init function of the model, drawing the initial v in place from
+    # the generator if the function declares it is uniform (uniform_v, see
+    # models.py), other init functions are called as they are
+    init = model['init']
+    params = model['parameters']
+    uniform_v = getattr(init, 'uniform_v', None)
+    if uniform_v is None:
+        init(group, params)
+        return
+    low, high = uniform_v(params)
+    n = len(group)
+    buffer = buffers.get(n)
+    if buffer is None:
+        buffer = buffers[n] = numpy.empty(n)
+    _random_sample(random_state, buffer)
+    buffer *= float(high)-float(low)
+    buffer += float(low)
+    # for Brian groups as for NumpyGroup, group.v is a view of the state
+    v = group.v
+    v[:] = buffer
+
+def reset_model(model, seed=None, network=None, filtergroup=None,
+                synchronygroup=None):
+    '''
+    Resets the network of a model (any of the three, with either engine) to
+    the start of a simulation, and sets the initial potentials of its groups
+    as its init functions do. With a seed, the random numbers come from the
+    generator of the model seeded with it (and with the Brian engine, the
+    noise from numpy's global generator seeded with it), otherwise from
+    numpy's global generator as it is. The seed can be anything accepted by
+    RandomState, e.g. an int or a sequence of ints.
+
+    The network and groups are those of the model unless they are given,
+    e.g. the network for several sounds of run_batch, or that of a
+    ParameterSweep. Every function that runs a model resets it with this,
+    so the results only depend on the seed, not on the previous calls.
+    '''
+    if network is None:
+        network = model.network
+    if filtergroup is None:
+        filtergroup = model.filtergroup
+    if synchronygroup is None:
+        synchronygroup = model.synchronygroup
+    network.reinit()
+    random_state = numpy.random
+    if seed is not None:
+        random_state = _random_state(model, seed)
+        if model.engine!='numpy':
+            numpy.random.seed(seed)
+    if model.engine=='numpy':
+        network.random_state = random_state
+    buffers = model.__dict__.setdefault('_reset_buffers', {})
+    _init_group(model.filtergroup_model, filtergroup, random_state, buffers)
+    _init_group(model.cd_model, synchronygroup, random_state, buffers)
+
+def _filterbanks(filterbank):
+    # the filterbank and all the filterbanks it is built on
+    found = {}
+    stack = [filterbank]
+    while stack:
+        fb = stack.pop()
+        if not hasattr(fb, 'buffer_fetch') or id(fb) in found:
+            continue
+        found[id(fb)] = fb
+        source = getattr(fb, 'source', None)
+        if isinstance(source, (list, tuple)):
+            stack.extend(source)
+        elif source is not None:
+            stack.append(source)
+    return list(found.values())
+
+def model_footprint(model):
+    '''
+    Returns an estimate in bytes of the memory used by the model: the arrays
+    held by the model, its filterbanks (e.g. their buffers and filter
+    states), its groups and its network, plus 24 bytes per synapse for the
+    Connection of the Brian engine. Sounds are not counted.
+    '''
+    objects = [model, model.network, model.filtergroup, model.synchronygroup,
+               model.counter]+_filterbanks(model.cochlea)
+    seen = set()
+    total = 0
+    for obj in objects:
+        for value in getattr(obj, '__dict__', {}).values():
+            if isinstance(value, ndarray) and id(value) not in seen:
+                seen.add(id(value))
+                total += value.nbytes
+    if model.synapses is not None:
+        total += 2*len(model.synchronygroup)*24
+    return total
+
+def _hashable(value):
+    # the value as part of a key, objects that cannot be hashed (e.g. the
+    # neuron model dicts) by identity
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return ('id', id(value))
+
+def _hrtfset_key(hrtfset):
+    # cache_key of the HRTFs of the hrtfset, computed on the first call and
+    # kept as an attribute of the hrtfset
+    key = getattr(hrtfset, '_model_pool_key', None)
+    if key is None:
+        key = cache_key(hrtfset.data, float(hrtfset.samplerate))
+        hrtfset._model_pool_key = key
+    return key
+
+def _build_model(model, hrtfset, *modelargs, **modelkwds):
+    # imported here so that the pool can be imported without Brian
+    from sweep import model_class
+    return model_class(model)(hrtfset, *modelargs, **modelkwds)
+
+class ModelPool(object):
+    '''
+    A thread-safe pool of models. For example::
+
+        pool = ModelPool(max_bytes=2*1024**3)
+        with pool.model('approximate', hrtfset, (cfmin, cfmax, cfN)) as model:
+            count = model(sound, index, seed=request_seed)
+
+    The model is given as for sweep.localisation_sweep: 'approximate',
+    'ideal' or 'allpairs', the positional arguments modelargs after the
+    hrtfset ((cfmin, cfmax, cfN), or for the all pairs model (cfmin, cfmax,
+    cfN, gain_max, gain_N, delay_max, delay_N)) and keyword arguments
+    modelkwds, e.g. engine='numpy'. The
+    HRTFs are identified by their data and samplerate, the neuron models of
+    modelkwds (cd_model, filtergroup_model) by identity.
+
+    A model is only lent to one thread at a time: if several threads ask
+    for the same model, another one is built. Models are built outside the
+    lock, so building does not hold up the other threads. When the models
+    not in use take more than max_bytes, the least recently used are
+    evicted. The models in use are not counted.
+
+    The noise of the Brian engine comes from numpy's global generator, which
+    is shared by all the threads, so Brian engine models (engine='brian',
+    the default) are only lent to one thread at a time: acquire waits until
+    the thread holding one has released it, and a thread can hold several.
+    They must be released by the thread that acquired them. Models with the
+    numpy engine can be used by any number of threads at once.
+
+    The models are built by builder(model, hrtfset, *modelargs,
+    **modelkwds), by default the class of sweep.model_class.
+    '''
+    def __init__(self, max_bytes=1024**3, builder=None):
+        self.max_bytes = max_bytes
+        if builder is None:
+            builder = _build_model
+        self.builder = builder
+        self.lock = threading.Lock()
+        # held by the thread using Brian engine models, one count per model
+        self.brian_lock = threading.RLock()
+        # key -> list of (model, footprint) not in use, least recently used
+        # key first
+        self.idle = OrderedDict()
+        self.idle_bytes = 0
+        # id(model) -> (key, whether it holds brian_lock) for the models in
+        # use
+        self.in_use = {}
+        self.num_built = 0
+        self.num_evicted = 0
+
+    def key(self, model, hrtfset, modelargs=(), **modelkwds):
+        '''
+        Returns the key of the model in the pool.
+        '''
+        return (model, _hrtfset_key(hrtfset),
+                tuple(float(x) for x in modelargs),
+                tuple((name, _hashable(value))
+                      for name, value in sorted(modelkwds.items())))
+
+    def acquire(self, model, hrtfset, modelargs=(), **modelkwds):
+        '''
+        Returns a model from the pool, building it if there is none available,
+        which should be given back with release when done.
+        '''
+        key = self.key(model, hrtfset, modelargs, **modelkwds)
+        brian = modelkwds.get('engine', 'brian')!='numpy'
+        if brian:
+            self.brian_lock.acquire()
+        try:
+            with self.lock:
+                instances = self.idle.get(key)
+                if instances:
+                    instance, footprint = instances.pop()
+                    self.idle_bytes -= footprint
+                    if not instances:
+                        del self.idle[key]
+                    self.in_use[id(instance)] = (key, brian)
+                    return instance
+            instance = self.builder(model, hrtfset, *modelargs, **modelkwds)
+            with self.lock:
+                self.num_built += 1
+                self.in_use[id(instance)] = (key, brian)
+            return instance
+        except:
+            if brian:
+                self.brian_lock.release()
+            raise
+
+    def release(self, instance):
+        '''
+        Gives back a model obtained with acquire, and evicts the least
+        recently used models if the pool is over its memory budget.
+        '''
+        footprint = model_footprint(instance)
+        evicted = []
+        with self.lock:
+            key, brian = self.in_use.pop(id(instance))
+            self.idle.setdefault(key, []).append((instance, footprint))
+            # most recently used last
+            self.idle[key] = self.idle.pop(key)
+            self.idle_bytes += footprint
+            while self.idle_bytes>self.max_bytes and self.idle:
+                oldest = next(iter(self.idle))
+                instances = self.idle[oldest]
+                evicted.append(instances.pop(0))
+                self.idle_bytes -= evicted[-1][1]
+                if not instances:
+                    del self.idle[oldest]
+            self.num_evicted += len(evicted)
+        if brian:
+            self.brian_lock.release()
+        if evicted:
+            del evicted[:]
+            gc.collect()
+
+    @contextmanager
+    def model(self, model, hrtfset, modelargs=(), **modelkwds):
+        '''
+        Context manager version of acquire and release.
+        '''
+        instance = self.acquire(model, hrtfset, modelargs, **modelkwds)
+        try:
+            yield instance
+        finally:
+            self.release(instance)
+
+    def clear(self):
+        '''
+        Evicts all the models not in use.
+        '''
+        with self.lock:
+            self.idle.clear()
+            self.idle_bytes = 0
+        gc.collect()
+
+    def __len__(self):
+        '''
+        The number of models not in use.
+        '''
+        n = 0
+        with self.lock:
+            for instances in self.idle.values():
+                n += len(instances)
+        return n
@@ -1,4 +1,20 @@
 from brian import *
+from scipy import sparse
+from model_equations import standard_filtergroup_eqs, standard_cd_eqs
+
+__all__ = ['cube_root',
+           'standard_filtergroup_model', 'standard_filtergroup_model_params',
+           'standard_filtergroup_model_init',
+           'standard_cd_model', 'standard_cd_model_params',
+           'standard_cd_model_init',
+           'makemodel', 'initmodel', 'makeconnection']
+
+def cube_root(x):
+    '''
+    The standard compression of the filter neuron input (filterbanks.py
+    computes it in place with cbrt).
+    '''
+    return x**(1.0/3.0)
 
 # standard filter group model
 standard_filtergroup_model_params = Parameters(
@@ -12,18 +28,17 @@ standard_filtergroup_model_params = Parameters(
     )
 def standard_filtergroup_model_init(G, params):
     G.v = params.Vr+(params.Vt-params.Vr)*rand(len(G))
+# the range of the uniform initial v, so that model_pool.reset_model can draw
+# it in place with the generator of the model
+standard_filtergroup_model_init.uniform_v = lambda params: (params.Vr, params.Vt)
 standard_filtergroup_model = {
-    'eqs':'''
-          dv/dt = (-(v-El)+R*I)/tau + mu/tau + sigma*xi*(2/tau)**0.5 : volt
-          I : amp
-          target_var = I
-          ''',
+    'eqs':standard_filtergroup_eqs,
     'parameters':standard_filtergroup_model_params,
     'threshold':standard_filtergroup_model_params.Vt,
     'reset':standard_filtergroup_model_params.Vr,
     'refractory':5*ms,
     'init':standard_filtergroup_model_init,
-    'compress':lambda x:x**(1.0/3.0),
+    'compress':cube_root,
     }
 
 # standard coincidence detector model
@@ -33,11 +48,9 @@ standard_cd_model_params = Parameters(
     )
 def standard_cd_model_init(G, params):
     G.v = rand(len(G))
+standard_cd_model_init.uniform_v = lambda params: (0, 1)
 standard_cd_model = {
-    'eqs':'''
-          dv/dt = -v/tau+sigma*(2./tau)**.5*xi : 1
-          target_var = v
-          ''',
+    'eqs':standard_cd_eqs,
     'parameters':standard_cd_model_params,
     'threshold':1,
     'reset':0,
@@ -59,3 +72,45 @@ def makemodel(model, N, clock):
 
 def initmodel(model, group):
     model['init'](group, model['parameters'])
+
+def makeconnection(source, target, pre, post, weight, delay=None, max_delay=None):
+    '''
+    Creates a Connection from source to target (acting on target_var) with one
+    synapse from neuron pre[k] to neuron post[k] for each k, with the given
+    weight (a scalar or one value per synapse) and optionally heterogeneous
+    delays delay[k] (in seconds) up to max_delay.
+    
+    The weight (and delay) matrices are built in one go as sparse matrices
+    from the index arrays and given to connect (and set_delays), rather than
+    setting one synapse at a time, which makes construction of large
+    networks much faster. Zero delays are kept as explicit entries, so that
+    the delay matrix has the same structure as the weight matrix. Raises a
+    ValueError if a pair of neurons has several synapses, or a delay is
+    longer than max_delay.
+    '''
+    pre = asarray(pre, dtype=int)
+    post = asarray(post, dtype=int)
+    weight = ones(len(pre))*weight
+    I = lexsort((post, pre))
+    if any((diff(pre[I])==0)&(diff(post[I])==0)):
+        raise ValueError('Several synapses between the same pair of neurons.')
+    shape = (len(source), len(target))
+    if delay is None:
+        C = Connection(source, target, 'target_var')
+    else:
+        delay = ones(len(pre))*delay
+        # delays are truncated to a whole number of time steps, as by the
+        # DelayConnection, which wraps around after max_delay
+        dt = float(target.clock.dt)
+        if len(delay) and int(amax(delay)/dt)>int(float(max_delay)/dt):
+            raise ValueError('Delay %s is longer than max_delay=%s.'%(
+                             amax(delay), max_delay))
+        C = Connection(source, target, 'target_var', delay=True,
+                       max_delay=max_delay)
+    # the lil_matrix rows are sorted, with explicit zeros kept
+    C.connect(source, target,
+              sparse.coo_matrix((weight, (pre, post)), shape=shape).tolil())
+    if delay is not None:
+        C.set_delays(source, target,
+                     sparse.coo_matrix((delay, (pre, post)), shape=shape).tolil())
+    return C
@@ -0,0 +1,269 @@
+'''
+A pure numpy simulator for the filter and coincidence detector neurons, used
+by the models when they are initialised with engine='numpy'.
+
+The connectivity of the models is fixed (every coincidence detector receives
+exactly two inputs with a constant weight and fixed delays) and the neuron
+models in models.py are linear, so rather than going through the generic
+NeuronGroup/Connection/SpikeCounter machinery we integrate the equations
+directly. The filterbank output is fetched in chunks of buffersize samples;
+the filter neurons are integrated over the chunk, and then the (delayed)
+input to every coincidence detector over the whole chunk is looked up in one
+go from a history buffer of the last max_delay steps of filter neuron spikes.
+
+The simulation follows the same scheme as Brian (Euler integration, threshold
+v>Vt, reset and refractoriness, delays truncated to an integer number of
+time steps, synaptic input arriving after the state update and threshold
+but before the reset) so that the counts are statistically the same. Only the standard model equations from
+models.py are supported, but their parameters can be changed freely. The
+state variables, the noise and the synaptic input can be kept in single
+precision with dtype=float32.
+
+Only numpy is imported here (the standard equations are in
+model_equations.py), so the engine can be used and tested without Brian.
+'''
+from numpy import *
+import numpy.random
+from model_equations import standard_filtergroup_eqs, standard_cd_eqs
+
+__all__ = ['NumpyNetwork']
+
+class NumpyGroup(object):
+    '''
+    Minimal stand-in for a NeuronGroup, holding the membrane potential v so
+    that the init functions of models.py can be applied to it.
+    '''
+    def __init__(self, N, dtype=float):
+        self.N = N
+        self._v = zeros(N, dtype=dtype)
+    def __len__(self):
+        return self.N
+    def _set_v(self, v):
+        self._v[:] = asarray(v)
+    v = property(fget=lambda self:self._v, fset=_set_v)
+
+class NumpySpikeCounter(object):
+    '''
+    Stand-in for SpikeCounter, count is the number of spikes of each neuron.
+    '''
+    def __init__(self, N):
+        self.count = zeros(N, dtype=int)
+        self.nspikes = 0
+    def reinit(self):
+        self.count[:] = 0
+        self.nspikes = 0
+
+class _Spiking(object):
+    '''
+    Threshold, reset and refractoriness following Brian's conventions: a
+    neuron spikes if v>threshold and it is not refractory, and v is clamped
+    to the reset value for int(refractory/dt)+1 steps after a spike. The
+    refractory period can be one value per neuron. As in Brian, the
+    threshold (threshold) and the reset (reset_state) are separate, so that
+    synaptic input can be propagated between them.
+    '''
+    def __init__(self, group, threshold, reset, refractory, dt):
+        self.group = group
+        self.threshold = float(threshold)
+        self.reset = float(reset)
+        refractory = asarray(refractory, dtype=float)
+        self.refractory_steps = refractory/dt
+        self.period = array(refractory/dt, dtype=int)+1
+        self.refractory = bool(any(refractory>0))
+        self.reinit()
+    def reinit(self):
+        N = len(self.group)
+        if not hasattr(self, 'next_allowed'):
+            self.next_allowed = zeros(N)
+            self.last_spike = zeros(N, dtype=int)
+        self.next_allowed[:] = 0
+        self.last_spike[:] = -self.period
+    def threshold_spikes(self, step):
+        spikes = self.group.v>self.threshold
+        if self.refractory:
+            spikes &= self.next_allowed<=step
+            if self.refractory_steps.ndim:
+                self.next_allowed[spikes] = step+self.refractory_steps[spikes]
+            else:
+                self.next_allowed[spikes] = step+self.refractory_steps
+            self.last_spike[spikes] = step
+        return spikes
+    def reset_state(self, step, spikes):
+        v = self.group.v
+        if self.refractory:
+            v[step-self.last_spike<self.period] = self.reset
+        else:
+            v[spikes] = self.reset
+    def __call__(self, step):
+        spikes = self.threshold_spikes(step)
+        self.reset_state(step, spikes)
+        return spikes
+
+def _parameter(model, values, name, dtype):
+    # the per-neuron values of a parameter if they are given, otherwise its
+    # value in the model
+    if values is not None and name in values:
+        return asarray(values[name], dtype=dtype)
+    if name in ('weight', 'refractory'):
+        return float(model[name])
+    return float(getattr(model['parameters'], name))
+
+def _check_model(model, eqs):
+    if model['eqs']!=eqs:
+        raise ValueError("The numpy engine only supports the standard model "
+                         "equations from models.py.")
+
+class NumpyNetwork(object):
+    '''
+    Simulates the filter neurons driven by the cochlea filterbank and the
+    coincidence detectors. Coincidence detector i receives input from filter
+    neurons pre_L[i] and pre_R[i] with delays delays_L[i] and delays_R[i] (in
+    seconds, or None for no delays), all with the weight of the cd_model.
+    The filterbank output and the state of the neurons are of type dtype.
+
+    Has the attributes filtergroup, synchronygroup and counter which behave
+    like the corresponding Brian objects for the purposes of the models, and
+    methods reinit() and run(duration) like a Brian Network. Successive calls
+    to run continue the simulation.
+
+    The parameters of the models (those of their equations, refractory and
+    the weight of the cd_model) can instead be given one value per neuron,
+    as arrays in the dicts filtergroup_values and cd_values with the
+    parameter names as keys (see parameter_sweep.py).
+
+    The noise is drawn from random_state, by default numpy's global random
+    generator, which can be replaced by a RandomState or Generator of its
+    own (see model_pool.reset_model). reinit() resets the state in place, without
+    allocating new arrays.
+    '''
+    def __init__(self, cochlea, filtergroup_model, cd_model,
+                 pre_L, pre_R, delays_L=None, delays_R=None, buffersize=32,
+                 dtype=float, filtergroup_values=None, cd_values=None):
+        _check_model(filtergroup_model, standard_filtergroup_eqs)
+        _check_model(cd_model, standard_cd_eqs)
+        self.cochlea = cochlea
+        self.samplerate = float(cochlea.samplerate)
+        self.dt = dt = 1/self.samplerate
+        self.buffersize = buffersize
+        self.dtype = dtype
+        self.random_state = numpy.random
+
+        p = lambda name: _parameter(filtergroup_model, filtergroup_values,
+                                    name, dtype)
+        self.filtergroup = NumpyGroup(cochlea.nchannels, dtype)
+        self.filter_spiking = _Spiking(self.filtergroup,
+                                       filtergroup_model['threshold'],
+                                       filtergroup_model['reset'],
+                                       p('refractory'), dt)
+        self.filter_a = dt/p('tau')
+        self.filter_b = p('El')+p('mu')
+        self.filter_R = p('R')
+        self.filter_noise = p('sigma')*sqrt(2*dt/p('tau'))
+
+        p = lambda name: _parameter(cd_model, cd_values, name, dtype)
+        self.synchronygroup = NumpyGroup(len(pre_L), dtype)
+        self.cd_spiking = _Spiking(self.synchronygroup,
+                                   cd_model['threshold'],
+                                   cd_model['reset'],
+                                   p('refractory'), dt)
+        self.cd_a = dt/p('tau')
+        self.cd_noise = p('sigma')*sqrt(2*dt/p('tau'))
+        self.cd_weight = p('weight')
+
+        self.counter = NumpySpikeCounter(len(pre_L))
+        # objects with an add(step, spikes) method called with the boolean
+        # array of coincidence detector spikes at every time step
+        self.monitors = []
+
+        self.pre_L = asarray(pre_L, dtype=int)
+        self.pre_R = asarray(pre_R, dtype=int)
+        if delays_L is None:
+            delays_L = zeros(len(pre_L))
+        if delays_R is None:
+            delays_R = zeros(len(pre_R))
+        # Brian truncates delays to a whole number of time steps
+        self.delay_steps_L = array(asarray(delays_L)*self.samplerate, dtype=int)
+        self.delay_steps_R = array(asarray(delays_R)*self.samplerate, dtype=int)
+        self.max_delay_steps = int(maximum(amax(self.delay_steps_L),
+                                           amax(self.delay_steps_R)))
+        # rows 0:max_delay_steps are the spikes from the previous steps,
+        # the remaining rows are filled with the spikes of the current chunk
+        self.history = zeros((self.max_delay_steps+self.buffersize,
+                              len(self.filtergroup)), dtype=bool)
+        self.reinit()
+
+    def reinit(self):
+        self.cochlea.buffer_init()
+        self.t = 0
+        self.filtergroup.v = 0
+        self.synchronygroup.v = 0
+        self.filter_spiking.reinit()
+        self.cd_spiking.reinit()
+        self.counter.reinit()
+        self.history[:] = False
+
+    def run(self, duration, report=None):
+        '''
+        Runs the simulation for the given duration. The report argument is
+        accepted for compatibility with Network.run and ignored.
+        '''
+        end = self.t+int(round(float(duration)*self.samplerate))
+        while self.t<end:
+            n = int(minimum(self.buffersize, end-self.t))
+            I = self.cochlea.buffer_fetch(self.t, self.t+n)
+            self._run_chunk(I)
+            self.t += n
+
+    def _run_chunk(self, I):
+        n = I.shape[0]
+        self._update_filtergroup(asarray(I, dtype=self.dtype))
+        inputs = self._synaptic_input(n)
+        self._update_synchronygroup(inputs)
+        # keep the last D steps of spikes for the next chunk
+        D = self.max_delay_steps
+        if D:
+            self.history[:D, :] = self.history[n:n+D, :].copy()
+
+    def _update_filtergroup(self, I):
+        # integrates the filter neurons over the chunk, storing their spikes
+        # in the history
+        n = I.shape[0]
+        D = self.max_delay_steps
+        history = self.history
+        v = self.filtergroup.v
+        a, b, R = self.filter_a, self.filter_b, self.filter_R
+        noise = asarray(self.filter_noise*self.random_state.standard_normal((n, len(v))), dtype=self.dtype)
+        for k in range(n):
+            v += a*(b-v+R*I[k, :])+noise[k, :]
+            history[D+k, :] = self.filter_spiking(self.t+k)
+
+    def _synaptic_input(self, n):
+        # delayed input to the coincidence detectors for the whole chunk
+        D = self.max_delay_steps
+        history = self.history
+        rows = D+arange(n).reshape((n, 1))
+        inputs = array(history[rows-self.delay_steps_L, self.pre_L], dtype=self.dtype)
+        inputs += history[rows-self.delay_steps_R, self.pre_R]
+        inputs *= self.cd_weight
+        return inputs
+
+    def _update_synchronygroup(self, inputs):
+        # integrates the coincidence detectors over the chunk and counts
+        # their spikes
+        n = inputs.shape[0]
+        v = self.synchronygroup.v
+        a = self.cd_a
+        noise = asarray(self.cd_noise*self.random_state.standard_normal((n, len(v))), dtype=self.dtype)
+        count = self.counter.count
+        spiking = self.cd_spiking
+        for k in range(n):
+            v += -a*v+noise[k, :]
+            spikes = spiking.threshold_spikes(self.t+k)
+            count += spikes
+            for monitor in self.monitors:
+                monitor.add(self.t+k, spikes)
+            # Brian propagates the spikes before the reset, so input arriving
+            # at a neuron that spikes in this step is lost
+            v += inputs[k, :]
+            spiking.reset_state(self.t+k, spikes)
+        self.counter.nspikes = int(sum(count))
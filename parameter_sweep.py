@@ -0,0 +1,219 @@
+'''
+Sweeps of the parameters of the neuron models in a single simulation.
+
+Rather than building and running a model for each value of the parameters
+of its filter neurons or coincidence detectors (see models.py), a
+ParameterSweep replicates the neurons of a built model once for every
+combination of a grid of values, and runs them all together. The cochlear
+filterbank of the model is shared by all of them. If filter neuron
+parameters are swept, its output is tiled so that each combination of
+these has its own filter neurons. Each combination of coincidence detector
+parameters has its own coincidence detectors, connected to the filter
+neurons of its filter combination as in the model.
+
+The swept parameters are per-neuron state variables instead of constants:
+with Brian each parameter p in the equations of the model is replaced by
+p_swept*p_unit, where p_swept is a dimensionless state variable set to the
+values of each neuron (in SI units), with the numpy engine the parameters
+are given as arrays to the NumpyNetwork. The parameters that can be swept
+are those appearing in the equations of the model, refractory, and weight
+for the coincidence detectors (the weight of their synapses). The threshold
+and reset are shared by all the combinations.
+
+The result is a count array with one axis for each swept parameter
+followed by the axes of the count of the model.
+'''
+from shared import *
+from models import *
+from numpy_engine import *
+from model_pool import reset_model
+import re, itertools
+
+__all__ = ['ParameterSweep']
+
+def _grid(grid):
+    # list of (name, values) pairs, dicts are ordered by name
+    if grid is None:
+        return []
+    if isinstance(grid, dict):
+        grid = sorted(grid.items())
+    return [(name, list(values)) for name, values in grid]
+
+def _check_names(model, grid, extra, which):
+    for name, _ in grid:
+        if name in extra or name=='refractory':
+            continue
+        if name in model['parameters'].keys() and re.search(r'\b%s\b'%name, model['eqs']):
+            continue
+        raise ValueError(name+' cannot be swept for the '+which+', only the '
+                         'parameters of its equations, refractory'+
+                         ''.join(', '+e for e in extra)+' can be.')
+
+def _combinations(grid):
+    # array of shape (number of combinations, number of parameters) of the
+    # values in SI units, the last parameter varying fastest
+    if not grid:
+        return zeros((1, 0))
+    return array([[float(x) for x in values] for values in
+                  itertools.product(*[values for _, values in grid])])
+
+def _swept_equations(model, grid):
+    # the Equations of the model with the swept parameters (apart from
+    # refractory and weight) as dimensionless state variables
+    eqs = model['eqs']
+    parameters = model['parameters']
+    namespace = dict((name, parameters[name]) for name in parameters.keys())
+    for name, values in grid:
+        if name in ('refractory', 'weight'):
+            continue
+        eqs = re.sub(r'\b%s\b'%name, '(%s_swept*%s_unit)'%(name, name), eqs)
+        eqs += '\n%s_swept : 1\n'%name
+        namespace[name+'_unit'] = get_unit(values[0])
+        del namespace[name]
+    return Equations(eqs, **namespace)
+
+class ParameterSweep(object):
+    '''
+    Runs the model (any of the three, with either engine) for every
+    combination of the values of the filter neuron parameters in
+    filtergroup_grid and the coincidence detector parameters in cd_grid.
+    These are dicts or lists of (name, values) pairs, dicts being ordered by
+    name. For example::
+
+        sweep = ParameterSweep(model, cd_grid=[('tau', [0.5*ms, 1*ms, 2*ms]),
+                                               ('sigma', [0.05, 0.1, 0.2])])
+        count = sweep(sound, index)
+
+    gives count[i, j] the count of the model with the coincidence detector
+    tau of the value i and sigma of the value j. The filter parameters come
+    first in the axes, as in the names attribute, a list of ('filtergroup',
+    name) and ('cd', name) pairs.
+
+    The sweep uses the cochlea and sound input of the model, so calling the
+    model itself resets the sweep and vice versa.
+    '''
+    def __init__(self, model, cd_grid=None, filtergroup_grid=None):
+        self.model = model
+        filtergroup_model, cd_model = model.filtergroup_model, model.cd_model
+        self.filtergroup_grid = filtergroup_grid = _grid(filtergroup_grid)
+        self.cd_grid = cd_grid = _grid(cd_grid)
+        _check_names(filtergroup_model, filtergroup_grid, (), 'filter neurons')
+        _check_names(cd_model, cd_grid, ('weight',), 'coincidence detectors')
+        self.names = ([('filtergroup', name) for name, _ in filtergroup_grid]+
+                      [('cd', name) for name, _ in cd_grid])
+        self.shape = tuple(len(values) for _, values in filtergroup_grid+cd_grid)
+        filter_combinations = _combinations(filtergroup_grid)
+        cd_combinations = _combinations(cd_grid)
+        nf = len(filter_combinations)
+        nc = len(cd_combinations)
+        self.num_combinations = nf*nc
+
+        # the filter neurons of combination f are the block f of the tiled
+        # cochlea, the coincidence detectors of the combination (f, c) are
+        # the block f*nc+c
+        cochlea = model.cochlea
+        if nf>1:
+            cochlea = Tile(cochlea, nf)
+        Nf = model.cochlea.nchannels
+        pre_L, pre_R, delays_L, delays_R = model._connectivity()
+        Ncd = len(pre_L)
+        self.num_cd = Ncd
+        offsets = repeat(arange(nf)*Nf, nc)
+        pre_L = (offsets[:, newaxis]+pre_L[newaxis, :]).flatten()
+        pre_R = (offsets[:, newaxis]+pre_R[newaxis, :]).flatten()
+        if delays_L is not None:
+            delays_L = tile(delays_L, nf*nc)
+            delays_R = tile(delays_R, nf*nc)
+
+        # per-neuron values of the swept parameters
+        filtergroup_values = {}
+        for k, (name, _) in enumerate(filtergroup_grid):
+            filtergroup_values[name] = repeat(filter_combinations[:, k], Nf)
+        cd_values = {}
+        for k, (name, _) in enumerate(cd_grid):
+            cd_values[name] = repeat(tile(cd_combinations[:, k], nf), Ncd)
+        self.filtergroup_values = filtergroup_values
+        self.cd_values = cd_values
+
+        self.cochlea = cochlea
+        if model.engine=='numpy':
+            self.network = NumpyNetwork(cochlea, filtergroup_model, cd_model,
+                                        pre_L, pre_R, delays_L, delays_R,
+                                        dtype=model.dtype,
+                                        filtergroup_values=filtergroup_values,
+                                        cd_values=cd_values)
+            self.filtergroup = self.network.filtergroup
+            self.synchronygroup = self.network.synchronygroup
+            self.synapses = None
+            self.counter = self.network.counter
+            return
+
+        # Create the filterbank group
+        eqs = _swept_equations(filtergroup_model, filtergroup_grid)
+        G = FilterbankGroup(cochlea, 'target_var', eqs,
+                            threshold=filtergroup_model['threshold'],
+                            reset=filtergroup_model['reset'],
+                            **_refractory(filtergroup_model, filtergroup_values))
+
+        # create the synchrony group
+        cd_eqs = _swept_equations(cd_model, cd_grid)
+        cd = NeuronGroup(nf*nc*Ncd, cd_eqs,
+                         threshold=cd_model['threshold'],
+                         reset=cd_model['reset'],
+                         clock=G.clock,
+                         **_refractory(cd_model, cd_values))
+
+        # set up the synaptic connectivity
+        post = arange(nf*nc*Ncd)
+        weight = cd_values.get('weight', cd_model['weight']*ones(len(post)))
+        if delays_L is None:
+            C = makeconnection(G, cd, hstack((pre_L, pre_R)),
+                               hstack((post, post)), hstack((weight, weight)))
+        else:
+            C = makeconnection(G, cd, hstack((pre_L, pre_R)),
+                               hstack((post, post)), hstack((weight, weight)),
+                               delay=hstack((delays_L, delays_R)),
+                               max_delay=model.delay_max)
+
+        self.filtergroup = G
+        self.synchronygroup = cd
+        self.synapses = C
+        self.counter = SpikeCounter(cd)
+        self.network = Network(G, cd, C, self.counter)
+
+    def _set_values(self):
+        # the swept parameters are state variables, reset by reinit
+        for group, values in [(self.filtergroup, self.filtergroup_values),
+                              (self.synchronygroup, self.cd_values)]:
+            for name, value in values.items():
+                if name not in ('refractory', 'weight'):
+                    setattr(group, name+'_swept', value)
+
+    def __call__(self, sound, index=None, report='stderr', seed=None,
+                 **indexkwds):
+        '''
+        Applies every combination of parameters to the sound, given as for
+        the __call__ method of the model (including the seed). Returns the
+        count with shape self.shape followed by the shape of the count of the
+        model.
+        '''
+        model = self.model
+        sound = model._prepare_sound(sound, index, **indexkwds)
+        model.soundinput.source = sound
+        reset_model(model, seed, self.network, self.filtergroup,
+                    self.synchronygroup)
+        if model.engine=='brian':
+            self._set_values()
+        self.network.run(sound.duration, report=report)
+        counts = reshape(self.counter.count, (self.num_combinations, self.num_cd))
+        counts = array([model._format_count(count) for count in counts])
+        return reshape(counts, self.shape+counts.shape[1:])
+
+def _refractory(model, values):
+    # the refractory keywords of the group, with max_refractory for
+    # per-neuron values
+    if 'refractory' in values:
+        refractory = values['refractory']
+        return {'refractory':refractory*second,
+                'max_refractory':amax(refractory)*second}
+    return {'refractory':model['refractory']}
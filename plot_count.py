@@ -1,45 +1,186 @@
-from brian import *
+'''
+Plotting of the counts of the approximate and ideal filtering models for
+HRTF sets with the IRCAM LISTEN locations.
+
+Only numpy is imported here, matplotlib when something is drawn, so that the
+images can be computed without importing Brian or matplotlib.
+'''
+from numpy import *
+
+class IrcamPixelMap(object):
+    '''
+    The pixels of the 10x24 image of ircam_plot_count covered by each HRTF
+    index of an hrtfset with the IRCAM LISTEN locations (15 degree steps of
+    elevation from -45 to 90 degrees and of azimuth from -180 degrees, with
+    wider pixels above 45 degrees of elevation). Use ircam_pixel_map to get
+    the map of an hrtfset, which is only computed once.
+
+    Each pixel shows the last index covering it, as in a loop over the
+    indices in order.
+    '''
+    shape = (10, 24)
+
+    def __init__(self, coordinates):
+        elev = asarray(coordinates['elev'], dtype=float)
+        azim = asarray(coordinates['azim'], dtype=float)
+        self.num_indices = len(elev)
+        w = ones(len(elev), dtype=int)
+        w[elev==60] = 2
+        w[elev==75] = 4
+        w[elev==90] = 24
+        # the locations of the markers
+        self.azim = where(azim>=180, azim-360, azim)
+        self.elev = elev
+        azim = where(elev==90, -180, self.azim)
+        x = array((azim+180)/15, dtype=int)
+        y = array((elev+45)/15, dtype=int)
+        # (index, pixel) pairs, in the order of the indices
+        index = repeat(arange(len(w)), w)
+        x = repeat(x, w)+(arange(len(index))-repeat(cumsum(w)-w, w))
+        y = repeat(y, w)
+        inside = x<self.shape[1]
+        self.pair_index = index[inside]
+        self.pair_pixel = (y*self.shape[1]+x)[inside]
+        self.owner = self._owner(ones(self.num_indices, dtype=bool))
+
+    def _owner(self, selected):
+        # the last selected index covering each pixel, or -1
+        sel = selected[self.pair_index]
+        index = self.pair_index[sel]
+        pixel = self.pair_pixel[sel]
+        order = lexsort((index, pixel))
+        index, pixel = index[order], pixel[order]
+        last = hstack((pixel[1:]!=pixel[:-1], True)) if len(pixel) else zeros(0, dtype=bool)
+        owner = -ones(self.shape[0]*self.shape[1], dtype=int)
+        owner[pixel[last]] = index[last]
+        return owner
+
+    def images(self, values, I=None):
+        '''
+        Returns the images of shape (n, 10, 24) for values of shape (n,
+        num_indices), e.g. the counts of n results summed over channels,
+        with zeros in the pixels not covered. If I is given, only the indices
+        in I are shown.
+        '''
+        values = asarray(values, dtype=float)
+        if values.ndim==1:
+            values = reshape(values, (1, len(values)))
+        if I is None:
+            owner = self.owner
+        else:
+            selected = zeros(self.num_indices, dtype=bool)
+            selected[asarray(I, dtype=int)] = True
+            owner = self._owner(selected)
+        covered = owner>=0
+        img = zeros((values.shape[0], len(owner)))
+        img[:, covered] = values[:, owner[covered]]
+        return reshape(img, (values.shape[0],)+self.shape)
+
+    def location(self, index):
+        '''
+        Returns the (azim, elev) at which index is plotted, azim being in
+        [-180, 180).
+        '''
+        return self.azim[index], self.elev[index]
+
+def ircam_pixel_map(hrtfset):
+    '''
+    Returns the IrcamPixelMap of the hrtfset, computed on the first call and
+    kept as an attribute of the hrtfset.
+    '''
+    pixelmap = getattr(hrtfset, '_ircam_pixel_map', None)
+    if pixelmap is None:
+        pixelmap = IrcamPixelMap(hrtfset.coordinates)
+        hrtfset._ircam_pixel_map = pixelmap
+    return pixelmap
+
+def ircam_count_images(hrtfset, counts, I=None):
+    '''
+    Returns the images of ircam_plot_count, with shape (n, 10, 24), for n
+    counts given as an array of shape (n, cfN, num_indices), or (n,
+    num_indices) for counts already summed over the channels.
+    '''
+    counts = asarray(counts, dtype=float)
+    if counts.ndim==3:
+        counts = sum(counts, axis=1)
+    return ircam_pixel_map(hrtfset).images(counts, I)
+
+extent = (-180-7.5, 180-7.5, -45-7.5, 90+7.5)
 
 def ircam_plot_count(hrtfset, count, index=None, showbest=True, absolute=False,
                      vmin=None, vmax=None, I=None, ms=20, mew=2, indexcol='k', bestcol='w'):
-    count = array(count, dtype=float)
-    num_indices = hrtfset.num_indices
-    count = sum(count, axis=0)
-    if I is None: I = arange(num_indices)
-    img = zeros((10, 24))
-    for i, c in enumerate(count):
-        if i in I:
-            elev = hrtfset.coordinates['elev'][i]
-            azim = hrtfset.coordinates['azim'][i]
-            if elev<60:
-                w = 1
-            elif elev==60:
-                w = 2
-            elif elev==75:
-                w = 4
-            elif elev==90:
-                w = 24
-                azim = -180
-            if azim>=180: azim -= 360
-            x = int((azim+180)/15)
-            y = int((elev+45)/15)
-            img[y, x:x+w] = c
+    from pylab import imshow, axis, plot
+    pixelmap = ircam_pixel_map(hrtfset)
+    count = sum(array(count, dtype=float), axis=0)
+    img = pixelmap.images(count, I)[0]
     if absolute:
-        imshow(img, origin='lower left', interpolation='nearest', extent=(-180-7.5, 180-7.5, -45-7.5, 90+7.5),
+        imshow(img, origin='lower left', interpolation='nearest', extent=extent,
                vmin=vmin, vmax=vmax)
         axis('tight')
     else:
-        imshow(img, origin='lower left', interpolation='nearest', extent=(-180-7.5, 180-7.5, -45-7.5, 90+7.5))
+        imshow(img, origin='lower left', interpolation='nearest', extent=extent)
         axis('tight')
     if index is not None:
-        azim = hrtfset.coordinates['azim'][index]
-        elev = hrtfset.coordinates['elev'][index]
-        if azim>=180: azim -= 360
+        azim, elev = pixelmap.location(index)
         plot([azim], [elev], '+', ms=ms, mew=mew, color=indexcol)
     if showbest:
-        i = argmax(count)
-        azim = hrtfset.coordinates['azim'][i]
-        elev = hrtfset.coordinates['elev'][i]
-        if azim>=180: azim -= 360
+        azim, elev = pixelmap.location(argmax(count))
         plot([azim], [elev], 'x', ms=ms, mew=mew, color=bestcol)
     return img
+
+def ircam_save_count_grids(hrtfset, counts, filename, indices=None,
+                           titles=None, rows=4, cols=6, absolute=False,
+                           vmin=None, vmax=None, showbest=True, ms=8, mew=1.5,
+                           indexcol='k', bestcol='w', panelsize=2.5, dpi=80):
+    '''
+    Renders the counts (as for ircam_count_images) as images like those of
+    ircam_plot_count, in grids of rows*cols panels, one PNG file per grid.
+    The filename should contain %d, which is replaced by the number of the
+    grid. indices, if given, are the true HRTF index of each count (marked
+    with +), and titles a title for each panel. With absolute=True all the
+    panels have the same colour scale, from vmin to vmax (by default the
+    range of all the images).
+
+    The figures are drawn with the Agg backend directly, without pyplot, so
+    this works without a display and does not affect the current figure.
+    Returns the list of the files written.
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    pixelmap = ircam_pixel_map(hrtfset)
+    counts = asarray(counts, dtype=float)
+    if counts.ndim==3:
+        counts = sum(counts, axis=1)
+    images = pixelmap.images(counts)
+    best = argmax(counts, axis=1)
+    if absolute:
+        if vmin is None:
+            vmin = amin(images)
+        if vmax is None:
+            vmax = amax(images)
+    else:
+        vmin = vmax = None
+    perpage = rows*cols
+    filenames = []
+    for page, start in enumerate(xrange(0, len(images), perpage)):
+        fig = Figure(figsize=(cols*panelsize, rows*panelsize*0.6), dpi=dpi)
+        canvas = FigureCanvasAgg(fig)
+        for k in xrange(start, int(minimum(start+perpage, len(images)))):
+            ax = fig.add_subplot(rows, cols, k-start+1)
+            ax.imshow(images[k], origin='lower', interpolation='nearest',
+                      extent=extent, vmin=vmin, vmax=vmax)
+            if indices is not None:
+                azim, elev = pixelmap.location(indices[k])
+                ax.plot([azim], [elev], '+', ms=ms, mew=mew, color=indexcol)
+            if showbest:
+                azim, elev = pixelmap.location(best[k])
+                ax.plot([azim], [elev], 'x', ms=ms, mew=mew, color=bestcol)
+            ax.axis('tight')
+            ax.set_xticks([])
+            ax.set_yticks([])
+            if titles is not None:
+                ax.set_title(titles[k], fontsize=8)
+        fname = filename%page
+        canvas.print_png(fname)
+        filenames.append(fname)
+    return filenames
@@ -0,0 +1,117 @@
+'''
+Recorders for time-resolved output of the models.
+
+WindowedSpikeCounter counts the spikes of a group in sliding time windows
+(of length window, starting every hop) during a single run, instead of only
+the total count of SpikeCounter. Spikes are accumulated into bins of one hop,
+kept in a ring buffer of window/hop bins, and each window is emitted as the
+sum of its bins when it is complete. If max_windows is given, only the most
+recent max_windows windows are kept, so memory stays bounded for long
+recordings.
+
+windowed_count runs a model on a sound with such a counter and returns the
+counts in the same layout as the model's __call__, with an extra first axis
+for the windows.
+
+The windows are accumulated by TimeWindows (in time_windows.py, which does
+not import Brian), also used as a monitor of the numpy engine.
+'''
+from shared import *
+from model_pool import reset_model
+from time_windows import TimeWindows
+
+__all__ = ['TimeWindows', 'WindowedSpikeCounter', 'windowed_count']
+
+class WindowedSpikeCounter(SpikeCounter):
+    '''
+    SpikeCounter which also counts spikes in windows of duration window
+    every hop (by default hop=window), which should divide the window.
+    Keeps the most recent max_windows windows, or all of them if it is None.
+
+    Attributes ``count`` (the total count) and ``nspikes`` as for
+    SpikeCounter, and ``windows``, the TimeWindows object; use the counts
+    method to get the counts for each window.
+    '''
+    def __init__(self, source, window, hop=None, max_windows=None):
+        SpikeCounter.__init__(self, source)
+        hop_steps, window_hops = _window_steps(window, hop, source.clock.dt)
+        self.windows = TimeWindows(len(source), hop_steps, window_hops, max_windows)
+        self.hop = hop_steps*source.clock.dt
+
+    def _step(self):
+        clock = self.source.clock
+        return int(clock._t/clock._dt+0.5)
+
+    def propagate(self, spikes):
+        self.windows.advance(self._step())
+        if len(spikes):
+            SpikeCounter.propagate(self, spikes)
+            self.windows.add(self._step(), asarray(spikes, dtype=int))
+
+    def reinit(self):
+        SpikeCounter.reinit(self)
+        self.windows.reinit()
+
+    def counts(self):
+        '''
+        Returns (counts, times) with the counts of shape (n, N) of the n
+        complete windows kept, and their start times.
+        '''
+        self.windows.advance(self._step())
+        counts, first = self.windows.counts()
+        times = arange(first, first+counts.shape[0])*self.hop
+        return counts, times
+
+def _window_steps(window, hop, dt):
+    if hop is None:
+        hop = window
+    hop_steps = int(round(float(hop)/float(dt)))
+    window_hops = int(round(float(window)/float(hop)))
+    if hop_steps<1 or window_hops<1 or abs(window_hops*float(hop)-float(window))>float(dt)/2:
+        raise ValueError('The window should be a multiple of the hop, which '
+                         'should be at least one time step.')
+    return hop_steps, window_hops
+
+def windowed_count(model, sound, window, hop=None, index=None,
+                   max_windows=None, report=None, seed=None, **indexkwds):
+    '''
+    Runs the model (any of the three, with either engine) on the sound as in
+    its __call__ method, counting spikes in windows of duration window every
+    hop. Returns (count, times) where count has shape (n, ...) with the
+    model's count shape for each of the n windows (the last max_windows
+    windows if it is specified), and times are the start times of the
+    windows. The total count is left in model.counter as usual. The
+    progress is reported as for Network.run, by default not at all, and the
+    model is reset with the seed as by its __call__ method.
+    '''
+    sound = model._prepare_sound(sound, index, **indexkwds)
+    model.soundinput.source = sound
+    if model.engine=='numpy':
+        dt = model.network.dt
+        hop_steps, window_hops = _window_steps(window, hop, dt)
+        windows = TimeWindows(len(model.synchronygroup), hop_steps,
+                              window_hops, max_windows)
+        model.network.monitors.append(windows)
+    else:
+        counter = WindowedSpikeCounter(model.synchronygroup, window, hop,
+                                       max_windows)
+        model.network.add(counter)
+    try:
+        reset_model(model, seed)
+        model.network.run(sound.duration, report=report)
+    finally:
+        if model.engine=='numpy':
+            model.network.monitors.remove(windows)
+        else:
+            model.network.remove(counter)
+    if model.engine=='numpy':
+        windows.advance(model.network.t)
+        counts, first = windows.counts()
+        times = arange(first, first+counts.shape[0])*hop_steps*dt*second
+    else:
+        counts, times = counter.counts()
+    shape = model._format_count(zeros(counts.shape[1], dtype=int)).shape
+    count = zeros((counts.shape[0],)+shape, dtype=int)
+    for i, c in enumerate(counts):
+        count[i] = model._format_count(c)
+    return count, times
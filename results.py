@@ -0,0 +1,254 @@
+'''
+Compact on-disk storage of the counts of the models.
+
+A CountStore is a directory holding the counts of many runs (e.g. a sweep
+over every index of every subject) as unsigned integers, uint16 by default
+or uint32 for long sounds, instead of one float64 array per run. The counts
+are appended to a sequence of flat .npy chunk files, which are memory mapped
+on access, and the location of each count in the chunks is recorded with its
+metadata (subject, index, sound number and any other JSON values) as one
+line of the JSON index file. Counts can have any shape, e.g. (cfN,
+num_indices) for the filtering models and (cfN, gain_N, 2*delay_N-1) for
+the all pairs model, and the shape can differ between counts.
+
+Opening a store only reads the index, the counts are read from disk when
+they are accessed, so analyses can stream over the counts of a whole sweep::
+
+    store = CountStore(path)
+    for record, count in store.iter_counts(subject=1002):
+        ircam_plot_count(hrtfset, count, index=record['index'])
+
+A count is written to its chunk before its line is added to the index, so an
+interrupted writer leaves at most counts that are not indexed, which are
+overwritten by the next append. Only one process should append to a store at
+a time, any number can read it.
+
+Only numpy and the standard library are used here, so that results can be
+read without importing the simulator.
+'''
+import os, json
+import numpy
+from numpy.lib.format import open_memmap
+
+__all__ = ['CountStore']
+
+store_version = 1
+
+# keys of the index records used by the store itself
+_reserved = ('chunk', 'offset', 'shape')
+
+class CountStore(object):
+    '''
+    A store of counts in the directory path, which is created on the first
+    append.
+
+    ``dtype``
+        The type of the stored counts for a new store, 'uint16' (counts up
+        to 65535) or 'uint32'. An existing store keeps its own type, and
+        giving a different one raises a ValueError.
+    ``chunk_size``
+        The number of values in each chunk file for a new store (a count
+        larger than this gets a chunk of its own).
+    '''
+    def __init__(self, path, dtype=None, chunk_size=2**22):
+        self.path = path
+        self.records = []
+        self.chunks = {}
+        self.writable_chunk = None
+        self._keys = {}
+        # length of the complete lines of the index file
+        self._index_length = 0
+        metafile = os.path.join(path, 'store.json')
+        if os.path.exists(metafile):
+            f = open(metafile, 'r')
+            try:
+                meta = json.load(f)
+            finally:
+                f.close()
+            if meta['version']!=store_version:
+                raise ValueError('Count store '+str(path)+' has an '
+                                 'unsupported version.')
+            if dtype is not None and numpy.dtype(dtype)!=numpy.dtype(meta['dtype']):
+                raise ValueError('Count store '+str(path)+' has counts of type '+
+                                 meta['dtype']+', not '+numpy.dtype(dtype).name)
+            self.dtype = numpy.dtype(meta['dtype'])
+            self.chunk_size = meta['chunk_size']
+            self._read_index()
+        else:
+            if dtype is None:
+                dtype = 'uint16'
+            self.dtype = numpy.dtype(dtype)
+            if self.dtype not in (numpy.dtype(numpy.uint16),
+                                  numpy.dtype(numpy.uint32)):
+                raise ValueError("dtype should be 'uint16' or 'uint32'")
+            self.chunk_size = int(chunk_size)
+
+    def _index_file(self):
+        return os.path.join(self.path, 'index.jsonl')
+
+    def _chunk_file(self, chunk):
+        return os.path.join(self.path, 'counts-%05d.npy'%chunk)
+
+    def _read_index(self):
+        fname = self._index_file()
+        if not os.path.exists(fname):
+            return
+        f = open(fname, 'r')
+        try:
+            for line in f:
+                # a line without its newline was being written when the
+                # writer stopped, the count it describes is not in the store
+                if not line.endswith('\n'):
+                    break
+                self._add_record(json.loads(line))
+                # the lines are ASCII (json.dumps escapes everything else)
+                self._index_length += len(line)
+        finally:
+            f.close()
+
+    def _add_record(self, record):
+        self._keys[_record_key(record)] = len(self.records)
+        self.records.append(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        '''
+        Whether there is a count for the (subject, index, sound) key.
+        '''
+        return tuple(key) in self._keys
+
+    def _chunk(self, chunk):
+        # chunks are memory mapped once and kept open
+        if chunk not in self.chunks:
+            self.chunks[chunk] = numpy.load(self._chunk_file(chunk),
+                                            mmap_mode='r')
+        return self.chunks[chunk]
+
+    def count(self, record):
+        '''
+        Returns the count of the record (one of self.records), a read-only
+        array of the store's dtype mapped from the disk.
+        '''
+        start = record['offset']
+        size = int(numpy.prod(record['shape']))
+        return self._chunk(record['chunk'])[start:start+size].reshape(record['shape'])
+
+    def get(self, subject, index, sound=0):
+        '''
+        Returns the count for the subject, HRTF index and sound number, or
+        raises a KeyError.
+        '''
+        return self.count(self.records[self._keys[subject, index, sound]])
+
+    def find(self, **where):
+        '''
+        Returns the records whose values are those given as keywords, e.g.
+        find(subject=1002).
+        '''
+        return [record for record in self.records
+                if all(record.get(k)==v for k, v in where.items())]
+
+    def iter_counts(self, **where):
+        '''
+        Iterates over (record, count) for the records selected as for find,
+        in the order of the chunks. Only the chunks needed are mapped.
+        '''
+        records = sorted(self.find(**where),
+                         key=lambda record: (record['chunk'], record['offset']))
+        for record in records:
+            yield record, self.count(record)
+
+    def append(self, count, subject, index, sound=0, **meta):
+        '''
+        Adds the count of the given subject, HRTF index and sound number. The
+        count should contain nonnegative integers that fit in the dtype of
+        the store, otherwise a ValueError is raised. Extra keywords are saved
+        in the index record and must be JSON serialisable.
+        '''
+        for key in _reserved:
+            if key in meta:
+                raise ValueError(key+' is used by the store and cannot be '
+                                 'given as metadata')
+        count = numpy.asarray(count)
+        values = count.ravel()
+        if values.size:
+            if values.min()<0 or values.max()>numpy.iinfo(self.dtype).max:
+                raise ValueError('Count has values outside the range of '+
+                                 self.dtype.name)
+            if count.dtype.kind=='f' and numpy.any(values!=numpy.round(values)):
+                raise ValueError('Count has values which are not integers')
+        if not os.path.exists(os.path.join(self.path, 'store.json')):
+            self._create()
+        # the next count goes after the last indexed one, if it fits
+        if self.records:
+            last = self.records[-1]
+            chunk = last['chunk']
+            offset = last['offset']+int(numpy.prod(last['shape']))
+            if offset+values.size>self._writable(chunk).shape[0]:
+                chunk += 1
+                offset = 0
+        else:
+            chunk = 0
+            offset = 0
+        if offset==0:
+            self._new_chunk(chunk, max(self.chunk_size, values.size))
+        data = self._writable(chunk)
+        data[offset:offset+values.size] = values
+        data.flush()
+        record = dict(meta, subject=subject, index=index, sound=sound,
+                      chunk=chunk, offset=offset, shape=list(count.shape))
+        line = json.dumps(record, sort_keys=True)+'\n'
+        f = open(self._index_file(), 'a')
+        try:
+            # drop a partial line left by an interrupted writer
+            f.truncate(self._index_length)
+            f.write(line)
+        finally:
+            f.close()
+        self._index_length += len(line)
+        self._add_record(record)
+
+    def _create(self):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        meta = {'version':store_version, 'dtype':self.dtype.name,
+                'chunk_size':self.chunk_size}
+        tmpname = os.path.join(self.path, 'store.json.tmp')
+        f = open(tmpname, 'w')
+        try:
+            json.dump(meta, f)
+        finally:
+            f.close()
+        os.rename(tmpname, os.path.join(self.path, 'store.json'))
+
+    def _new_chunk(self, chunk, size):
+        self._close_writable()
+        self.chunks.pop(chunk, None)
+        data = open_memmap(self._chunk_file(chunk), mode='w+',
+                           dtype=self.dtype, shape=(int(size),))
+        self.writable_chunk = (chunk, data)
+
+    def _writable(self, chunk):
+        if self.writable_chunk is None or self.writable_chunk[0]!=chunk:
+            self._close_writable()
+            self.chunks.pop(chunk, None)
+            self.writable_chunk = (chunk, open_memmap(self._chunk_file(chunk),
+                                                      mode='r+'))
+        return self.writable_chunk[1]
+
+    def _close_writable(self):
+        if self.writable_chunk is not None:
+            self.writable_chunk[1].flush()
+            self.writable_chunk = None
+
+    def close(self):
+        '''
+        Closes the memory mapped chunks.
+        '''
+        self._close_writable()
+        self.chunks.clear()
+
+def _record_key(record):
+    return (record['subject'], record['index'], record['sound'])
@@ -0,0 +1,14 @@
+'''
+Settings shared by all the modules, importable without Brian (shared.py
+imports Brian and gives the samplerate as a quantity).
+'''
+import os
+
+__all__ = ['datapath', 'samplerate_hz']
+
+# shared samplerate in Hz, we use this for everything resampling if necessary
+samplerate_hz = 44100.0
+
+# base path for data
+datapath, _ = os.path.split(__file__)
+datapath = os.path.normpath(os.path.join(datapath, './data'))
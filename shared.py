@@ -2,15 +2,13 @@ from brian import *
 from brian.hears import *
 from brian.tools import datamanager
 import os, sys, time, pickle
+# datapath and samplerate_hz, see settings.py
+from settings import *
 
 # shared samplerate, we use this for everything resampling if necessary
-samplerate = 44.1*kHz
+samplerate = samplerate_hz*Hz
 set_default_samplerate(samplerate)
 
-# base path for data, and derived DataManager class which uses it
-datapath, _ = os.path.split(__file__)
-datapath = os.path.normpath(os.path.join(datapath, './data'))
-
 # convenience function to get the IRCAM database, replace the file path
 # with the location you downloaded it to.
 def get_ircam():
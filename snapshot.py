@@ -0,0 +1,72 @@
+'''
+Saving and loading of built models.
+
+The save method of the models writes everything the model computed from the
+hrtfset (the gains, the delays and the coincidence detectors used) and its
+parameters to a single .npz file, and the load class method builds the model
+from this file without redoing the HRTF analysis. The neuron models contain
+functions, so they are not saved: they are passed to load as to the
+constructor, as is the hrtfset, which is checked against a hash stored in the
+file.
+'''
+import numpy
+from cache import cache_key
+
+__all__ = ['save_model', 'load_model']
+
+snapshot_version = 1
+
+def _hrtfset_key(hrtfset):
+    return cache_key(hrtfset.data, hrtfset.samplerate)
+
+def save_model(path, model, params, arrays):
+    '''
+    Saves the class name of the model, a hash of its hrtfset, the dict params
+    of numbers (in SI units, None values are omitted) and the dict of arrays
+    to the .npz file path.
+    '''
+    data = {}
+    for name, value in arrays.items():
+        data['array_'+name] = numpy.asarray(value)
+    for name, value in params.items():
+        if value is not None:
+            data['param_'+name] = numpy.asarray(float(value))
+    f = open(path, 'wb')
+    try:
+        numpy.savez(f, version=snapshot_version,
+                    modelclass=model.__class__.__name__,
+                    hrtfset_key=_hrtfset_key(model.hrtfset), **data)
+    finally:
+        f.close()
+
+class _Missing(dict):
+    # dict returning None for missing keys
+    def __missing__(self, key):
+        return None
+
+def load_model(path, modelclass, hrtfset):
+    '''
+    Loads a file written by save_model for a model of class modelclass
+    with the given hrtfset. Returns (params, arrays), the params being floats
+    in SI units, and missing ones None.
+    '''
+    data = numpy.load(path)
+    try:
+        if int(data['version'])!=snapshot_version:
+            raise ValueError('Model file '+str(path)+' has an unsupported version.')
+        if str(data['modelclass'])!=modelclass.__name__:
+            raise ValueError('Model file '+str(path)+' is for a '+
+                             str(data['modelclass'])+', not a '+modelclass.__name__)
+        if str(data['hrtfset_key'])!=_hrtfset_key(hrtfset):
+            raise ValueError('Model file '+str(path)+' was saved with a '
+                             'different hrtfset.')
+        params = {}
+        arrays = {}
+        for name in data.files:
+            if name.startswith('param_'):
+                params[name[len('param_'):]] = float(data[name])
+            elif name.startswith('array_'):
+                arrays[name[len('array_'):]] = data[name]
+    finally:
+        data.close()
+    return _Missing(params), _Missing(arrays)
@@ -0,0 +1,139 @@
+'''
+Streaming interface to the approximate and ideal filtering models.
+
+A StreamingLocaliser wraps a model and is fed blocks of stereo audio (e.g.
+10 ms at a time). The state of the filters and neurons is kept from one
+block to the next, and after each block it returns the increment of the
+count and a running estimate of the location.
+
+The input to the model is a StreamSource, which replaces the sound of the
+model's DoNothingFilterbank. The network can only be run up to the point
+where all the filterbanks in the chain have the input they need, which
+includes the lookahead of filterbanks with a minimum_buffer_size (e.g. the
+FFT-based FIR filterbank for the HRTFs in the ideal model), and is run in
+whole buffers of the filter group. The latency of the output is therefore
+bounded by this lookahead plus one buffer.
+'''
+from shared import *
+from model_pool import reset_model
+
+__all__ = ['StreamSource', 'StreamingLocaliser']
+
+class StreamSource(Bufferable):
+    '''
+    A Bufferable source of samples that are pushed to it in blocks. Samples
+    are discarded once they have been fetched.
+    '''
+    def __init__(self, nchannels, samplerate):
+        self.nchannels = nchannels
+        self.samplerate = samplerate
+        self.buffer_init()
+
+    def buffer_init(self):
+        self.samples = zeros((0, self.nchannels))
+        self.offset = 0
+
+    @property
+    def available(self):
+        '''
+        The number of samples pushed since the start.
+        '''
+        return self.offset+self.samples.shape[0]
+
+    def push(self, block):
+        block = asarray(block, dtype=float)
+        if block.ndim==1:
+            block = reshape(block, (len(block), 1))
+        if block.shape[1]!=self.nchannels:
+            raise ValueError('Blocks should have '+str(self.nchannels)+' channels.')
+        self.samples = vstack((self.samples, block))
+
+    def buffer_fetch(self, start, end):
+        if start<self.offset:
+            raise IndexError('Attempted to fetch samples that have been discarded.')
+        if end>self.available:
+            raise IndexError('Attempted to fetch samples that have not been pushed yet.')
+        output = self.samples[start-self.offset:end-self.offset, :]
+        self.samples = self.samples[start-self.offset:, :]
+        self.offset = start
+        return output
+
+def filterbank_lookahead(filterbank):
+    '''
+    Returns the largest minimum_buffer_size of the filterbank and its sources.
+    '''
+    lookahead = getattr(filterbank, 'minimum_buffer_size', 0)
+    source = getattr(filterbank, 'source', None)
+    if source is None:
+        return lookahead
+    if isinstance(source, Bufferable):
+        source = [source]
+    for s in source:
+        lookahead = maximum(lookahead, filterbank_lookahead(s))
+    return int(lookahead)
+
+class StreamingLocaliser(object):
+    '''
+    Online localisation with an ApproximateFilteringModel or
+    IdealFilteringModel (with either engine).
+
+    ``memory``
+        If specified, the time constant with which old evidence for each
+        location is forgotten by the running estimate, for moving sources.
+        By default all evidence since the last reset is used.
+
+    ``seed``
+        If specified, the seed of the random initial state and noise of the
+        model, as for its __call__ method.
+
+    Use the process method to feed blocks of samples, and reset to start
+    again from the initial state (optionally with a new seed). Note that this
+    takes over the model, calling the model directly resets it.
+    '''
+    def __init__(self, model, memory=None, seed=None):
+        self.model = model
+        self.memory = memory
+        self.samplerate = model.soundinput.samplerate
+        if hasattr(model.network, 'buffersize'):
+            self.buffersize = model.network.buffersize
+        else:
+            self.buffersize = model.filtergroup.buffersize
+        self.lookahead = filterbank_lookahead(model.cochlea)
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        model = self.model
+        self.source = StreamSource(2, self.samplerate)
+        model.soundinput.source = self.source
+        reset_model(model, seed)
+        self.t = 0
+        self.count = model._format_count(zeros(len(model.counter.count), dtype=int))
+        self.evidence = zeros(model.num_indices)
+
+    def process(self, block):
+        '''
+        Feeds a block of samples of shape (nsamples, 2), for example a stereo
+        Sound, and runs the network as far as possible. Returns a pair
+        (count, index) where count is the increment of the count of the
+        model since the last block, and index is the current estimate of the
+        HRTF index of the location.
+        '''
+        self.source.push(block)
+        end = ((self.source.available-self.lookahead)//self.buffersize)*self.buffersize
+        newcount = self.count
+        if end>self.t:
+            self.model.network.run((end-self.t)/self.samplerate, report=None)
+            newcount = self.model._format_count(array(self.model.counter.count))
+            if self.memory is not None:
+                self.evidence *= exp(-(end-self.t)/(self.samplerate*self.memory))
+            self.t = end
+        increment = newcount-self.count
+        self.count = newcount
+        self.evidence += sum(increment, axis=0)
+        return increment, self.estimate()
+
+    def estimate(self):
+        '''
+        Returns the HRTF index with the most evidence.
+        '''
+        return argmax(self.evidence)
@@ -0,0 +1,169 @@
+'''
+Parallel localisation sweep over every HRTF index of a set of subjects.
+
+Each job (subject, index, sound) applies the HRTF of the given index to the
+given sound and runs it through a model, saving the count to disk. Jobs are
+sharded across a multiprocessing pool. Every worker constructs the model once
+per subject and reuses it for all the jobs of that subject it gets. The jobs
+of each subject are handed out in contiguous chunks to keep model
+reconstruction rare. The cached itd/ild and attenuation data are generated in
+the main process before the pool starts, so workers only ever read them.
+
+Results are appended to a CountStore (see results.py) in the output
+directory as soon as they finish, as uint16 counts by default, so an
+interrupted sweep can be resumed by running it again with the same
+arguments: jobs whose results are already in the store are skipped.
+'''
+from shared import *
+from hrtf_analysis import *
+from results import CountStore
+import multiprocessing, gc
+
+__all__ = ['localisation_sweep', 'whitenoise_sound', 'model_class',
+           'precompute_caches']
+
+def whitenoise_sound(number, duration=500*ms):
+    '''
+    The default sound for a sweep: white noise, the same for every subject and
+    index with the same sound number.
+    '''
+    seed(number)
+    return whitenoise(duration)
+
+def model_class(model):
+    '''
+    Returns the class of the model 'approximate', 'ideal' or 'allpairs'.
+    '''
+    # imported here to avoid importing all the models in every worker
+    if model=='approximate':
+        from approximate_filtering_model import ApproximateFilteringModel
+        return ApproximateFilteringModel
+    elif model=='ideal':
+        from ideal_filtering_model import IdealFilteringModel
+        return IdealFilteringModel
+    elif model=='allpairs':
+        from all_pairs_model import AllPairsModel
+        return AllPairsModel
+    raise ValueError("model should be 'approximate', 'ideal' or 'allpairs'")
+
+def precompute_caches(model, hrtfset, modelargs):
+    '''
+    Computes (or loads) the HRTF analysis used by the model for the hrtfset.
+    '''
+    cfmin, cfmax, cfN = modelargs[:3]
+    if model=='approximate':
+        hrtfset_itd_ild(hrtfset, cfmin, cfmax, cfN)
+    elif model=='ideal':
+        hrtfset_attenuations(cfmin, cfmax, cfN, hrtfset)
+
+# State of each worker process, set by _init_worker
+_worker = {}
+
+def _init_worker(model, modelargs, modelkwds, sound, get_database, baseseed):
+    _worker.update(model=model, modelargs=modelargs, modelkwds=modelkwds,
+                   sound=sound, get_database=get_database, baseseed=baseseed,
+                   hrtfdb=None, subject=None, instance=None)
+
+def _worker_model(subject):
+    if _worker['subject']!=subject:
+        # release the previous model before building the new one
+        _worker['instance'] = None
+        gc.collect()
+        if _worker['hrtfdb'] is None:
+            _worker['hrtfdb'] = _worker['get_database']()
+        hrtfset = _worker['hrtfdb'].load_subject(subject)
+        modelclass = model_class(_worker['model'])
+        _worker['instance'] = modelclass(hrtfset, *_worker['modelargs'],
+                                         **_worker['modelkwds'])
+        _worker['subject'] = subject
+    return _worker['instance']
+
+def _run_job(job):
+    subject, index, number = job
+    model = _worker_model(subject)
+    sound = _worker['sound'](number)
+    # workers are forked with the same random state, so each job gets its own
+    # seed for the neuron noise
+    seed(hash((_worker['baseseed'], subject, index, number))%2**32)
+    count = model(sound, index, report=None)
+    return job, asarray(count)
+
+def localisation_sweep(outdir, subjects, modelargs, model='approximate',
+                       modelkwds=None, num_sounds=1, sound=whitenoise_sound,
+                       get_database=get_ircam, processes=None, baseseed=0,
+                       count_dtype=None):
+    '''
+    Runs model on num_sounds sounds at every HRTF index of every subject, with
+    results saved in a CountStore in the directory outdir, the count of each
+    job being store.get(subject, index, number).
+
+    ``modelargs``, ``modelkwds``
+        The arguments to the model after the hrtfset, starting with
+        (cfmin, cfmax, cfN).
+    ``model``
+        One of 'approximate', 'ideal' or 'allpairs'.
+    ``sound``
+        A function of the sound number returning a mono sound, it must be
+        defined at the top level of a module so that it can be pickled.
+    ``get_database``
+        A top-level function returning the HRTF database, an object with a
+        load_subject(subject) method.
+    ``processes``
+        The number of worker processes, by default the number of CPUs.
+    ``baseseed``
+        Seed for the neuron noise, the seed of each job is derived from this
+        and the job.
+    ``count_dtype``
+        The type of the counts for a new store, 'uint16' (the default) or
+        'uint32' for counts above 65535, with long sounds.
+
+    Returns the number of jobs that were run (jobs whose results already
+    exist are skipped).
+    '''
+    if modelkwds is None:
+        modelkwds = {}
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    store = CountStore(outdir, dtype=count_dtype)
+    hrtfdb = get_database()
+    jobs = []
+    jobs_per_subject = 1
+    for subject in subjects:
+        hrtfset = hrtfdb.load_subject(subject)
+        subject_jobs = [(subject, index, number)
+                        for index in xrange(hrtfset.num_indices)
+                        for number in xrange(num_sounds)
+                        if (subject, index, number) not in store]
+        if subject_jobs:
+            precompute_caches(model, hrtfset, modelargs)
+            jobs.extend(subject_jobs)
+            jobs_per_subject = maximum(jobs_per_subject, len(subject_jobs))
+    del hrtfdb
+    gc.collect()
+    if not jobs:
+        return 0
+    chunksize = int(ceil(float(jobs_per_subject)/processes))
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(model, modelargs, modelkwds, sound,
+                                          get_database, baseseed))
+    try:
+        for job, count in pool.imap_unordered(_run_job, jobs, chunksize):
+            store.append(count, *job)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        store.close()
+    return len(jobs)
+
+if __name__=='__main__':
+
+    hrtfdb = get_ircam()
+    cfmin, cfmax, cfN = 150*Hz, 5*kHz, 80
+    outdir = os.path.join(datapath, 'sweeps', 'approximate')
+
+    numjobs = localisation_sweep(outdir, hrtfdb.subjects, (cfmin, cfmax, cfN))
+
+    print('Ran %d jobs'%numjobs)
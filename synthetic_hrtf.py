@@ -0,0 +1,123 @@
+'''
+Synthetic HRTFs of a spherical head, for running the models without the
+IRCAM database and at any number of locations.
+
+The HRIR for each ear is computed in the frequency domain from two standard
+approximations for a rigid sphere with the ears at the ends of the
+interaural axis, where theta is the angle between the direction of the source
+and the ear:
+
+* The delay is Woodworth's: -a*cos(theta)/c while the ear faces the source
+  (theta<90 degrees), and a*(theta-pi/2)/c once the sound has to travel
+  around the head (a is the head radius and c the speed of sound), so that
+  the ITD of a source on the horizontal plane at azimuth phi is
+  a*(phi+sin(phi))/c.
+* The head shadow is the one-pole one-zero filter of Brown and Duda (1998),
+  (1+j*alpha*w/(2*w0))/(1+j*w/(2*w0)) with w0=c/a and
+  alpha = 1+alpha_min/2+(1-alpha_min/2)*cos(theta/theta_min*180 degrees),
+  alpha_min=0.1 and theta_min=150 degrees, giving a high frequency boost
+  towards the source and a low pass attenuation away from it.
+
+The coordinates follow the IRCAM convention: azim in degrees
+counterclockwise from the front (the left ear is at 90 degrees) and elev in
+degrees, with the same sampling as the IRCAM database by default (see
+spherical_head_coordinates).
+'''
+from shared import *
+from numpy.fft import irfft
+
+__all__ = ['spherical_head_hrtfset', 'spherical_head_coordinates',
+           'horizontal_coordinates', 'SphericalHeadDatabase',
+           'get_spherical_head']
+
+speed_of_sound = 343*metre/second
+
+def spherical_head_coordinates(azim_step=15, elev_step=15, elev_min=-45,
+                               elev_max=90):
+    '''
+    Returns coordinates with elevations from elev_min to elev_max in steps of
+    elev_step, and azimuths every azim_step degrees up to 45 degrees of
+    elevation, and fewer above, in proportion to the cosine of the
+    elevation. The defaults give the 187 locations of the IRCAM database.
+    '''
+    azims = []
+    elevs = []
+    for elev in arange(elev_min, elev_max+elev_step/2., elev_step):
+        n = int(round(360./azim_step))
+        if abs(elev)>45:
+            n = maximum(1, int(round(n*cos(elev*pi/180))))
+        azims.append(arange(n)*360./n)
+        elevs.append(elev*ones(n))
+    return make_coordinates(azim=hstack(azims), elev=hstack(elevs))
+
+def horizontal_coordinates(num_indices):
+    '''
+    Returns coordinates of num_indices locations evenly spaced on the
+    horizontal plane.
+    '''
+    return make_coordinates(azim=arange(num_indices)*360./num_indices,
+                            elev=zeros(num_indices))
+
+def _direction(azim, elev):
+    azim = azim*pi/180
+    elev = elev*pi/180
+    return array([cos(elev)*cos(azim), cos(elev)*sin(azim), sin(elev)])
+
+def spherical_head_hrtfset(coordinates=None, head_radius=8.75*cm,
+                           hrir_length=512, samplerate=samplerate):
+    '''
+    Returns an HRTFSet for a spherical head of the given radius at the given
+    coordinates (by default spherical_head_coordinates()), with HRIRs of
+    hrir_length samples at the samplerate (by default the shared samplerate).
+    '''
+    if coordinates is None:
+        coordinates = spherical_head_coordinates()
+    a = float(head_radius)
+    c = float(speed_of_sound)
+    fs = float(samplerate)
+    source = _direction(coordinates['azim'], coordinates['elev'])
+    w = 2*pi*arange(hrir_length//2+1)*fs/hrir_length
+    w0 = c/a
+    # every HRIR starts after the earliest possible arrival, plus a few
+    # samples for the head shadow filter
+    onset = a/c+8/fs
+    data = zeros((2, len(coordinates), hrir_length))
+    for ear, ear_azim in enumerate([90, -90]):
+        costheta = clip(dot(_direction(ear_azim, 0), source), -1, 1)
+        theta = arccos(costheta)
+        delay = where(theta<pi/2, -a*costheta/c, a*(theta-pi/2)/c)
+        alpha = 1.05+0.95*cos(theta*180/150)
+        H = ((1+1j*alpha[:, newaxis]*w/(2*w0))/(1+1j*w/(2*w0))*
+             exp(-1j*w*(onset+delay[:, newaxis])))
+        data[ear] = irfft(H, hrir_length, axis=1)
+    hrtfset = HRTFSet(data, samplerate, coordinates)
+    hrtfset.name = 'spherical_%gcm'%(a*100)
+    return hrtfset
+
+class SphericalHeadDatabase(object):
+    '''
+    A database of spherical head HRTF sets with the same interface as
+    IRCAM_LISTEN: the subjects attribute and the load_subject method. The
+    subjects are numbered from 0, one for each of the head radii.
+    '''
+    def __init__(self, head_radii=(8.75*cm,), coordinates=None,
+                 hrir_length=512):
+        self.head_radii = head_radii
+        self.coordinates = coordinates
+        self.hrir_length = hrir_length
+        self.subjects = range(len(head_radii))
+
+    def load_subject(self, subject):
+        try:
+            head_radius = self.head_radii[subject]
+        except (IndexError, TypeError):
+            raise IOError("Couldn't find the HRTF data for subject "+str(subject))
+        return spherical_head_hrtfset(self.coordinates, head_radius,
+                                      self.hrir_length)
+
+def get_spherical_head():
+    '''
+    Returns a SphericalHeadDatabase with five head radii from 8 to 10 cm at
+    the IRCAM locations, for use in place of get_ircam().
+    '''
+    return SphericalHeadDatabase(linspace(8, 10, 5)*cm)
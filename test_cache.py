@@ -0,0 +1,65 @@
+'''
+Tests of the cache keys and of the on-disk cache of arrays (run with
+pytest).
+'''
+import os
+import numpy
+from cache import cache_key, CacheStore
+
+def test_cache_key():
+    x = numpy.arange(6.)
+    assert cache_key(x, 1, 'a')==cache_key(x.copy(), 1.0, 'a')
+    # numbers hash as floats, arrays by type, shape and contents
+    assert cache_key(numpy.float32(0.5))==cache_key(0.5)
+    assert cache_key(x)!=cache_key(x.astype(numpy.float32))
+    assert cache_key(x)!=cache_key(x.reshape((2, 3)))
+    assert cache_key(x)!=cache_key(x+1)
+    # non-contiguous arrays hash as their values
+    assert cache_key(x[::2])==cache_key(numpy.array([0., 2., 4.]))
+    # the nesting is part of the key
+    assert cache_key((1, 2), 3)!=cache_key(1, (2, 3))
+    assert cache_key('1')!=cache_key(1)
+
+def test_put_get(tmpdir):
+    store = CacheStore(str(tmpdir))
+    key = cache_key('entry')
+    assert store.get('ns', key) is None
+    store.put('ns', key, {'a':numpy.arange(4), 'b':numpy.eye(2)})
+    arrays = store.get('ns', key)
+    assert sorted(arrays.keys())==['a', 'b']
+    assert (arrays['a']==numpy.arange(4)).all()
+    # read back memory mapped, and kept in memory
+    assert isinstance(arrays['b'], numpy.memmap)
+    assert store.get('ns', key) is arrays
+    # another store reads it from disk
+    other = CacheStore(str(tmpdir), mmap_mode=None)
+    arrays = other.get('ns', key)
+    assert not isinstance(arrays['b'], numpy.memmap)
+    assert (arrays['b']==numpy.eye(2)).all()
+    # put replaces the entry, without temporary directories left behind
+    store.put('ns', key, {'c':numpy.zeros(3)})
+    assert list(store.get('ns', key).keys())==['c']
+    assert os.listdir(os.path.join(str(tmpdir), 'ns'))==[key]
+
+def test_cached(tmpdir):
+    store = CacheStore(str(tmpdir))
+    calls = []
+    def compute():
+        calls.append(1)
+        return {'x':numpy.ones(3)}
+    for _ in range(2):
+        assert (store.cached('ns', 'k', compute)['x']==1).all()
+        store.clear_memory()
+    assert len(calls)==1
+
+def test_lru(tmpdir):
+    store = CacheStore(str(tmpdir), maxitems=2)
+    for k in 'abc':
+        store.put('ns', k, {'x':numpy.zeros(1)})
+    first = store.get('ns', 'a')
+    store.get('ns', 'b')
+    store.get('ns', 'a')
+    store.get('ns', 'c')
+    # b was the least recently used
+    assert list(store.lru.keys())==[('ns', 'a'), ('ns', 'c')]
+    assert store.get('ns', 'a') is first
@@ -0,0 +1,66 @@
+'''
+Tests of the models run together on a shared front end (run with pytest).
+'''
+import pytest
+pytest.importorskip('brian')
+
+from shared import *
+from models import *
+from frontend import CochlearFrontEnd, MultiModelRunner
+from streaming import filterbank_lookahead
+from synthetic_hrtf import spherical_head_hrtfset, horizontal_coordinates
+from approximate_filtering_model import ApproximateFilteringModel
+from ideal_filtering_model import IdealFilteringModel
+from instrumentation import profile_model
+
+cfmin, cfmax, cfN = 300*Hz, 3*kHz, 8
+
+def _init_filtergroup(G, params):
+    G.v = params.Vr
+def _init_cd(G, params):
+    G.v = 0
+
+# models without noise or random initial state, so that the counts only
+# depend on the sound
+filtergroup_params = dict((name, standard_filtergroup_model_params[name])
+                          for name in standard_filtergroup_model_params.keys())
+filtergroup_params['sigma'] = 0*mV
+filtergroup_model = dict(standard_filtergroup_model, init=_init_filtergroup,
+                         parameters=Parameters(**filtergroup_params))
+cd_model = dict(standard_cd_model, init=_init_cd, weight=.6,
+                parameters=Parameters(tau=standard_cd_model_params.tau, sigma=0))
+
+@pytest.mark.parametrize('engine', ['numpy', 'brian'])
+def test_consumer_order(engine):
+    hrtfset = spherical_head_hrtfset(horizontal_coordinates(6), hrir_length=128)
+    frontend = CochlearFrontEnd(cfmin, cfmax, cfN)
+    kwds = dict(cd_model=cd_model, filtergroup_model=filtergroup_model,
+                engine=engine, frontend=frontend)
+    ideal = IdealFilteringModel(hrtfset, cfmin, cfmax, cfN, **kwds)
+    approximate = ApproximateFilteringModel(hrtfset, cfmin, cfmax, cfN, **kwds)
+    # the FFT convolution of the ideal model fetches larger blocks of the
+    # front end than the filter groups
+    assert filterbank_lookahead(ideal.cochlea)>32
+    sound = whitenoise(100*ms)
+    expected = {}
+    for model in [ideal, approximate]:
+        expected[model] = model(sound, 1, report=None)
+        assert sum(expected[model])>0
+    for models in [[ideal, approximate], [approximate, ideal]]:
+        counts = MultiModelRunner(models)(sound, 1, report=None)
+        for model, count in zip(models, counts):
+            assert (count==expected[model]).all()
+
+@pytest.mark.parametrize('engine', ['numpy', 'brian'])
+def test_shared_frontend_profile(engine):
+    hrtfset = spherical_head_hrtfset(horizontal_coordinates(6), hrir_length=128)
+    frontend = CochlearFrontEnd(cfmin, cfmax, cfN)
+    model = ApproximateFilteringModel(hrtfset, cfmin, cfmax, cfN,
+                                      engine=engine, frontend=frontend)
+    count, result = profile_model(model, whitenoise(50*ms), 1)
+    stages = result['stages']
+    # the shared output is fetched, and the Gammatone computed, once per
+    # buffer of the model
+    assert stages['SharedOutputFilterbank']['calls']>0
+    assert stages['Gammatone']['calls']>0
+    assert stages['Gammatone']['calls']<=stages['SharedOutputFilterbank']['calls']
@@ -0,0 +1,179 @@
+'''
+Tests of the seeded reset of the models and of the model pool (run with
+pytest). The pool and the reset are tested on numpy engine networks without
+Brian, the models themselves are skipped if Brian is not installed.
+'''
+import pytest
+import threading
+from numpy import arange, zeros
+from model_pool import ModelPool, reset_model, model_footprint
+from numpy_engine import NumpyNetwork
+from test_numpy_engine import ConstantInput, filtergroup_model, cd_model
+
+class NumpyModel(object):
+    # the attributes of a model used by the pool and reset_model, for a
+    # NumpyNetwork of N coincidence detectors on a constant input
+    engine = 'numpy'
+    synapses = None
+    def __init__(self, N=8):
+        self.cochlea = ConstantInput(N, 0.1)
+        self.filtergroup_model = filtergroup_model
+        self.cd_model = cd_model
+        self.network = NumpyNetwork(self.cochlea, filtergroup_model, cd_model,
+                                    arange(N), (arange(N)+1)%N)
+        self.filtergroup = self.network.filtergroup
+        self.synchronygroup = self.network.synchronygroup
+        self.counter = self.network.counter
+
+class HRTFSet(object):
+    # the attributes of an HRTFSet used by the pool
+    def __init__(self, n):
+        self.data = zeros((2, n, 16))
+        self.samplerate = 44100.0
+
+def build(model, hrtfset, N, **modelkwds):
+    # builder for the pool, with the model and hrtfset ignored
+    return NumpyModel(int(N))
+
+def _run(model, seed):
+    reset_model(model, seed)
+    model.network.run(0.02)
+    return model.counter.count.copy()
+
+def test_reset_reuses_state():
+    model = NumpyModel()
+    v = model.synchronygroup.v
+    history = model.network.history
+    reset_model(model, 1)
+    first = v.copy()
+    buffers = dict(model._reset_buffers)
+    model.network.run(0.01)
+    reset_model(model, 1)
+    assert model.synchronygroup.v is v and model.network.history is history
+    assert (v==first).all()
+    assert ((0<=v)&(v<1)).all() and len(set(v))==len(v)
+    v = model.filtergroup.v
+    assert ((filtergroup_model['reset']<=v)&(v<filtergroup_model['threshold'])).all()
+    # the draws use the same buffers
+    for n, buffer in model._reset_buffers.items():
+        assert buffers[n] is buffer
+    reset_model(model, 2)
+    assert (model.synchronygroup.v!=first).any()
+
+def test_same_seed_same_counts_numpy():
+    # the initial state and the noise come from the generator of the model,
+    # not from numpy's global generator
+    model, other = NumpyModel(), NumpyModel()
+    count = _run(model, 5)
+    assert count.sum()>0
+    _run(model, 7)
+    reset_model(other, 5)
+    _run(model, (5, 0))
+    other.network.run(0.02)
+    assert (other.counter.count==count).all()
+    assert (_run(model, 5)==count).all()
+
+def test_pool():
+    hrtfset = HRTFSet(6)
+    pool = ModelPool(builder=build)
+    model = pool.acquire('approximate', hrtfset, (8,), engine='numpy')
+    # a model in use is not lent twice
+    other = pool.acquire('approximate', hrtfset, (8,), engine='numpy')
+    assert other is not model
+    pool.release(other)
+    pool.release(model)
+    assert len(pool)==2 and pool.num_built==2
+    assert pool.idle_bytes==2*model_footprint(model)>0
+    with pool.model('approximate', hrtfset, (8,), engine='numpy') as m:
+        assert m is model or m is other
+    assert pool.num_built==2
+    # a different key builds a new model
+    with pool.model('approximate', hrtfset, (9,), engine='numpy'):
+        pass
+    with pool.model('approximate', HRTFSet(7), (8,), engine='numpy'):
+        pass
+    assert pool.num_built==4 and len(pool)==4
+    # the same HRTFs in another object are the same key
+    with pool.model('approximate', HRTFSet(6), (8,), engine='numpy'):
+        pass
+    assert pool.num_built==4
+    # eviction of the least recently used models, the models for (8,) were
+    # used last
+    pool.max_bytes = 2*model_footprint(model)
+    with pool.model('approximate', hrtfset, (8,), engine='numpy'):
+        pass
+    assert len(pool)==2 and pool.num_evicted==2
+    assert pool.idle_bytes<=pool.max_bytes
+    with pool.model('approximate', hrtfset, (8,), engine='numpy'):
+        pass
+    assert pool.num_built==4
+    pool.clear()
+    assert len(pool)==0 and pool.idle_bytes==0
+
+def test_pool_build_error():
+    def fail(*args, **kwds):
+        raise RuntimeError
+    pool = ModelPool(builder=fail)
+    with pytest.raises(RuntimeError):
+        pool.acquire('approximate', HRTFSet(6), (8,))
+    # the Brian lock is released, another thread can take it
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(pool.brian_lock.acquire(False)))
+    thread.start()
+    thread.join()
+    assert result==[True] and not pool.in_use
+
+def test_brian_models_one_thread():
+    # Brian engine models are lent to one thread at a time, numpy engine
+    # models to any number
+    hrtfset = HRTFSet(6)
+    pool = ModelPool(builder=build)
+    acquired = {}
+    def acquire(engine):
+        model = pool.acquire('approximate', hrtfset, (8,), engine=engine)
+        acquired[engine].set()
+        pool.release(model)
+    model = pool.acquire('approximate', hrtfset, (8,), engine='brian')
+    # the same thread can hold several
+    pool.release(pool.acquire('approximate', hrtfset, (8,)))
+    threads = []
+    for engine in ['numpy', 'brian']:
+        acquired[engine] = threading.Event()
+        threads.append(threading.Thread(target=acquire, args=(engine,)))
+        threads[-1].start()
+    assert acquired['numpy'].wait(10)
+    assert not acquired['brian'].wait(0.2)
+    pool.release(model)
+    assert acquired['brian'].wait(10)
+    for thread in threads:
+        thread.join()
+    assert not pool.in_use
+
+@pytest.mark.parametrize('engine', ['numpy', 'brian'])
+def test_same_seed_same_counts(engine):
+    pytest.importorskip('brian')
+    from shared import whitenoise, Hz, kHz, ms
+    from recorders import windowed_count
+    from synthetic_hrtf import spherical_head_hrtfset, horizontal_coordinates
+    from approximate_filtering_model import ApproximateFilteringModel
+    hrtfset = spherical_head_hrtfset(horizontal_coordinates(6), hrir_length=128)
+    model = ApproximateFilteringModel(hrtfset, 300*Hz, 3*kHz, 8, engine=engine)
+    sound = whitenoise(50*ms)
+    count = model(sound, 2, report=None, seed=5)
+    assert count.sum()>0
+    # the result does not depend on the previous calls
+    model(sound, 3, report=None, seed=7)
+    model(sound, 3, report=None)
+    assert (model(sound, 2, report=None, seed=5)==count).all()
+    assert (model(sound, 2, report=None, seed=6)!=count).any()
+    # nor for the other ways of running the model
+    batch = model.run_batch([sound, sound], [2, 3], seed=5)
+    model(sound, 3, report=None, seed=7)
+    assert (model.run_batch([sound, sound], [2, 3], seed=5)==batch).all()
+    windows, _ = windowed_count(model, sound, 10*ms, index=2, seed=5)
+    model(sound, 3, report=None, seed=7)
+    assert (windowed_count(model, sound, 10*ms, index=2, seed=5)[0]==windows).all()
+    estimate = model.estimate(sound, 2, seed=5)
+    model(sound, 3, report=None, seed=7)
+    assert model.estimate(sound, 2, seed=5)==estimate
@@ -0,0 +1,175 @@
+'''
+Tests of the numpy engine, and of its counts against the Brian engine (run
+with pytest, the comparison with Brian is skipped if it is not installed).
+'''
+import pytest
+from numpy import array, arange, zeros, ones, linspace, corrcoef, random, sum
+from settings import samplerate_hz
+from model_equations import standard_filtergroup_eqs, standard_cd_eqs
+from numpy_engine import NumpyNetwork
+from time_windows import TimeWindows
+
+class Parameters(object):
+    # stand-in for Brian's Parameters, enough for NumpyNetwork
+    def __init__(self, **kwds):
+        self.__dict__.update(kwds)
+
+def _init_filtergroup(G, params):
+    G.v = params.Vr+(params.Vt-params.Vr)*random.rand(len(G))
+_init_filtergroup.uniform_v = lambda params: (params.Vr, params.Vt)
+
+def _init_cd(G, params):
+    G.v = random.rand(len(G))
+_init_cd.uniform_v = lambda params: (0, 1)
+
+# the standard models of models.py, with their values in SI units
+filtergroup_params = Parameters(Vr=-60e-3, Vt=-50e-3, El=-60e-3, R=0.2,
+                                tau=1e-3, dVt=0, mu=0, sigma=1e-3)
+filtergroup_model = {'eqs':standard_filtergroup_eqs,
+                     'parameters':filtergroup_params,
+                     'threshold':filtergroup_params.Vt,
+                     'reset':filtergroup_params.Vr,
+                     'refractory':5e-3,
+                     'init':_init_filtergroup}
+cd_model = {'eqs':standard_cd_eqs,
+            'parameters':Parameters(tau=1e-3, sigma=.1),
+            'threshold':1,
+            'reset':0,
+            'refractory':0,
+            'init':_init_cd,
+            'weight':.5}
+
+class ConstantInput(object):
+    # a cochlea with constant output, enough for NumpyNetwork
+    def __init__(self, nchannels, value=0.0):
+        self.nchannels = nchannels
+        self.samplerate = samplerate_hz
+        self.value = value
+    def buffer_init(self):
+        pass
+    def buffer_fetch(self, start, end):
+        return self.value*ones((end-start, self.nchannels))
+
+def constant_network(N=8, value=0.1):
+    # filter neurons driven above threshold (R*value is 20 mV), coincidence
+    # detector i receiving input from filter neurons i and i+1 with delays
+    # of 0 to 7 steps
+    pre_L = arange(N)
+    pre_R = (arange(N)+1)%N
+    delays = arange(N)%8/samplerate_hz
+    return NumpyNetwork(ConstantInput(N, value), filtergroup_model, cd_model,
+                        pre_L, pre_R, delays, zeros(N))
+
+def test_input_is_lost_at_reset():
+    # a coincidence detector that spikes in the step in which its input
+    # arrives is reset to 0 as in Brian, the input does not survive the reset
+    network = NumpyNetwork(ConstantInput(2), filtergroup_model, cd_model,
+                           [0], [1])
+    network.filter_noise = 0
+    network.cd_noise = 0
+    network.filtergroup.v = filtergroup_params.Vt+1
+    network.synchronygroup.v = 2
+    network.run(1/samplerate_hz)
+    assert network.counter.count[0]==1
+    assert network.synchronygroup.v[0]==0
+    # without a spike, the input is added to v
+    network.reinit()
+    network.filter_noise = network.cd_noise = 0
+    network.filtergroup.v = filtergroup_params.Vt+1
+    network.synchronygroup.v = 0
+    network.run(1/samplerate_hz)
+    assert network.counter.count[0]==0
+    assert abs(network.synchronygroup.v[0]-2*cd_model['weight'])<1e-12
+
+def test_only_standard_equations():
+    model = dict(cd_model, eqs='dv/dt = -v/tau : 1')
+    with pytest.raises(ValueError):
+        NumpyNetwork(ConstantInput(2), filtergroup_model, model, [0], [1])
+
+def test_random_state():
+    # the noise only depends on the random_state of the network
+    network = constant_network()
+    results = []
+    for seed in [1, 2, 1]:
+        network.reinit()
+        network.random_state = random.RandomState(seed)
+        network.run(0.02)
+        results.append((network.counter.count.copy(),
+                        network.synchronygroup.v.copy()))
+    assert results[0][0].sum()>0
+    assert (results[0][0]==results[2][0]).all()
+    assert (results[0][1]==results[2][1]).all()
+    assert (results[0][1]!=results[1][1]).any()
+
+def test_reinit_in_place():
+    network = constant_network()
+    arrays = [network.filtergroup.v, network.synchronygroup.v,
+              network.counter.count, network.history,
+              network.filter_spiking.next_allowed,
+              network.cd_spiking.last_spike]
+    network.run(0.01)
+    assert network.filter_spiking.next_allowed.any()
+    assert network.counter.nspikes>0
+    network.reinit()
+    assert network.t==0 and network.counter.nspikes==0
+    for x, y in zip(arrays, [network.filtergroup.v, network.synchronygroup.v,
+                             network.counter.count, network.history,
+                             network.filter_spiking.next_allowed,
+                             network.cd_spiking.last_spike]):
+        assert x is y
+    assert not network.history.any() and not network.counter.count.any()
+    assert not network.filtergroup.v.any()
+    assert not network.filter_spiking.next_allowed.any()
+
+def test_run_continues():
+    # running in several parts, not multiples of the buffer size, is the
+    # same as running in one go (without noise, which is drawn per chunk)
+    network = constant_network()
+    network.cochlea.value = linspace(0.06, 0.2, len(network.filtergroup))
+    states = []
+    for parts in [1, 3]:
+        network.reinit()
+        network.filter_noise = network.cd_noise = 0
+        for _ in range(parts):
+            network.run(0.02/parts)
+        network.run(0.02-network.t/samplerate_hz)
+        assert network.t==int(round(0.02*samplerate_hz))
+        states.append((network.filtergroup.v.copy(),
+                       network.synchronygroup.v.copy()))
+    assert (states[0][1]!=0).any()
+    assert (states[0][0]==states[1][0]).all()
+    assert (states[0][1]==states[1][1]).all()
+
+def test_monitors():
+    # the monitors see every spike of the coincidence detectors
+    network = constant_network()
+    windows = TimeWindows(len(network.synchronygroup), 10, 1)
+    network.monitors.append(windows)
+    network.run(0.01)
+    windows.advance(network.t)
+    counts, first = windows.counts()
+    assert first==0 and counts.shape[0]==network.t//10
+    assert (sum(counts, axis=0)==network.counter.count).all()
+
+def test_counts_match_brian():
+    pytest.importorskip('brian')
+    from shared import whitenoise, seed, Hz, kHz, ms
+    from synthetic_hrtf import spherical_head_hrtfset, horizontal_coordinates
+    from approximate_filtering_model import ApproximateFilteringModel
+    hrtfset = spherical_head_hrtfset(horizontal_coordinates(8), hrir_length=256)
+    cfmin, cfmax, cfN = 300*Hz, 3*kHz, 16
+    counts = {}
+    for engine in ['brian', 'numpy']:
+        model = ApproximateFilteringModel(hrtfset, cfmin, cfmax, cfN,
+                                          engine=engine)
+        seed(3)
+        counts[engine] = array([model(whitenoise(200*ms), 2, report=None)
+                                for _ in xrange(4)])
+    brian_total = sum(counts['brian'])
+    numpy_total = sum(counts['numpy'])
+    assert brian_total>0
+    assert abs(numpy_total-brian_total)<0.1*brian_total
+    # the profiles over locations agree
+    brian_profile = sum(counts['brian'], axis=(0, 1))
+    numpy_profile = sum(counts['numpy'], axis=(0, 1))
+    assert corrcoef(brian_profile, numpy_profile)[0, 1]>0.8
@@ -0,0 +1,77 @@
+'''
+Tests of the on-disk storage of the counts (run with pytest).
+'''
+import os
+import numpy
+import pytest
+from results import CountStore
+
+def test_append_get(tmpdir):
+    path = os.path.join(str(tmpdir), 'store')
+    store = CountStore(path, chunk_size=20)
+    counts = {}
+    for subject in [1002, 1003]:
+        for index in range(3):
+            counts[subject, index] = numpy.arange(12).reshape((3, 4))+index
+            store.append(counts[subject, index], subject, index, cfN=3)
+    # a count larger than a chunk gets its own
+    large = numpy.arange(30)
+    store.append(large, 1002, 0, sound=1)
+    assert len(store)==7 and (1002, 0, 1) in store and (1002, 5, 0) not in store
+    assert (store.get(1002, 0, 1)==large).all()
+    assert store.get(1002, 0).dtype==numpy.uint16
+    with pytest.raises(KeyError):
+        store.get(1004, 0)
+    store.close()
+    # another store reads the index
+    store = CountStore(path)
+    assert store.chunk_size==20 and len(store)==7
+    for (subject, index), count in counts.items():
+        assert (store.get(subject, index)==count).all()
+    records = store.find(subject=1003)
+    assert [r['index'] for r in records]==[0, 1, 2]
+    assert all(r['cfN']==3 for r in records)
+    for record, count in store.iter_counts(subject=1003):
+        assert (count==counts[1003, record['index']]).all()
+    store.close()
+
+def test_checks(tmpdir):
+    path = str(tmpdir)
+    store = CountStore(path)
+    with pytest.raises(ValueError):
+        store.append(numpy.array([70000]), 1002, 0)
+    with pytest.raises(ValueError):
+        store.append(numpy.array([-1]), 1002, 0)
+    with pytest.raises(ValueError):
+        store.append(numpy.array([0.5]), 1002, 0)
+    with pytest.raises(ValueError):
+        store.append(numpy.array([1]), 1002, 0, offset=3)
+    store.append(numpy.array([1.0, 2.0]), 1002, 0)
+    store.close()
+    with pytest.raises(ValueError):
+        CountStore(path, dtype='uint32')
+    with pytest.raises(ValueError):
+        CountStore(os.path.join(path, 'other'), dtype='int8')
+    store = CountStore(os.path.join(path, 'other'), dtype='uint32')
+    store.append(numpy.array([70000]), 1002, 0)
+    assert store.get(1002, 0)[0]==70000
+    store.close()
+
+def test_interrupted_append(tmpdir):
+    path = str(tmpdir)
+    store = CountStore(path)
+    store.append(numpy.arange(4), 1002, 0)
+    store.close()
+    # a partial line left by an interrupted writer is ignored, and
+    # overwritten by the next append
+    f = open(os.path.join(path, 'index.jsonl'), 'a')
+    f.write('{"subject": 1002, "ind')
+    f.close()
+    store = CountStore(path)
+    assert len(store)==1
+    store.append(numpy.arange(5), 1002, 1)
+    store.close()
+    store = CountStore(path)
+    assert len(store)==2
+    assert (store.get(1002, 1)==numpy.arange(5)).all()
+    store.close()
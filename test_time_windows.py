@@ -0,0 +1,58 @@
+'''
+Tests of the accumulation of spikes in sliding windows (run with pytest).
+'''
+from numpy import random, arange, zeros
+from time_windows import TimeWindows
+
+def _spikes(T, N):
+    return random.RandomState(0).rand(T, N)<0.3
+
+def _expected(spikes, hop_steps, window_hops):
+    # window k is the sum of the steps of the bins k to k+window_hops-1
+    num_windows = spikes.shape[0]//hop_steps-window_hops+1
+    return [spikes[k*hop_steps:(k+window_hops)*hop_steps].sum(axis=0)
+            for k in range(num_windows)]
+
+def test_windows():
+    spikes = _spikes(60, 3)
+    for as_indices in [False, True]:
+        windows = TimeWindows(3, 4, 3)
+        for step in range(spikes.shape[0]):
+            if as_indices:
+                windows.add(step, spikes[step].nonzero()[0])
+            else:
+                windows.add(step, spikes[step])
+        windows.advance(spikes.shape[0])
+        counts, first = windows.counts()
+        expected = _expected(spikes, 4, 3)
+        assert first==0 and counts.shape==(len(expected), 3)
+        for k, window in enumerate(expected):
+            assert (counts[k]==window).all()
+
+def test_steps_without_spikes():
+    # add is only called for some steps, advance completes the windows
+    windows = TimeWindows(2, 5, 2)
+    windows.add(3, arange(2))
+    windows.add(27, arange(1))
+    windows.advance(30)
+    counts, first = windows.counts()
+    expected = zeros((5, 2), dtype=int)
+    expected[0, :] = 1
+    expected[4, 0] = 1
+    assert (counts==expected).all()
+
+def test_max_windows():
+    spikes = _spikes(100, 2)
+    windows = TimeWindows(2, 2, 5, max_windows=7)
+    for step in range(spikes.shape[0]):
+        windows.add(step, spikes[step])
+    windows.advance(spikes.shape[0])
+    expected = _expected(spikes, 2, 5)
+    counts, first = windows.counts()
+    assert windows.num_windows==len(expected)
+    assert first==len(expected)-7 and counts.shape==(7, 2)
+    for k in range(7):
+        assert (counts[k]==expected[first+k]).all()
+    windows.reinit()
+    counts, first = windows.counts()
+    assert first==0 and counts.shape==(0, 2)
@@ -0,0 +1,67 @@
+'''
+Accumulation of spikes in sliding time windows, the part of the recorders of
+recorders.py which does not depend on the simulator: it is used by
+WindowedSpikeCounter with Brian and as a monitor of the numpy engine. Only
+numpy is imported here.
+'''
+from numpy import *
+
+__all__ = ['TimeWindows']
+
+class TimeWindows(object):
+    '''
+    Accumulates the spikes of N neurons in windows of window_hops bins of
+    hop_steps time steps each, window k covering the bins k to
+    k+window_hops-1. Call add(step, spikes) with the spikes (indices or a
+    boolean array) at each time step, and advance(step) at the end to
+    complete the windows before the given step.
+    '''
+    def __init__(self, N, hop_steps, window_hops, max_windows=None):
+        self.N = N
+        self.hop_steps = hop_steps
+        self.window_hops = window_hops
+        self.max_windows = max_windows
+        self.reinit()
+
+    def reinit(self):
+        self.bins = zeros((self.window_hops, self.N), dtype=int)
+        self.hop = 0
+        self.num_windows = 0
+        if self.max_windows is None:
+            self.windows = []
+        else:
+            self.windows = zeros((self.max_windows, self.N), dtype=int)
+
+    def advance(self, step):
+        hop = step//self.hop_steps
+        while self.hop<hop:
+            # the bin self.hop is complete, and with it the window ending there
+            if self.hop>=self.window_hops-1:
+                window = sum(self.bins, axis=0)
+                if self.max_windows is None:
+                    self.windows.append(window)
+                else:
+                    self.windows[self.num_windows%self.max_windows, :] = window
+                self.num_windows += 1
+            self.hop += 1
+            self.bins[self.hop%self.window_hops, :] = 0
+
+    def add(self, step, spikes):
+        self.advance(step)
+        if spikes.dtype==bool:
+            self.bins[self.hop%self.window_hops, :] += spikes
+        else:
+            self.bins[self.hop%self.window_hops, spikes] += 1
+
+    def counts(self):
+        '''
+        Returns (counts, first) where counts has shape (n, N) for the n
+        complete windows kept, in order, and first is the number of the first
+        of these windows.
+        '''
+        if self.max_windows is None:
+            return array(self.windows, dtype=int).reshape((self.num_windows, self.N)), 0
+        n = self.num_windows if self.num_windows<self.max_windows else self.max_windows
+        first = self.num_windows-n
+        I = arange(first, self.num_windows)%self.max_windows
+        return self.windows[I, :], first